@@ -0,0 +1,166 @@
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from datetime import datetime, timezone
+from os import makedirs, path
+
+import typer
+from typing_extensions import Annotated, List, Optional
+
+from benchmarks.synthetic import CorpusShape, write_corpus
+
+app = typer.Typer()
+
+RESULTS_DIR = path.join(path.dirname(path.realpath(__file__)), "results")
+ROOT_DIR = path.dirname(path.dirname(path.realpath(__file__)))
+
+# cold start of one backend: a fresh interpreter importing the CLI module and creating the backend
+STARTUP_SCRIPT = "import sigma_convert; sigma_convert.create_backend({backend!r}, {pipeline!r})"
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_backend(backend_name: str, directory: str) -> dict:
+    # runs in a fresh process so peak RSS belongs to this backend only
+    import sigma_convert
+
+    start = time.perf_counter()
+    backend = sigma_convert.create_backend(backend_name)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    paths = sigma_convert.parse_files(directory, True)
+    total = failed = 0
+    for _, _, error in sigma_convert.convert_rules(paths, backend):
+        total += 1
+        failed += error is not None
+    elapsed = time.perf_counter() - start
+    return {
+        "rules": total,
+        "failed": failed,
+        "setup_s": setup,
+        "convert_s": elapsed,
+        "rules_per_s": total / elapsed if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _cold_start(args: List[str], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for backend_name, current in results["backends"].items():
+        previous = baseline["backends"].get(backend_name)
+        if not previous:
+            continue
+        if current["rules_per_s"] < previous["rules_per_s"] * (1 - threshold):
+            regressions.append(f"{backend_name}: {current['rules_per_s']:.1f} rules/s, "
+                               f"baseline {previous['rules_per_s']:.1f}")
+        if current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{backend_name}: peak RSS {current['peak_rss_mb']:.1f} MB, "
+                               f"baseline {previous['peak_rss_mb']:.1f}")
+    return regressions
+
+
+@app.command()
+def generate(output: Annotated[str, typer.Argument(help="Folder to write the synthetic rules to")],
+             rules: Annotated[int, typer.Option(help="Number of rules")] = 1000,
+             selections: Annotated[int, typer.Option(help="Selections per rule")] = 2,
+             values: Annotated[int, typer.Option(help="Values per selection field")] = 4,
+             wildcard_share: Annotated[float, typer.Option(help="Share of wildcard values")] = 0.4,
+             regex_share: Annotated[float, typer.Option(help="Share of regex values")] = 0.05,
+             cidr_share: Annotated[float, typer.Option(help="Share of CIDR values")] = 0.05,
+             seed: Annotated[int, typer.Option(help="Random seed, the same seed gives the same corpus")] = 1):
+    shape = CorpusShape(rules, selections, values, wildcard_share, regex_share, cidr_share, seed)
+    count = write_corpus(shape, output)
+    print(f"{count} synthetic rules written to {output}")
+
+
+@app.command()
+def run(rules: Annotated[int, typer.Option(help="Number of rules")] = 1000,
+        selections: Annotated[int, typer.Option(help="Selections per rule")] = 2,
+        values: Annotated[int, typer.Option(help="Values per selection field")] = 4,
+        wildcard_share: Annotated[float, typer.Option(help="Share of wildcard values")] = 0.4,
+        regex_share: Annotated[float, typer.Option(help="Share of regex values")] = 0.05,
+        cidr_share: Annotated[float, typer.Option(help="Share of CIDR values")] = 0.05,
+        seed: Annotated[int, typer.Option(help="Random seed, the same seed gives the same corpus")] = 1,
+        backends: Annotated[Optional[List[str]], typer.Option("--backend", "-b",
+                                                              help="Backends to benchmark. Repeatable")] = None,
+        save: Annotated[Optional[str], typer.Option(help="Store the results under this name")] = None,
+        compare: Annotated[Optional[str], typer.Option(help="Compare against results stored under this name")] = None,
+        threshold: Annotated[float, typer.Option(help="Allowed slowdown (and peak RSS growth) before the "
+                                                      "comparison fails, as a fraction")] = 0.1):
+    shape = CorpusShape(rules, selections, values, wildcard_share, regex_share, cidr_share, seed)
+    results = {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "shape": asdict(shape),
+        "backends": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        write_corpus(shape, directory)
+        for backend_name in backends or ["splunk", "logrhythm"]:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                stats = executor.submit(_run_backend, backend_name, directory).result()
+            results["backends"][backend_name] = stats
+            print(f"{backend_name:<10} {stats['rules']} rules ({stats['failed']} failed) in "
+                  f"{stats['convert_s']:.2f}s, {stats['rules_per_s']:.1f} rules/s, "
+                  f"setup {stats['setup_s']:.2f}s, peak RSS {stats['peak_rss_mb']:.1f} MB")
+
+    if save:
+        makedirs(RESULTS_DIR, exist_ok=True)
+        with open(path.join(RESULTS_DIR, f"{save}.json"), "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved as {save}")
+
+    if compare:
+        with open(path.join(RESULTS_DIR, f"{compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("shape") != results["shape"]:
+            print(f"Warning: corpus shape differs from {compare}, results are not comparable")
+        regressions = _compare(results, baseline, threshold)
+        if regressions:
+            print(f"Regression against {compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise typer.Exit(code=1)
+        print(f"No regression against {compare} (threshold {threshold:.0%})")
+
+
+@app.command()
+def startup(backends: Annotated[Optional[List[str]], typer.Option("--backend", "-b",
+                                                                  help="Backends to measure. Repeatable")] = None,
+            pipeline: Annotated[str, typer.Option("--pipeline", "-p",
+                                                  help="Pipeline created with every backend")] = "",
+            repeat: Annotated[int, typer.Option(help="Cold starts per backend")] = 5):
+    """Cold start time of sigma_convert --help and of creating each backend in a fresh interpreter."""
+    print(f"{'startup':<12} {'min':>8} {'median':>8}  (ms, {repeat} runs)")
+    runs = [("--help", ["sigma_convert.py", "--help"])]
+    for backend_name in backends or ["splunk", "logrhythm"]:
+        runs.append((backend_name, ["-c", STARTUP_SCRIPT.format(backend=backend_name, pipeline=pipeline)]))
+    for name, args in runs:
+        times = _cold_start(args, repeat)
+        print(f"{name:<12} {min(times) * 1000:>8.0f} {statistics.median(times) * 1000:>8.0f}")
+
+
+if __name__ == "__main__":
+    app()
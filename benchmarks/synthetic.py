@@ -0,0 +1,103 @@
+import random
+import uuid
+from dataclasses import dataclass
+from os import makedirs, path
+from typing import Dict, Iterator, List, Tuple
+
+import yaml
+
+from custom_sigma.pipelines.logrhythm import windows
+
+NAMESPACE = uuid.UUID("9b0f4d7e-3c1a-4c55-a8a4-3e7d2b6f1c20")
+IP_FIELDS = ("DestinationIp", "SourceIp")
+
+
+@dataclass
+class CorpusShape:
+    """Scale and shape of a synthetic rule corpus. Shares are fractions of all generated values."""
+
+    rules: int = 1000
+    selections: int = 2
+    values: int = 4
+    wildcard_share: float = 0.4
+    regex_share: float = 0.05
+    cidr_share: float = 0.05
+    seed: int = 1
+
+
+def logsource_fields() -> List[Tuple[str, List[str]]]:
+    """(category, fields) of every log source mapped by lr_windows_v2, so rules convert with both backends."""
+    table = windows.windows_mappings()
+    categories = []
+    for position, entry in enumerate(table.entries):
+        category = entry["category"]
+        if not category or category.startswith("["):  # entries keyed by several categories in one string
+            continue
+        fields = [name for name in table.mapping(position) if " " not in name]
+        categories.append((category, fields))
+    return categories
+
+
+def _value(rng: random.Random, shape: CorpusShape, field: str) -> Tuple[str, str]:
+    """(modifier, value) for one detection value."""
+    word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 12)))
+    draw = rng.random()
+    if draw < shape.cidr_share:
+        return "|cidr", f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24"
+    draw -= shape.cidr_share
+    if draw < shape.regex_share:
+        return "|re", f"^{word}[0-9]{{2,4}}\\.(exe|dll)$"
+    draw -= shape.regex_share
+    if draw < shape.wildcard_share:
+        return rng.choice(("|contains", "|startswith", "|endswith")), f"\\{word}.exe"
+    return "", f"C:\\Windows\\System32\\{word}.exe"
+
+
+def generate_rule(rng: random.Random, shape: CorpusShape, index: int,
+                  sources: List[Tuple[str, List[str]]]) -> Dict:
+    category, fields = rng.choice(sources)
+    detection = {}
+    for number in range(shape.selections):
+        selection = {}
+        for _ in range(rng.randint(1, 3)):
+            field = rng.choice(fields)
+            values = {}
+            for _ in range(shape.values):
+                modifier, value = _value(rng, shape, field)
+                if modifier == "|cidr" and field not in IP_FIELDS:
+                    modifier, value = "|contains", value.replace("/", "_")
+                values.setdefault(modifier, []).append(value)
+            for modifier, items in values.items():
+                selection[f"{field}{modifier}"] = items
+        detection[f"selection_{number}"] = selection
+    detection["condition"] = rng.choice(("all of selection_*", "1 of selection_*"))
+    return {
+        "title": f"Synthetic {category} rule {index}",
+        "id": str(uuid.uuid5(NAMESPACE, f"{shape.seed}-{index}")),
+        "status": "test",
+        "description": f"Synthetic benchmark rule {index} for {category}",
+        "tags": ["attack.execution", "attack.t1059"],
+        "logsource": {"product": "windows", "category": category},
+        "detection": detection,
+        "level": rng.choice(("low", "medium", "high")),
+    }
+
+
+def generate_rules(shape: CorpusShape) -> Iterator[Tuple[str, Dict]]:
+    """Yield (relative path, rule dict). The same shape always produces the same corpus."""
+    rng = random.Random(shape.seed)
+    sources = logsource_fields()
+    for index in range(shape.rules):
+        rule = generate_rule(rng, shape, index, sources)
+        yield path.join(rule["logsource"]["category"], f"synthetic_{index:06d}.yml"), rule
+
+
+def write_corpus(shape: CorpusShape, directory: str) -> int:
+    count = 0
+    for relative_path, rule in generate_rules(shape):
+        destination = path.join(directory, relative_path)
+        makedirs(path.dirname(destination), exist_ok=True)
+        with open(destination, "w", encoding="utf-8") as f:
+            yaml.safe_dump(rule, f, sort_keys=False)
+        count += 1
+    return count
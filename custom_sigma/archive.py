@@ -0,0 +1,178 @@
+"""
+Rules read straight from .zip (memory mapped) and .tar.gz archives, addressed as <archive path>/<member name>.
+"""
+import mmap
+import re
+import zlib
+from abc import ABC, abstractmethod
+from fnmatch import fnmatch
+from functools import lru_cache
+from os import path, stat
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar.gz", ".tgz")
+RULE_EXTENSIONS = (".yml", ".yaml")
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+MEMBER_PATH = re.compile(r"(.+?(?:\.zip|\.tar\.gz|\.tgz))/(.+)", re.IGNORECASE)
+
+
+class RuleArchive(ABC):
+    """Rule members of an archive by name, opened once per process (see open_archive)."""
+
+    def __init__(self, file: str):
+        self.file = file
+        self.mtime_ns = stat(file).st_mtime_ns
+
+    @abstractmethod
+    def names(self) -> Iterable[str]:
+        ...
+
+    @abstractmethod
+    def size(self, name: str) -> int:
+        ...
+
+    @abstractmethod
+    def read(self, name: str) -> bytes:
+        ...
+
+
+class ZipRuleArchive(RuleArchive):
+    # the central directory is read once through the mapping, every rule is sliced out at its offset and
+    # inflated, so worker processes read the rules they are sent without seeking or locking a shared file
+
+    def __init__(self, file: str):
+        import zipfile
+
+        super().__init__(file)
+        with open(file, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise zipfile.BadZipFile(f"File is not a zip file: {file}")
+        # only the central directory is parsed by zipfile, members are read from the mapping
+        self._zip = zipfile.ZipFile(self._map)
+        self._members = {info.filename: info for info in self._zip.infolist() if not info.is_dir()}
+
+    def names(self) -> Iterable[str]:
+        return self._members
+
+    def size(self, name: str) -> int:
+        return self._member(name).file_size
+
+    def read(self, name: str) -> bytes:
+        import zipfile
+
+        info = self._member(name)
+        if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            # encrypted members and other compression methods are left to zipfile
+            with zipfile.ZipFile(self.file) as archive:
+                return archive.read(info)
+        header = self._map[info.header_offset:info.header_offset + LOCAL_HEADER_SIZE]
+        if len(header) != LOCAL_HEADER_SIZE or header[:4] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local file header of {name} in {self.file}")
+        start = (info.header_offset + LOCAL_HEADER_SIZE + int.from_bytes(header[26:28], "little")
+                 + int.from_bytes(header[28:30], "little"))
+        data = self._map[start:start + info.compress_size]
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 of {name} in {self.file}")
+        return data
+
+    def _member(self, name: str) -> "zipfile.ZipInfo":
+        try:
+            return self._members[name]
+        except KeyError:
+            raise FileNotFoundError(f"No such rule in {self.file}: {name}")
+
+
+class TarRuleArchive(RuleArchive):
+    # gzip streams cannot be read at an offset, the rule members are decompressed in one pass and kept in memory.
+    # Workers forked after rule discovery share them with the main process
+
+    def __init__(self, file: str):
+        import tarfile
+
+        super().__init__(file)
+        self._members: Dict[str, bytes] = {}
+        with tarfile.open(file, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(RULE_EXTENSIONS):
+                    name = member.name[2:] if member.name.startswith("./") else member.name
+                    self._members[name] = tar.extractfile(member).read()
+
+    def names(self) -> Iterable[str]:
+        return self._members
+
+    def size(self, name: str) -> int:
+        return len(self.read(name))
+
+    def read(self, name: str) -> bytes:
+        try:
+            return self._members[name]
+        except KeyError:
+            raise FileNotFoundError(f"No such rule in {self.file}: {name}")
+
+
+def is_archive(source: str) -> bool:
+    return source.lower().endswith(ARCHIVE_EXTENSIONS) and path.isfile(source)
+
+
+@lru_cache(maxsize=None)
+def open_archive(file: str) -> RuleArchive:
+    """Archive opened once per process."""
+    return ZipRuleArchive(file) if file.lower().endswith(".zip") else TarRuleArchive(file)
+
+
+@lru_cache(maxsize=4096)
+def _archive_of(prefix: str) -> bool:
+    return path.isfile(prefix)
+
+
+def split_member(file: str) -> Optional[Tuple[str, str]]:
+    """(archive, member name) of a rule inside an archive, None for any other path."""
+    match = MEMBER_PATH.match(file)
+    if match is None or not _archive_of(match.group(1)):
+        return None
+    return match.group(1), match.group(2)
+
+
+def read_file(file: str) -> bytes:
+    """Content of a rule file or of a rule inside an archive."""
+    member = split_member(file)
+    if member is None:
+        with open(file, "rb") as f:
+            return f.read()
+    archive, name = member
+    return open_archive(archive).read(name)
+
+
+def file_stat(file: str) -> Tuple[int, int]:
+    """(modification time in ns, size) of a rule file. Rules inside an archive carry the archive time."""
+    member = split_member(file)
+    if member is None:
+        st = stat(file)
+        return st.st_mtime_ns, st.st_size
+    archive = open_archive(member[0])
+    return archive.mtime_ns, archive.size(member[1])
+
+
+def _excluded(name: str, exclude) -> bool:
+    # like get_files, an excluded folder excludes everything below it
+    parts = name.split("/")
+    return any(fnmatch("/".join(parts[:end]), pattern) for end in range(1, len(parts) + 1) for pattern in exclude)
+
+
+def archive_files(archive: str, include=(), exclude=()) -> Iterator[str]:
+    """
+    Rules of an archive as <archive>/<member> paths, in get_files order (depth first, by name) and filtered like
+    get_files, so an archive converts to the same output as its extracted folder.
+    """
+    names = [name for name in open_archive(archive).names() if name.endswith(RULE_EXTENSIONS)]
+    for name in sorted(names, key=lambda name: name.split("/")):
+        if exclude and _excluded(name, exclude):
+            continue
+        if include and not any(fnmatch(name, pattern) for pattern in include):
+            continue
+        yield f"{archive}/{name}"
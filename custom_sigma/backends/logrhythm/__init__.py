@@ -1 +1,10 @@
-from .logrhythm_lucene import LogRhythmBackend
+__all__ = ["LogRhythmBackend"]
+
+
+def __getattr__(name):
+    # the backend is imported on first use, so modules that only need the optimizer (e.g. query splitting for
+    # other backends) do not load it
+    if name == "LogRhythmBackend":
+        from .logrhythm_lucene import LogRhythmBackend
+        return LogRhythmBackend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,8 +1,9 @@
+import json
 import re
-from typing import Iterable, ClassVar, Dict, List, Optional, Pattern, Tuple, Union, Any
+from typing import ClassVar, Dict, List, Optional, Pattern, Tuple, Union, Any
 
 from sigma.conversion.state import ConversionState
-from sigma.rule import SigmaRule, SigmaRuleTag
+from sigma.rule import SigmaRule
 from sigma.conversion.base import TextQueryBackend
 from sigma.conversion.deferred import DeferredQueryExpression
 from sigma.conditions import (
@@ -13,10 +14,12 @@ from sigma.conditions import (
     ConditionFieldEqualsValueExpression,
 )
 from sigma.types import SigmaCompareExpression, SigmaNull, SigmaFieldReference
-from sigma.data.mitre_attack import mitre_attack_tactics, mitre_attack_techniques
 from sigma.exceptions import SigmaFeatureNotSupportedByBackendError
 import sigma
 
+from .mitre import classify_tag, threat_entries
+from .optimizer import count_terms, optimize_condition
+
 
 class LogRhythmBackend(TextQueryBackend):
     """
@@ -32,6 +35,9 @@ class LogRhythmBackend(TextQueryBackend):
     # The name should match to finalize_output_<name>.
     formats: ClassVar[Dict[str, str]] = {
         "default": "Plain LogRhythm Lucene queries",
+        "threat_model": "Queries with the MITRE ATT&CK tactics and techniques of their rule as JSON lines, "
+                        "a JSON array for collections",
+        "ndjson": "One JSON line per query with rule metadata and ATT&CK IDs",
     }
     # Does the backend requires that a processing pipeline is provided?
     requires_pipeline: ClassVar[bool] = True
@@ -154,9 +160,13 @@ class LogRhythmBackend(TextQueryBackend):
         ),
         schedule_interval: int = 5,
         schedule_interval_unit: str = "m",
+        optimize: bool = True,
+        output_format: str = "default",
         **kwargs,
     ):
         super().__init__(processing_pipeline, collect_errors)
+        # like sigmaiq backends, unknown output formats fall back to the default format
+        self.output_format = output_format if output_format in self.formats else self.default_format
         self.index_names = index_names or [
             "apm-*-transaction*",
             "auditbeat-*",
@@ -177,6 +187,12 @@ class LogRhythmBackend(TextQueryBackend):
             "HIGH": 73,
             "CRITICAL": 99,
         }
+        # rewrite condition trees into smaller equivalent ones before generating queries
+        self.optimize = optimize
+        # value terms of all converted conditions before and after optimization
+        self.terms_before = 0
+        self.terms_after = 0
+        self._converting = False
 
     @staticmethod
     def _is_field_null_condition(cond: ConditionItem) -> bool:
@@ -184,6 +200,20 @@ class LogRhythmBackend(TextQueryBackend):
             cond.value, SigmaNull
         )
 
+    def convert_condition(self, cond: ConditionItem, state: ConversionState) -> Any:
+        """Optimize the condition tree once at its root, nested conditions are converted as usual."""
+        if self._converting or not self.optimize:
+            return super().convert_condition(cond, state)
+
+        self._converting = True
+        try:
+            self.terms_before += count_terms(cond)
+            cond = optimize_condition(cond)
+            self.terms_after += count_terms(cond)
+            return super().convert_condition(cond, state)
+        finally:
+            self._converting = False
+
     def convert_condition_field_eq_field(
         self, cond: SigmaFieldReference, state: ConversionState
     ) -> Any:
@@ -246,68 +276,49 @@ class LogRhythmBackend(TextQueryBackend):
 
         return super().compare_precedence(outer, inner)
 
-    def finalize_output_threat_model(self, tags: List[SigmaRuleTag]) -> Iterable[Dict]:
-        attack_tags = [t for t in tags if t.namespace == "attack"]
-        if not len(attack_tags) >= 2:
-            return []
+    def convert_rule(self, rule: SigmaRule, output_format: Optional[str] = None) -> List[Any]:
+        """Convert to the output format chosen when the backend was created unless another one is given."""
+        return super().convert_rule(rule, output_format or self.output_format)
 
-        techniques = [
-            tag.name.upper() for tag in attack_tags if re.match(r"[tT]\d{4}", tag.name)
-        ]
-        tactics = [
-            tag.name.lower()
-            for tag in attack_tags
-            if not re.match(r"[tT]\d{4}", tag.name)
-        ]
+    @staticmethod
+    def _rule_record(rule: SigmaRule, query: str) -> Dict[str, Any]:
+        return {
+            "title": rule.title,
+            "id": str(rule.id) if rule.id else None,
+            "level": rule.level.name.lower() if rule.level else None,
+            "query": query,
+        }
 
-        for tactic, technique in zip(tactics, techniques):
-            if (
-                not tactic or not technique
-            ):  # Only add threat if tactic and technique is known
-                continue
-
-            try:
-                if "." in technique:  # Contains reference to Mitre Att&ck subtechnique
-                    sub_technique = technique
-                    technique = technique[0:5]
-                    sub_technique_name = mitre_attack_techniques[sub_technique]
-
-                    sub_techniques = [
-                        {
-                            "id": sub_technique,
-                            "reference": f"https://attack.mitre.org/techniques/{sub_technique.replace('.', '/')}",
-                            "name": sub_technique_name,
-                        }
-                    ]
-                else:
-                    sub_techniques = []
-
-                tactic_id = [
-                    id
-                    for (id, name) in mitre_attack_tactics.items()
-                    if name == tactic.replace("_", "-")
-                ][0]
-                technique_name = mitre_attack_techniques[technique]
-            except (IndexError, KeyError):
-                # Occurs when Sigma Mitre Att&ck list is out of date
-                continue
-
-            yield {
-                "tactic": {
-                    "id": tactic_id,
-                    "reference": f"https://attack.mitre.org/tactics/{tactic_id}",
-                    "name": tactic.title().replace("_", " "),
-                },
-                "framework": "MITRE ATT&CK",
-                "technique": [
-                    {
-                        "id": technique,
-                        "reference": f"https://attack.mitre.org/techniques/{technique}",
-                        "name": technique_name,
-                        "subtechnique": sub_techniques,
-                    }
-                ],
-            }
-
-        for tag in attack_tags:
-            tags.remove(tag)
+    def finalize_query_threat_model(
+        self, rule: SigmaRule, query: str, index: int, state: ConversionState
+    ) -> str:
+        """
+        Query with the ATT&CK tactics and techniques of the rule tags, as a JSON object on one line. Rules converted
+        one by one are written as JSON lines, only collections are finalized into a JSON array.
+        """
+        record = self._rule_record(rule, query)
+        record["threat"] = list(threat_entries(tuple(tag.name for tag in rule.tags if tag.namespace == "attack")))
+        return json.dumps(record)
+
+    def finalize_output_threat_model(self, queries: List[str]) -> str:
+        """JSON array of the threat model objects of a collection."""
+        return "[" + ",\n".join(queries) + "]"
+
+    def finalize_query_ndjson(
+        self, rule: SigmaRule, query: str, index: int, state: ConversionState
+    ) -> str:
+        """Query with the rule metadata and ATT&CK tactic and technique IDs, as one JSON line."""
+        record = self._rule_record(rule, query)
+        record["status"] = rule.status.name.lower() if rule.status else None
+        record["tags"] = [str(tag) for tag in rule.tags]
+        tactics, techniques = [], []
+        for tag in rule.tags:
+            classified = classify_tag(tag.name) if tag.namespace == "attack" else None
+            if classified:
+                (tactics if classified[0] == "tactic" else techniques).append(classified[1])
+        record["tactics"] = tactics
+        record["techniques"] = techniques
+        return json.dumps(record)
+
+    def finalize_output_ndjson(self, queries: List[str]) -> List[str]:
+        return queries
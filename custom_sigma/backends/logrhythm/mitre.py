@@ -0,0 +1,101 @@
+"""
+MITRE ATT&CK lookups for rule tags, indexed once per process from the tables shipped with pySigma.
+
+Tags are classified with one precompiled pattern and the threat entries of a tag combination are memoized, so
+enriching a batch of rules mostly costs dictionary lookups.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sigma.data.mitre_attack import (
+    mitre_attack_tactics,
+    mitre_attack_techniques,
+    mitre_attack_techniques_tactics_mapping,
+)
+
+TECHNIQUE_TAG = re.compile(r"t\d{4}(?:\.\d{3})?", re.IGNORECASE)
+
+
+class MitreIndex(NamedTuple):
+    tactic_ids: Dict[str, str]  # tactic name (e.g. defense-evasion) -> tactic ID
+    tactic_names: Dict[str, str]  # tactic ID -> tactic name
+    techniques: Dict[str, str]  # technique or subtechnique ID -> name
+    technique_tactics: Dict[str, List[str]]  # technique ID -> names of its tactics
+
+
+@lru_cache(maxsize=None)
+def mitre_index() -> MitreIndex:
+    return MitreIndex(
+        tactic_ids={name: tactic_id for tactic_id, name in mitre_attack_tactics.items()},
+        tactic_names=dict(mitre_attack_tactics),
+        techniques=dict(mitre_attack_techniques),
+        technique_tactics=dict(mitre_attack_techniques_tactics_mapping),
+    )
+
+
+@lru_cache(maxsize=4096)
+def classify_tag(name: str) -> Optional[Tuple[str, str]]:
+    """("technique", ID) or ("tactic", ID) for a known attack tag name, None for anything else."""
+    index = mitre_index()
+    if TECHNIQUE_TAG.fullmatch(name):
+        technique = name.upper()
+        return ("technique", technique) if technique in index.techniques else None
+    tactic_id = index.tactic_ids.get(name.lower().replace("_", "-"))
+    return ("tactic", tactic_id) if tactic_id else None
+
+
+def _technique(technique_id: str, index: MitreIndex) -> Dict:
+    return {
+        "id": technique_id,
+        "reference": f"https://attack.mitre.org/techniques/{technique_id.replace('.', '/')}",
+        "name": index.techniques[technique_id],
+    }
+
+
+@lru_cache(maxsize=4096)
+def threat_entries(tag_names: Tuple[str, ...]) -> Tuple[Dict, ...]:
+    """
+    Threat entries (tactic with its techniques and subtechniques) of the attack tags of a rule. Techniques are
+    listed under the tagged tactics they belong to, techniques of untagged tactics under their first tactic.
+    The result is shared between rules with the same tags and must not be modified.
+    """
+    index = mitre_index()
+    tactics: List[str] = []
+    techniques: List[str] = []
+    for name in tag_names:
+        classified = classify_tag(name)
+        if classified is None:
+            continue
+        kind, item_id = classified
+        items = tactics if kind == "tactic" else techniques
+        if item_id not in items:
+            items.append(item_id)
+
+    grouped: Dict[str, Dict[str, List[str]]] = {tactic_id: {} for tactic_id in tactics}
+    for technique_id in techniques:
+        parent = technique_id.split(".")[0]
+        tactic_ids = [index.tactic_ids[name] for name in index.technique_tactics.get(parent, [])
+                      if name in index.tactic_ids]
+        tagged = [tactic_id for tactic_id in tactic_ids if tactic_id in grouped]
+        for tactic_id in tagged or tactic_ids[:1]:
+            subtechniques = grouped.setdefault(tactic_id, {}).setdefault(parent, [])
+            if technique_id != parent and technique_id not in subtechniques:
+                subtechniques.append(technique_id)
+
+    return tuple(
+        {
+            "tactic": {
+                "id": tactic_id,
+                "reference": f"https://attack.mitre.org/tactics/{tactic_id}",
+                "name": index.tactic_names[tactic_id].title().replace("-", " "),
+            },
+            "framework": "MITRE ATT&CK",
+            "technique": [
+                dict(_technique(parent, index), subtechnique=[_technique(sub, index) for sub in subtechniques])
+                for parent, subtechniques in grouped[tactic_id].items()
+                if parent in index.techniques
+            ],
+        }
+        for tactic_id in grouped
+    )
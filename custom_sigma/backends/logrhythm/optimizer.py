@@ -0,0 +1,163 @@
+"""
+Equivalence preserving rewrites of pySigma condition trees, applied before query text generation:
+
+* nested AND/OR of the same kind are flattened, single argument groups are replaced by their argument
+* identical arguments of an AND/OR are removed
+* values of the same field that are spread over several OR branches are grouped, so the backend emits
+  one field:(a OR b) in-expression
+* OR-ed string values of a field that are covered by a broader wildcard value of the same field are dropped
+
+Only the last rewrite looks at values. A value is dropped when every string it matches is also matched by the
+broader value, checked on literal (case sensitive) text, which keeps it sound for case insensitive SIEMs too.
+"""
+from typing import List, Optional, Tuple, Union
+
+from sigma.conditions import (
+    ConditionItem,
+    ConditionAND,
+    ConditionOR,
+    ConditionNOT,
+    ConditionFieldEqualsValueExpression,
+    ConditionValueExpression,
+)
+from sigma.types import SigmaExpansion, SigmaNumber, SigmaString, SpecialChars
+
+Condition = Union[ConditionItem, ConditionFieldEqualsValueExpression, ConditionValueExpression]
+
+# maximum number of value comparisons per OR when looking for covered wildcard values, larger lists are kept as is
+SUBSUMPTION_LIMIT = 250_000
+
+
+def count_terms(cond: Condition) -> int:
+    """Number of value terms in a condition tree, expansions count each of their values."""
+    if isinstance(cond, (ConditionFieldEqualsValueExpression, ConditionValueExpression)):
+        return len(cond.value.values) if isinstance(cond.value, SigmaExpansion) else 1
+    return sum(count_terms(arg) for arg in cond.args)
+
+
+def _key(cond: Condition) -> Tuple:
+    """Structural identity of a condition, used to find duplicates."""
+    if isinstance(cond, ConditionFieldEqualsValueExpression):
+        return "eq", cond.field, type(cond.value).__name__, repr(cond.value)
+    if isinstance(cond, ConditionValueExpression):
+        return "value", type(cond.value).__name__, repr(cond.value)
+    return (type(cond).__name__,) + tuple(_key(arg) for arg in cond.args)
+
+
+def _plain_parts(value: SigmaString) -> Optional[List[Union[str, SpecialChars]]]:
+    """String and wildcard parts of a value, None if it contains anything else (e.g. placeholders)."""
+    if type(value) is not SigmaString:  # cased strings and other subclasses are left alone
+        return None
+    parts = []
+    for part in value.s:
+        if isinstance(part, str) or part in (SpecialChars.WILDCARD_MULTI, SpecialChars.WILDCARD_SINGLE):
+            parts.append(part)
+        else:
+            return None
+    return parts
+
+
+def _pattern(parts: List[Union[str, SpecialChars]]) -> Optional[Tuple[str, str]]:
+    """
+    Classify a value as ("contains", x) for *x*, ("startswith", x) for x*, ("endswith", x) for *x,
+    None for anything else.
+    """
+    multi = SpecialChars.WILDCARD_MULTI
+    if len(parts) == 3 and parts[0] == multi and parts[2] == multi and isinstance(parts[1], str):
+        return "contains", parts[1]
+    if len(parts) == 2 and isinstance(parts[0], str) and parts[1] == multi:
+        return "startswith", parts[0]
+    if len(parts) == 2 and parts[0] == multi and isinstance(parts[1], str):
+        return "endswith", parts[1]
+    return None
+
+
+def _subsumes(broad: List, narrow: List) -> bool:
+    """True if every string matched by narrow is matched by broad."""
+    pattern = _pattern(broad)
+    if pattern is None or not pattern[1] or broad == narrow:
+        return False
+    kind, text = pattern
+    if kind == "contains":
+        # any match of narrow contains each of its literal segments
+        return any(isinstance(part, str) and text in part for part in narrow)
+    if kind == "startswith":
+        return isinstance(narrow[0], str) and narrow[0].startswith(text)
+    return isinstance(narrow[-1], str) and narrow[-1].endswith(text)
+
+
+def _drop_subsumed(args: List[Condition]) -> List[Condition]:
+    parts = [
+        _plain_parts(arg.value) if isinstance(arg, ConditionFieldEqualsValueExpression) else None
+        for arg in args
+    ]
+    # only wildcard values of the *x*, x* and *x forms can cover others
+    broad = {}
+    for index, arg in enumerate(args):
+        if parts[index] is not None and _pattern(parts[index]) is not None:
+            broad.setdefault(arg.field, []).append(index)
+
+    kept = []
+    for index, arg in enumerate(args):
+        candidates = broad.get(arg.field, ()) if parts[index] is not None else ()
+        if len(candidates) * len(args) <= SUBSUMPTION_LIMIT and any(
+            other != index and _subsumes(parts[other], parts[index]) for other in candidates
+        ):
+            continue
+        kept.append(arg)
+    return kept
+
+
+def _groupable(cond: Condition) -> bool:
+    # the values pySigma turns into in-expressions
+    return isinstance(cond, ConditionFieldEqualsValueExpression) and isinstance(cond.value, (SigmaString, SigmaNumber))
+
+
+def _group_fields(cond: ConditionOR, args: List[Condition]) -> List[Condition]:
+    fields = {}
+    for arg in args:
+        if _groupable(arg):
+            fields.setdefault(arg.field, []).append(arg)
+    if all(len(values) < 2 for values in fields.values()) or len(fields) == 1 and len(args) == len(
+            next(iter(fields.values()))):
+        return args
+
+    grouped = []
+    emitted = set()
+    for arg in args:
+        if not _groupable(arg) or len(fields[arg.field]) < 2:
+            grouped.append(arg)
+        elif arg.field not in emitted:
+            emitted.add(arg.field)
+            grouped.append(_link(ConditionOR(fields[arg.field], cond.source)))
+    return grouped
+
+
+def _link(cond: ConditionItem) -> ConditionItem:
+    for arg in cond.args:
+        arg.parent = cond
+    return cond
+
+
+def optimize_condition(cond: Condition) -> Condition:
+    """Return an equivalent, smaller condition tree. Groups are rebuilt, leaves are shared with the given tree."""
+    if isinstance(cond, ConditionNOT):
+        return _link(ConditionNOT([optimize_condition(cond.args[0])], cond.source))
+    if not isinstance(cond, (ConditionAND, ConditionOR)):
+        return cond
+
+    # flatten nested groups of the same kind and drop duplicates, keeping the first occurrence
+    args = []
+    seen = set()
+    for arg in (optimize_condition(arg) for arg in cond.args):
+        for item in (arg.args if type(arg) is type(cond) else [arg]):
+            key = _key(item)
+            if key not in seen:
+                seen.add(key)
+                args.append(item)
+
+    if isinstance(cond, ConditionOR):
+        args = _group_fields(cond, _drop_subsumed(args))
+    if len(args) == 1:
+        return args[0]
+    return _link(type(cond)(args, cond.source))
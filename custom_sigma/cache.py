@@ -0,0 +1,184 @@
+import dataclasses
+import hashlib
+import sqlite3
+import time
+from importlib.metadata import version, PackageNotFoundError
+from os import makedirs, path
+from typing import Any, Dict, List, Optional
+
+from custom_sigma.archive import read_file
+
+# bump when the layout of the cache database or its keys change
+CACHE_FORMAT = 4
+
+
+def _package_version(name: str) -> str:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "none"
+
+
+def _canonical(obj: Any) -> str:
+    """
+    Stable textual form of pipeline objects. Plain repr() is not usable as a fingerprint: sets are
+    ordered by hash seed and some transformations carry random names that do not affect the output.
+    """
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        fields = ", ".join(
+            f"{f.name}={_canonical(getattr(obj, f.name))}"
+            for f in dataclasses.fields(obj)
+            if f.init and f.compare
+        )
+        return f"{type(obj).__qualname__}({fields})"
+    if isinstance(obj, dict):
+        return "{" + ", ".join(f"{_canonical(k)}: {_canonical(v)}" for k, v in obj.items()) + "}"
+    if isinstance(obj, (list, tuple)):
+        return "[" + ", ".join(_canonical(item) for item in obj) + "]"
+    if isinstance(obj, (set, frozenset)):
+        return "{" + ", ".join(sorted(_canonical(item) for item in obj)) + "}"
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return repr(obj)
+    if callable(obj):
+        return getattr(obj, "__qualname__", type(obj).__qualname__)
+    if hasattr(obj, "pattern"):  # compiled regular expressions
+        return f"re({obj.pattern!r})"
+    return type(obj).__qualname__
+
+
+def pipeline_fingerprint(pipeline) -> str:
+    """Hash of the processing items of a pipeline, empty pipelines hash the same."""
+    items = getattr(pipeline, "items", None) or []
+    postprocessing = getattr(pipeline, "postprocessing_items", None) or []
+    finalizers = getattr(pipeline, "finalizers", None) or []
+    return hashlib.sha256(_canonical([items, postprocessing, finalizers]).encode("utf-8")).hexdigest()
+
+
+def environment_fingerprint() -> str:
+    """Hash of the cache format and the sigma package versions."""
+    text = _canonical([CACHE_FORMAT, _package_version("pysigma"), _package_version("sigmaiq")])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def backend_fingerprint(backend) -> str:
+    """Hash of the backend class and its attributes (tokens, expressions, escaping)."""
+    attributes = {}
+    for cls in reversed(type(backend).__mro__):
+        for name, value in vars(cls).items():
+            if name.startswith("__") or callable(value) or isinstance(value, (staticmethod, classmethod, property)):
+                continue
+            attributes[name] = value
+    text = _canonical([type(backend).__module__, type(backend).__qualname__, attributes])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ConversionCache:
+    """
+    On-disk cache of converted queries keyed by the hash of the rule file content, the backend name and
+    fingerprint, the output format, the pipeline fingerprint and the query limits. The whole cache is dropped
+    when the pySigma/sigmaiq versions change. Entries are evicted least recently used first once the stored
+    queries exceed max_size bytes.
+    """
+
+    def __init__(self, directory: str, backend, backend_name: str, output_format: str,
+                 max_size: int = 64 * 1024 * 1024, connection: Optional[sqlite3.Connection] = None):
+        self.max_size = max_size
+        self.prefix = "\0".join([
+            backend_name.lower(),
+            output_format,
+            backend_fingerprint(backend),
+            pipeline_fingerprint(getattr(backend, "processing_pipeline", None)),
+            repr(getattr(backend, "optimize", None)),
+            repr(getattr(backend, "query_limits", None)),
+        ])
+        self.hits = 0
+        self.misses = 0
+        self._used: Dict[str, float] = {}
+        self._owns_db = connection is None
+        if connection is not None:
+            self._db = connection
+            return
+        makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path.join(directory, "conversions.sqlite"))
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, query TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._invalidate_on_change(environment_fingerprint())
+
+    def _invalidate_on_change(self, fingerprint: str):
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'environment'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('environment', ?)",
+                             (fingerprint,))
+            self._db.commit()
+
+    def share(self, backend, backend_name: str, output_format: str) -> "ConversionCache":
+        """
+        Cache of another backend using the same database connection, so several conversion targets of one
+        run can write entries without waiting for each other to commit.
+        """
+        return ConversionCache("", backend, backend_name, output_format, self.max_size, connection=self._db)
+
+    def key(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        return hashlib.sha256(f"{self.prefix}\0{digest}".encode("utf-8")).hexdigest()
+
+    def key_for_file(self, file: str) -> Optional[str]:
+        try:
+            return self.key(read_file(file))
+        except OSError:
+            return None
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        row = self._db.execute("SELECT query FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = time.time()
+        return row[0]
+
+    def put(self, key: Optional[str], query: str):
+        if key is None or not isinstance(query, str):
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (key, query, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, query, len(query.encode("utf-8")), time.time()),
+        )
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # drop the least recently used entries until the cache is back under 90% of its limit
+        target = total - int(self.max_size * 0.9)
+        keys: List[str] = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            keys.append(key)
+            target -= size
+            if target <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in keys])
+
+    def clear(self):
+        self._db.execute("DELETE FROM entries")
+        self._db.commit()
+
+    def flush(self):
+        self._db.executemany(
+            "UPDATE entries SET last_used = ? WHERE key = ?",
+            [(used, key) for key, used in self._used.items()],
+        )
+        self._used.clear()
+        self._evict()
+        self._db.commit()
+
+    def close(self):
+        self.flush()
+        if self._owns_db:
+            self._db.close()
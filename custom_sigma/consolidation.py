@@ -0,0 +1,126 @@
+"""
+Consolidation of converted Splunk queries into one scheduled search per logsource.
+
+Every rule converted on its own becomes a scheduled search scanning the same source and event codes as the other
+rules of its logsource. Consolidated, the queries of a logsource are OR-ed into one search, so the data is read
+once per interval, and every matching event is tagged with the ids of the rules it matched through searchmatch()
+on the original query of each rule:
+
+    (query 1) OR (query 2)
+    | eval sigma_id=mvdedup(mvappend(if(searchmatch("query 1"), "<id 1>", null()), ...))
+    | where isnotnull(sigma_id)
+    | mvexpand sigma_id
+    | eval sigma_rule=case(sigma_id=="<id 1>", "Rule 1", ...), sigma_level=case(...)
+
+Rules are tagged by id, as titles are not unique. Rules without an id are tagged with their title, and rules
+sharing an id with a rule added before them with "<id> #2", "<id> #3", ...
+
+Queries with a search pipeline (deferred regular expression or CIDR matching, tables of fields) cannot be a branch
+of a combined search and stay scheduled searches of their own, as do rules alone in their logsource.
+"""
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+# quoted strings are skipped, a pipe outside of them starts a search pipeline
+PIPE = re.compile(r'"(?:\\.|[^"\\])*"|(\|)')
+METADATA_FIELDS = (("sigma_rule", "title"), ("sigma_level", "level"))
+
+
+class RuleSearch(NamedTuple):
+    name: str  # stanza name when the query stays a search of its own
+    title: str
+    id: str
+    level: str
+    description: str
+    query: str
+    key: str  # sigma_id of the events matching the rule in a combined search, unique per rule
+
+
+def has_pipeline(query: str) -> bool:
+    return any(match.group(1) for match in PIPE.finditer(query))
+
+
+def eval_string(text: str) -> str:
+    """SPL eval string literal of text."""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def stanza(name: str, settings: Dict[str, str]) -> str:
+    """savedsearches.conf stanza, formatted like the savedsearches output of the Splunk backend."""
+    clean_name = name.translate({ord(c): None for c in "[]"})
+    return f"\n[{clean_name}]" + "".join(f"\n{key} = " + " \\\n".join(value.split("\n"))
+                                        for key, value in settings.items())
+
+
+def logsource_key(rule: Dict) -> Tuple[str, ...]:
+    logsource = rule.get("logsource") or {}
+    return tuple(str(logsource[name]) for name in ("product", "category", "service") if logsource.get(name))
+
+
+def combined_search(searches: List[RuleSearch]) -> str:
+    branches = " OR ".join(f"({search.query})" for search in searches)
+    tags = ", ".join(f"if(searchmatch({eval_string(search.query)}), {eval_string(search.key)}, null())"
+                     for search in searches)
+    lines = [branches,
+             f"| eval sigma_id=mvdedup(mvappend({tags}))",
+             "| where isnotnull(sigma_id)",
+             "| mvexpand sigma_id"]
+    # the parts of a split rule share their key and metadata
+    rules = list({search.key: search for search in searches}.values())
+    metadata = ", ".join(
+        f"{field}=case(" + ", ".join(f"sigma_id=={eval_string(search.key)}, {eval_string(getattr(search, name))}"
+                                     for search in rules) + ")"
+        for field, name in METADATA_FIELDS)
+    lines.append(f"| eval {metadata}")
+    return "\n".join(lines)
+
+
+class SearchConsolidator:
+    """
+    Collects converted rules by logsource and emits their savedsearches.conf stanzas, one combined search per
+    group_size rules of a logsource. Groups and the rules in them keep the order they were added in, so
+    consolidating an unchanged rule set gives the same stanzas.
+    """
+
+    def __init__(self, group_size: int = 50):
+        self.group_size = max(group_size, 1)
+        self.groups: Dict[Tuple[str, ...], List[RuleSearch]] = {}
+        self.rules = 0
+        self.keys: Dict[str, int] = {}
+
+    def add(self, rule: Dict, query: str):
+        """Add a rule dict with its converted query, split queries are added as one branch per line."""
+        self.rules += 1
+        group = self.groups.setdefault(logsource_key(rule), [])
+        title = str(rule.get("title") or "")
+        rule_id = str(rule.get("id") or "")
+        key = rule_id or title
+        self.keys[key] = self.keys.get(key, 0) + 1
+        if self.keys[key] > 1:
+            key = f"{key} #{self.keys[key]}"
+        parts = query.split("\n")
+        for number, part in enumerate(parts, 1):
+            group.append(RuleSearch(f"{title} (part {number} of {len(parts)})" if len(parts) > 1 else title, title,
+                                    rule_id, str(rule.get("level") or ""),
+                                    str(rule.get("description") or "").strip(), part, key))
+
+    def stanzas(self) -> List[str]:
+        stanzas = []
+        for key, searches in self.groups.items():
+            combinable = [search for search in searches if not has_pipeline(search.query)]
+            if len(combinable) < 2:
+                combinable = []
+            chunks = [combinable[start:start + self.group_size]
+                      for start in range(0, len(combinable), self.group_size)]
+            name = "Sigma " + (" ".join(key) if key else "any logsource")
+            for number, chunk in enumerate(chunks, 1):
+                titles = [search.title for search in {search.key: search for search in chunk}.values()]
+                stanzas.append(stanza(
+                    f"{name} (part {number} of {len(chunks)})" if len(chunks) > 1 else name,
+                    {"description": f"Consolidated search of {len(titles)} rules: " + ", ".join(titles),
+                     "search": combined_search(chunk)}))
+            combined = set(map(id, combinable))
+            stanzas.extend(stanza(search.name, {"description": search.description, "search": search.query})
+                           for search in searches if id(search) not in combined)
+        return stanzas
+
@@ -0,0 +1,191 @@
+"""
+Static execution cost estimate of converted Splunk and LogRhythm queries.
+
+Queries are tokenized, not parsed: quoted strings, Lucene field:/regex/ terms, groups, IN lists and the regex
+commands of a search pipeline are recognized, everything else is a term. The score adds up weighted counts of
+what makes SIEM searches slow and doubles for queries that are not bound to a log source or event ID, since
+those scan every event of the search window.
+"""
+import json
+import re
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+# savedsearches.conf stanzas are scored on their search, not their description
+SEARCH_SETTING = re.compile(r"^search\s*=\s*(.*(?:\\\n.*)*)", re.MULTILINE)
+TOKEN = re.compile(r"""
+    (?P<quoted>"(?:\\.|[^"\\])*")
+  | (?P<regex>(?:\\.|[^\s()":/|,])+:/(?:\\.|[^/\\])*/)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<pipe>\|)
+  | (?P<comma>,)
+  | (?P<word>(?:\\.|[^\s()",|])+)
+""", re.VERBOSE)
+# terms on these fields limit the events a query has to look at (Splunk source/EventCode, LogRhythm vendorMessageId)
+BOUND_FIELDS = frozenset({"index", "source", "sourcetype", "eventcode", "eventid", "vendormessageid",
+                          "logsourcetype", "logsource"})
+# search pipeline commands whose quoted arguments are regular expressions
+REGEX_COMMANDS = frozenset({"regex", "rex"})
+
+WEIGHTS = {
+    "terms": 1.0,  # every compared value
+    "leading_wildcards": 10.0,  # *value cannot use the term index
+    "regexes": 15.0,  # every regular expression, plus its complexity
+    "regex_complexity": 2.0,
+    "depth": 5.0,  # per group nesting level beyond the second
+    "negations": 3.0,
+}
+UNBOUND_FACTOR = 2.0
+
+
+@dataclass
+class QueryCost:
+    terms: int = 0
+    leading_wildcards: int = 0
+    regexes: int = 0
+    regex_complexity: int = 0
+    largest_list: int = 0
+    depth: int = 0
+    negations: int = 0
+    bound: bool = False
+    score: float = 0.0
+
+
+def regex_complexity(pattern: str) -> int:
+    """Rough backtracking cost of a regular expression: unanchored starts, unbounded repeats, alternations, groups."""
+    complexity = 0 if pattern.startswith("^") else 3
+    complexity += 2 * len(re.findall(r"\.[*+]", pattern))
+    complexity += len(re.findall(r"(?<!\\)(?:[*+]|\{\d*,\})", pattern))
+    complexity += len(re.findall(r"(?<!\\)\|", pattern))
+    complexity += len(re.findall(r"(?<!\\)\((?!\?:)", pattern))
+    complexity += 5 * len(re.findall(r"\\\d", pattern))
+    return complexity
+
+
+def _split_term(word: str) -> Tuple[Optional[str], str]:
+    # field and value of field=value, field!=value and field:value terms, the colon may be escaped in values
+    match = re.match(r"((?:\\.|[^=:!<>\\])+?)(?:!?=|(?<!\\):)(.*)", word)
+    if match is None:
+        return None, word
+    return match.group(1), match.group(2)
+
+
+def analyze_query(query: str) -> QueryCost:
+    """Cost estimate of one converted query."""
+    stanza = SEARCH_SETTING.search(query)
+    if stanza:
+        query = stanza.group(1)
+    tokens = [(token.lastgroup, token.group()) for token in TOKEN.finditer(query)] + [(None, "")]
+    cost = QueryCost()
+    depth = 0
+    negated = False
+    command = None  # search pipeline command, None while in the base search
+    opens_list = False  # the next group is the value list of a field
+    lists: List[List[int]] = []  # [group depth, term count] of the open value lists
+
+    def bind(field: str):
+        if depth == 0 and not negated and field.lower() in BOUND_FIELDS:
+            cost.bound = True
+
+    index = 0
+    while index < len(tokens) - 1:
+        (kind, text), (following, following_text) = tokens[index], tokens[index + 1]
+        index += 1
+        if kind == "pipe":
+            command = ""
+        elif command == "":
+            command = text.lower()
+        elif command is not None:
+            # only the regular expressions of pipeline commands are scored
+            if kind == "quoted" and command in REGEX_COMMANDS:
+                cost.regexes += 1
+                cost.regex_complexity += regex_complexity(text[1:-1].replace("\\\\", "\\"))
+        elif kind == "open":
+            depth += 1
+            cost.depth = max(cost.depth, depth)
+            if opens_list:
+                lists.append([depth, 0])
+                opens_list = False
+        elif kind == "close":
+            if lists and lists[-1][0] == depth:
+                cost.largest_list = max(cost.largest_list, lists.pop()[1])
+            depth = max(depth - 1, 0)
+            negated = False
+        elif kind == "regex":
+            cost.regexes += 1
+            cost.regex_complexity += regex_complexity(text[text.index(":/") + 2:-1])
+            negated = False
+        elif kind == "word" and text.upper() in ("AND", "OR"):
+            continue
+        elif kind == "word" and text.upper() == "NOT":
+            cost.negations += 1
+            negated = True
+        elif kind == "word" and following == "word" and following_text.upper() == "IN":
+            # field IN (values)
+            bind(text)
+            opens_list = True
+            index += 1
+        elif kind in ("word", "quoted"):
+            if kind == "word":
+                field, value = _split_term(text)
+                if field is not None:
+                    bind(field)
+                    if not value:
+                        # field= or field: followed by a quoted value or a value list
+                        opens_list = following == "open"
+                        continue
+            else:
+                value = text[1:-1]
+            cost.terms += 1
+            if lists:
+                lists[-1][1] += 1
+            if value.startswith("*") and value != "*":
+                cost.leading_wildcards += 1
+            if not lists:
+                negated = False
+
+    cost.largest_list = max([cost.largest_list] + [count for _, count in lists])
+    cost.score = round((sum(WEIGHTS[name] * getattr(cost, name) for name in WEIGHTS if name != "depth")
+                        + WEIGHTS["depth"] * max(cost.depth - 2, 0)) * (1 if cost.bound else UNBOUND_FACTOR), 1)
+    return cost
+
+
+class CostReport:
+    """Cost estimates of the queries of a conversion run, ranked most expensive first."""
+
+    def __init__(self, max_cost: Optional[float] = None):
+        self.max_cost = max_cost
+        self.entries: List[Tuple[str, QueryCost]] = []
+
+    def analyze(self, name: str, query: str) -> QueryCost:
+        cost = analyze_query(query)
+        self.entries.append((name, cost))
+        return cost
+
+    def exceeds(self, cost: QueryCost) -> bool:
+        return self.max_cost is not None and cost.score > self.max_cost
+
+    def ranked(self) -> List[Tuple[str, QueryCost]]:
+        return sorted(self.entries, key=lambda entry: -entry[1].score)
+
+    def report(self, top: int = 10):
+        over = sum(1 for _, cost in self.entries if self.exceeds(cost))
+        print(f"\nMost expensive of {len(self.entries)} queries"
+              + (f", {over} above the maximum cost of {self.max_cost:g}:" if self.max_cost is not None else ":"))
+        print(f"{'score':>8} {'terms':>6} {'*lead':>6} {'regex':>6} {'list':>6} {'depth':>6} {'not':>4} {'bound':>6}")
+        for name, cost in self.ranked()[:top]:
+            print(f"{cost.score:>8g} {cost.terms:>6} {cost.leading_wildcards:>6} {cost.regexes:>6} "
+                  f"{cost.largest_list:>6} {cost.depth:>6} {cost.negations:>4} {str(cost.bound).lower():>6}  {name}")
+
+    def to_dict(self) -> Dict:
+        return {
+            "max_cost": self.max_cost,
+            "weights": WEIGHTS,
+            "unbound_factor": UNBOUND_FACTOR,
+            "queries": [dict(rule=name, exceeds=self.exceeds(cost), **asdict(cost)) for name, cost in self.ranked()],
+        }
+
+    def dump(self, file: str):
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,476 @@
+"""
+In-process evaluation of Sigma rules against exported events, for testing rules without running them in a SIEM.
+
+Rules go through the same pipeline and condition optimizer as with LogRhythmBackend, and the resulting condition
+trees are compiled into Python matchers:
+
+* OR-ed string values of one field become one value set: exact values in a hash set, prefixes and suffixes in
+  hash sets per length, contained strings in an Aho-Corasick automaton and any other wildcard values in one
+  regular expression
+* regular expressions are compiled once per rule
+* rules are indexed by the event IDs of their log source, an event is only matched against the rules of its ID
+
+Events (JSONL or CSV exports of Windows/Sysmon logs) keep their field names and also get the LogRhythm names of
+the mapping entry of their event ID, so mapped and unmapped rules match the same event. Strings compare case
+insensitively unless the rule uses the cased modifier, like the SIEMs this project converts for.
+"""
+import csv
+import json
+import re
+from collections import deque
+from ipaddress import ip_address
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from sigma.conditions import (
+    ConditionAND,
+    ConditionOR,
+    ConditionNOT,
+    ConditionFieldEqualsValueExpression,
+    ConditionValueExpression,
+)
+from sigma.exceptions import SigmaFeatureNotSupportedByBackendError
+from sigma.rule import SigmaRule
+from sigma.types import (
+    SigmaBool,
+    SigmaCasedString,
+    SigmaCIDRExpression,
+    SigmaCompareExpression,
+    SigmaExists,
+    SigmaExpansion,
+    SigmaFieldReference,
+    SigmaNull,
+    SigmaNumber,
+    SigmaRegularExpression,
+    SigmaString,
+    SpecialChars,
+)
+
+from custom_sigma.backends.logrhythm.optimizer import optimize_condition
+from custom_sigma.pipelines.logrhythm.mappings import MappingTable
+
+# the pyahocorasick C extension is much faster but not always installed
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# fields holding the Windows event ID in exported events
+EVENT_ID_FIELDS = ("EventID", "EventCode")
+# value lists with more contained strings than this are searched with an Aho-Corasick automaton
+AUTOMATON_THRESHOLD = 16
+
+Matcher = Callable[["Event"], bool]
+
+
+class Event:
+    """Field values of an exported event as tuples of strings, with their casefolded form."""
+
+    __slots__ = ("raw", "values", "folded")
+
+    def __init__(self, raw: Dict, translation: Optional[Dict[str, List[str]]] = None):
+        self.raw = raw
+        values: Dict[str, Tuple[str, ...]] = {}
+        _flatten(raw, "", values)
+        if translation:
+            for name, targets in translation.items():
+                if name in values:
+                    for target in targets:
+                        values[target] = values.get(target, ()) + values[name]
+        self.values = values
+        self.folded = {name: tuple(value.casefold() for value in field) for name, field in values.items()}
+
+
+def _flatten(raw: Dict, prefix: str, values: Dict[str, Tuple[str, ...]]):
+    # nested objects become dotted field names, lists hold several values of one field
+    for name, value in raw.items():
+        if isinstance(value, dict):
+            _flatten(value, f"{prefix}{name}.", values)
+        elif isinstance(value, list):
+            values[prefix + name] = tuple(_text(item) for item in value if item is not None)
+        elif value is not None:
+            values[prefix + name] = (_text(value),)
+
+
+def _text(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value if isinstance(value, str) else str(value)
+
+
+class Automaton:
+    """Aho-Corasick automaton telling whether any of its strings occurs in a text."""
+
+    def __init__(self, strings: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail = [0]
+        self._out = [False]
+        for string in strings:
+            node = 0
+            for char in string:
+                following = self._goto[node].get(char)
+                if following is None:
+                    following = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(False)
+                node = following
+            self._out[node] = True
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, following in self._goto[node].items():
+                queue.append(following)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[following] = self._goto[fail].get(char, 0) if node else 0
+                self._out[following] = self._out[following] or self._out[self._fail[following]]
+
+    def search(self, text: str) -> bool:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                return True
+        return False
+
+
+def _contains_any(strings: List[str]) -> Callable[[str], bool]:
+    if len(strings) <= AUTOMATON_THRESHOLD:
+        return lambda text: any(string in text for string in strings)
+    if ahocorasick is None:
+        return Automaton(strings).search
+    automaton = ahocorasick.Automaton()
+    for string in strings:
+        automaton.add_word(string, string)
+    automaton.make_automaton()
+    return lambda text: next(automaton.iter(text), None) is not None
+
+
+def _classify(value: SigmaString) -> Tuple[str, str]:
+    """
+    ("equals", x), ("contains", x) for *x*, ("startswith", x) for x*, ("endswith", x) for *x, ("any", "") for *
+    and ("regex", pattern) for any other wildcard value.
+    """
+    parts = value.s
+    if any(not isinstance(part, (str, SpecialChars)) for part in parts):
+        raise SigmaFeatureNotSupportedByBackendError("Placeholders cannot be evaluated")
+    multi = SpecialChars.WILDCARD_MULTI
+    if not any(isinstance(part, SpecialChars) for part in parts):
+        return "equals", "".join(parts)
+    if parts == (multi,):
+        return "any", ""
+    if len(parts) == 3 and parts[0] == multi and parts[2] == multi and isinstance(parts[1], str):
+        return "contains", parts[1]
+    if len(parts) == 2 and isinstance(parts[0], str) and parts[1] == multi:
+        return "startswith", parts[0]
+    if len(parts) == 2 and parts[0] == multi and isinstance(parts[1], str):
+        return "endswith", parts[1]
+    return "regex", value.to_regex().regexp
+
+
+class ValueSet:
+    """Test whether any value of a field matches any of many string values of a rule."""
+
+    def __init__(self, field: Optional[str], values: List[SigmaString], cased: bool):
+        self.field = field
+        self.cased = cased
+        self.any = False
+        self.exact = set()
+        self.prefixes: Dict[int, set] = {}
+        self.suffixes: Dict[int, set] = {}
+        contains = []
+        patterns = []
+        for value in values:
+            kind, text = _classify(value)
+            if field is None and kind == "equals":
+                # plain keywords are converted to *keyword* by LogRhythmBackend, they match inside any value
+                kind = "contains"
+            if not cased:
+                text = text.casefold()
+            if kind == "any":
+                self.any = True
+            elif kind == "equals":
+                self.exact.add(text)
+            elif kind == "startswith":
+                self.prefixes.setdefault(len(text), set()).add(text)
+            elif kind == "endswith":
+                self.suffixes.setdefault(len(text), set()).add(text)
+            elif kind == "contains":
+                contains.append(text)
+            else:
+                patterns.append(text)
+        self.contains = _contains_any(contains) if contains else None
+        # wildcard values were converted to regular expressions from their casefolded text
+        self.regex = re.compile("|".join(f"(?:{pattern})" for pattern in patterns),
+                                re.DOTALL) if patterns else None
+
+    def test(self, text: str) -> bool:
+        if text in self.exact:
+            return True
+        for length, prefixes in self.prefixes.items():
+            if text[:length] in prefixes:
+                return True
+        for length, suffixes in self.suffixes.items():
+            if len(text) >= length and text[len(text) - length:] in suffixes:
+                return True
+        if self.contains is not None and self.contains(text):
+            return True
+        return self.regex is not None and self.regex.fullmatch(text) is not None
+
+    def __call__(self, event: Event) -> bool:
+        if self.field is None:
+            # keywords match anywhere in the event, like unbound Lucene terms
+            fields = (event.values if self.cased else event.folded).values()
+            return any(self.test(text) for values in fields for text in values)
+        values = (event.values if self.cased else event.folded).get(self.field)
+        if not values:
+            return False
+        return self.any or any(self.test(text) for text in values)
+
+
+def _string_values(value) -> Optional[Tuple[List[SigmaString], bool]]:
+    # string values of a leaf and whether they are case sensitive, None for any other value type
+    values = value.values if isinstance(value, SigmaExpansion) else [value]
+    if not all(isinstance(item, SigmaString) for item in values):
+        return None
+    cased = [isinstance(item, SigmaCasedString) for item in values]
+    if any(cased) and not all(cased):
+        return None
+    return values, cased[0]
+
+
+def _numbers(values: Tuple[str, ...]) -> Iterator[float]:
+    for text in values:
+        try:
+            yield float(text)
+        except ValueError:
+            continue
+
+
+_COMPARE = {
+    SigmaCompareExpression.CompareOperators.LT: float.__lt__,
+    SigmaCompareExpression.CompareOperators.LTE: float.__le__,
+    SigmaCompareExpression.CompareOperators.GT: float.__gt__,
+    SigmaCompareExpression.CompareOperators.GTE: float.__ge__,
+}
+
+
+def _contains_ip(network, text: str) -> bool:
+    try:
+        return ip_address(text) in network
+    except ValueError:
+        return False
+
+
+def _compile_leaf(cond: Union[ConditionFieldEqualsValueExpression, ConditionValueExpression]) -> Matcher:
+    field = getattr(cond, "field", None)
+    value = cond.value
+    strings = _string_values(value)
+    if strings is not None:
+        return ValueSet(field, *strings)
+    if isinstance(value, SigmaExpansion):
+        return _compile_any([_compile_leaf(ConditionFieldEqualsValueExpression(field, item))
+                             for item in value.values])
+    if field is None:
+        raise SigmaFeatureNotSupportedByBackendError(f"Keywords of type {type(value).__name__} cannot be evaluated")
+
+    if isinstance(value, SigmaNull):
+        return lambda event: not any(event.values.get(field, ()))
+    if isinstance(value, SigmaExists):
+        return lambda event: (field in event.values) == value.exists
+    if isinstance(value, SigmaBool):
+        text = "true" if value.boolean else "false"
+        return lambda event: text in event.folded.get(field, ())
+    if isinstance(value, SigmaNumber):
+        number = float(value.number)
+        return lambda event: any(item == number for item in _numbers(event.values.get(field, ())))
+    if isinstance(value, SigmaCompareExpression):
+        number, compare = float(value.number.number), _COMPARE[value.op]
+        return lambda event: any(compare(item, number) for item in _numbers(event.values.get(field, ())))
+    if isinstance(value, SigmaRegularExpression):
+        flags = 0
+        for flag in value.flags:
+            flags |= value.sigma_to_python_flags[flag]
+        regex = re.compile(value.regexp, flags)
+        return lambda event: any(regex.search(text) for text in event.values.get(field, ()))
+    if isinstance(value, SigmaCIDRExpression):
+        network = value.network
+        return lambda event: any(_contains_ip(network, text) for text in event.values.get(field, ()))
+    if isinstance(value, SigmaFieldReference):
+        other = value.field
+        return lambda event: bool(set(event.folded.get(field, ())) & set(event.folded.get(other, ())))
+    raise SigmaFeatureNotSupportedByBackendError(f"Values of type {type(value).__name__} cannot be evaluated")
+
+
+def _compile_all(matchers: List[Matcher]) -> Matcher:
+    if len(matchers) == 1:
+        return matchers[0]
+
+    def match(event: Event) -> bool:
+        for matcher in matchers:
+            if not matcher(event):
+                return False
+        return True
+    return match
+
+
+def _compile_any(matchers: List[Matcher]) -> Matcher:
+    if len(matchers) == 1:
+        return matchers[0]
+
+    def match(event: Event) -> bool:
+        for matcher in matchers:
+            if matcher(event):
+                return True
+        return False
+    return match
+
+
+def compile_condition(cond) -> Matcher:
+    """Compile a pySigma condition tree into a function telling whether an event matches it."""
+    if isinstance(cond, ConditionNOT):
+        matcher = compile_condition(cond.args[0])
+        return lambda event: not matcher(event)
+    if isinstance(cond, ConditionAND):
+        return _compile_all([compile_condition(arg) for arg in cond.args])
+    if isinstance(cond, ConditionOR):
+        # string values of the same field, or keywords, are merged into one value set
+        groups: Dict[Tuple[Optional[str], bool], List[SigmaString]] = {}
+        matchers = []
+        for arg in cond.args:
+            strings = _string_values(arg.value) if isinstance(
+                arg, (ConditionFieldEqualsValueExpression, ConditionValueExpression)) else None
+            if strings is None:
+                matchers.append(compile_condition(arg))
+                continue
+            values, cased = strings
+            key = (getattr(arg, "field", None), cased)
+            if key not in groups:
+                groups[key] = []
+                matchers.append(key)
+            groups[key].extend(values)
+        return _compile_any([ValueSet(key[0], groups[key], key[1]) if isinstance(key, tuple) else key
+                             for key in matchers])
+    return _compile_leaf(cond)
+
+
+def _event_id(name: str) -> Optional[str]:
+    match = re.match(r"EVID (\d+)", name or "")
+    return match.group(1) if match else None
+
+
+class RuleMatcher:
+    """Compiled conditions of one rule and the event IDs of its log source, None when it applies to any event."""
+
+    def __init__(self, rule: SigmaRule, pipeline, table: MappingTable, optimize: bool = True):
+        self.title = rule.title
+        self.id = str(rule.id) if rule.id else None
+        self.event_ids = _logsource_event_ids(rule, table)
+        # the tree LogRhythmBackend converts: after the pipeline and optionally the optimizer
+        pipeline.apply(rule)
+        trees = [condition.parsed for condition in rule.detection.parsed_condition]
+        self.match = _compile_any([compile_condition(optimize_condition(tree) if optimize else tree)
+                                   for tree in trees])
+
+
+def _logsource_event_ids(rule: SigmaRule, table: MappingTable) -> Optional[frozenset]:
+    # event IDs of the mapping entries the pipeline applies to this rule, like LogsourceCondition
+    logsource = rule.logsource
+    event_ids = set()
+    for entry in table.entries:
+        if all(entry[key] is None or entry[key] == getattr(logsource, key) for key in
+               ("product", "category", "service")):
+            event_id = _event_id(entry["name"])
+            if event_id:
+                event_ids.add(event_id)
+    return frozenset(event_ids) or None
+
+
+class Evaluator:
+    """
+    Matches events against compiled rules. Rules are indexed by event ID, events are translated to the field
+    names of the mapping entry of their event ID.
+    """
+
+    def __init__(self, rules: List[RuleMatcher], table: MappingTable):
+        self.rules = rules
+        self._generic = [index for index, rule in enumerate(rules) if rule.event_ids is None]
+        self._by_event_id: Dict[str, List[int]] = {}
+        for index, rule in enumerate(rules):
+            for event_id in rule.event_ids or ():
+                self._by_event_id.setdefault(event_id, []).append(index)
+        for indexes in self._by_event_id.values():
+            indexes.sort()
+        self._translations: Dict[str, Dict[str, List[str]]] = {}
+        for position, entry in enumerate(table.entries):
+            event_id = _event_id(entry["name"])
+            if event_id and event_id not in self._translations:
+                self._translations[event_id] = {
+                    name: [target] if isinstance(target, str) else list(target)
+                    for name, target in table.mapping(position).items()
+                }
+
+    @staticmethod
+    def event_id(raw: Dict) -> Optional[str]:
+        for name in EVENT_ID_FIELDS:
+            if raw.get(name) is not None:
+                return str(raw[name])
+        return None
+
+    def match(self, raw: Dict) -> List[int]:
+        """Indexes of the rules matching an event, in rule order."""
+        event_id = self.event_id(raw)
+        event = Event(raw, self._translations.get(event_id))
+        mapped = self._by_event_id.get(event_id, [])
+        candidates = sorted(mapped + self._generic) if mapped and self._generic else mapped or self._generic
+        return [index for index in candidates if self.rules[index].match(event)]
+
+    def evaluate(self, items: List[Union[str, Dict]], samples: int = 3) -> Tuple[int, int, Dict[int, Tuple[int, List]]]:
+        """
+        Evaluate JSON lines or parsed event dicts. Returns the number of events, the number of skipped items
+        that are not JSON objects and per matching rule index its hit count and first samples.
+        """
+        events = skipped = 0
+        hits: Dict[int, Tuple[int, List]] = {}
+        for item in items:
+            if isinstance(item, str):
+                try:
+                    item = json.loads(item)
+                except ValueError:
+                    item = None
+            if not isinstance(item, dict):
+                skipped += 1
+                continue
+            events += 1
+            for index in self.match(item):
+                count, found = hits.get(index, (0, []))
+                if len(found) < samples:
+                    found.append(item)
+                hits[index] = (count + 1, found)
+        return events, skipped, hits
+
+
+def read_events(file: str, batch_size: int = 5000) -> Iterator[List[Union[str, Dict]]]:
+    """
+    Batches of events of a JSONL or CSV export, streamed from disk. JSON lines are returned unparsed so they can
+    be parsed by worker processes, CSV rows as dicts.
+    """
+    with open(file, "r", encoding="utf-8", newline="") as f:
+        if file.lower().endswith(".csv"):
+            lines = ({name: value for name, value in row.items() if name is not None and value != ""}
+                     for row in csv.DictReader(f))
+        else:
+            lines = (line for line in f if line.strip())
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
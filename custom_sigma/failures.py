@@ -0,0 +1,74 @@
+"""
+Failure report of a conversion run: every rule that did not convert, with its path, the reason and the message
+explaining it. Reasons are derived from the failure messages, so results coming from worker processes, the
+supervisor or the conversion cache are classified the same way.
+"""
+import json
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+# failure message prefix -> reason
+REASONS = (
+    ("Failed at opening file", "unreadable"),
+    ("Failed at parsing rule", "invalid_rule"),
+    ("Failed at converting SIGMA to query", "unsupported"),
+    ("Rule contains field with no official conversion", "unmapped_field"),
+    ("Conversion timed out", "timeout"),
+    ("Conversion exceeded the memory limit", "memory"),
+    ("Conversion worker crashed", "crash"),
+    ("Conversion raised", "exception"),
+)
+
+
+def failure_reason(message: str) -> str:
+    return next((reason for prefix, reason in REASONS if message.startswith(prefix)), "other")
+
+
+@dataclass
+class RuleFailure:
+    rule: str
+    reason: str
+    message: str
+
+
+class FailureReport:
+    """Rules that failed to convert, reported grouped by reason once the run is done."""
+
+    def __init__(self):
+        self.failures: List[RuleFailure] = []
+
+    def add(self, rule: str, message: str) -> RuleFailure:
+        failure = RuleFailure(rule, failure_reason(message), message)
+        self.failures.append(failure)
+        return failure
+
+    def __len__(self):
+        return len(self.failures)
+
+    def grouped(self) -> Dict[str, List[RuleFailure]]:
+        # reasons in the order of REASONS, rules in the order they failed
+        order = {reason: position for position, (_, reason) in enumerate(REASONS)}
+        groups: Dict[str, List[RuleFailure]] = {}
+        for failure in sorted(self.failures, key=lambda failure: order.get(failure.reason, len(order))):
+            groups.setdefault(failure.reason, []).append(failure)
+        return groups
+
+    def report(self):
+        if not self.failures:
+            return
+        print(f"\n{len(self.failures)} rules failed:")
+        for reason, failures in self.grouped().items():
+            print(f"  {reason} ({len(failures)})")
+            for failure in failures:
+                print(f"    {failure.message}")
+
+    def to_dict(self) -> Dict:
+        return {
+            "failed": len(self.failures),
+            "reasons": {reason: len(failures) for reason, failures in self.grouped().items()},
+            "rules": [asdict(failure) for failure in self.failures],
+        }
+
+    def dump(self, file: str):
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
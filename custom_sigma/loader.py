@@ -0,0 +1,73 @@
+import pickle
+import sqlite3
+from os import makedirs, path
+from typing import Dict
+
+import yaml
+
+from custom_sigma.archive import file_stat, read_file, split_member
+
+# libyaml bindings are several times faster than the pure Python loader but are not always installed.
+# Both are safe loaders: rules come from third parties and must never construct arbitrary objects
+try:
+    from yaml import CSafeLoader as RuleLoader
+except ImportError:
+    from yaml import SafeLoader as RuleLoader
+
+
+def load_yaml(content) -> Dict:
+    """Parse YAML text or bytes into a rule dict."""
+    return yaml.load(content, Loader=RuleLoader)
+
+
+def load_rule(file: str) -> Dict:
+    """Parse a rule file, or a rule inside an archive, into a dict, closing the file afterwards."""
+    if split_member(file):
+        return load_yaml(read_file(file))
+    with open(file, "rb") as f:
+        return load_yaml(f)
+
+
+class ParsedRuleCache:
+    """
+    Pickled rule dicts keyed by file path, reused while the file modification time and size are unchanged. Rules
+    inside an archive are keyed by their <archive>/<member> path and the archive modification time.
+    Several processes may share the cache, writes are committed by flush().
+    """
+
+    def __init__(self, directory: str):
+        makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self._pending = []
+        self._db = sqlite3.connect(path.join(directory, "rules.sqlite"), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rules "
+            "(path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+
+    def load(self, file: str) -> Dict:
+        """Rule dict of file, parsed from YAML only if the cached copy is missing or outdated."""
+        mtime_ns, size = file_stat(file)
+        key = path.abspath(file)
+        row = self._db.execute("SELECT mtime, size, data FROM rules WHERE path = ?", (key,)).fetchone()
+        if row is not None and row[0] == mtime_ns and row[1] == size:
+            self.hits += 1
+            return pickle.loads(row[2])
+
+        rule = load_rule(file)
+        self._pending.append((key, mtime_ns, size, pickle.dumps(rule, protocol=pickle.HIGHEST_PROTOCOL)))
+        return rule
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._db.executemany("INSERT OR REPLACE INTO rules (path, mtime, size, data) VALUES (?, ?, ?, ?)",
+                             self._pending)
+        self._db.commit()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
@@ -0,0 +1,115 @@
+"""
+Lookup-table mode: value lists of a rule with at least a threshold of values are written to lookup files, and
+the query references the lookup instead of listing every value. Updating a list then changes the lookup file,
+not the saved search.
+
+For Splunk the reference is an inputlookup subsearch, which Splunk expands into the OR of field="value" terms at
+search time. That keeps the exact meaning of the inline list anywhere in the query, negated or not, including
+wildcards and case insensitive matching. Subsearches return at most 10000 results by default, larger lists are
+written to several lookup files.
+
+Lookup files are named after the rule id (title if it has none) and the field, so the names stay the same when
+the values change.
+"""
+import re
+from collections import Counter
+from functools import wraps
+from os import makedirs, path
+from typing import List, Optional
+
+from sigma.conditions import ConditionFieldEqualsValueExpression, ConditionOR
+from sigma.types import SigmaNumber, SigmaString, SpecialChars
+
+from custom_sigma.writer import AtomicRuleWriter
+
+# query text referencing one lookup file of a value list, per backend
+LIST_REFERENCES = {
+    "splunk": "[| inputlookup {file} | fields {field}]",
+}
+SUBSEARCH_LIMIT = 10_000
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+def _lookup_value(value) -> Optional[str]:
+    """Lookup text of a value, None if the lookup cannot express it (cased strings, ? wildcards, placeholders)."""
+    if isinstance(value, SigmaNumber):
+        return str(value)
+    if type(value) is not SigmaString:
+        return None
+    parts = []
+    for part in value.s:
+        if isinstance(part, str) and "*" not in part:
+            parts.append(part)
+        elif part == SpecialChars.WILDCARD_MULTI:
+            parts.append("*")
+        else:
+            return None
+    return "".join(parts)
+
+
+def _csv_value(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+class LookupLists:
+    """Moves value lists converted by a backend into lookup files in directory."""
+
+    def __init__(self, backend_name: str, directory: str, threshold: int):
+        self.reference = LIST_REFERENCES[backend_name.lower()]
+        self.directory = directory
+        self.threshold = threshold
+        self._rule = None
+        self._names = Counter()
+
+    def install(self, backend):
+        """Convert the value lists of every rule converted by backend into lookup references."""
+        convert_rule = backend.convert_rule
+        convert_as_in = backend.convert_condition_as_in_expression
+
+        @wraps(convert_rule)
+        def convert_rule_with_lookups(rule, output_format=None):
+            self._rule = rule
+            self._names.clear()
+            return convert_rule(rule, output_format)
+
+        @wraps(convert_as_in)
+        def convert_as_in_with_lookups(cond, state):
+            return self.convert(cond) or convert_as_in(cond, state)
+
+        backend.convert_rule = convert_rule_with_lookups
+        backend.convert_condition_as_in_expression = convert_as_in_with_lookups
+        return backend
+
+    def convert(self, cond) -> Optional[str]:
+        """Lookup reference of an in-expression, None to keep the values in the query."""
+        if not isinstance(cond, ConditionOR) or len(cond.args) < self.threshold or self._rule is None:
+            return None
+        values = [_lookup_value(arg.value) for arg in cond.args if isinstance(arg, ConditionFieldEqualsValueExpression)]
+        if len(values) != len(cond.args) or None in values:
+            return None
+        field = cond.args[0].field
+        values = list(dict.fromkeys(values))
+        references = [self.reference.format(file=file, field=field)
+                      for file in self.write(field, values)]
+        return references[0] if len(references) == 1 else "(" + " OR ".join(references) + ")"
+
+    def write(self, field: str, values: List[str]) -> List[str]:
+        """Write values to lookup files of the current rule, returns the file names."""
+        base = f"sigma_{_slug(str(self._rule.id or self._rule.title))}_{_slug(field)}"
+        self._names[base] += 1
+        if self._names[base] > 1:
+            base += f"_{self._names[base]}"
+        chunks = [values[start:start + SUBSEARCH_LIMIT] for start in range(0, len(values), SUBSEARCH_LIMIT)]
+        makedirs(self.directory, exist_ok=True)
+        files = []
+        for number, chunk in enumerate(chunks, 1):
+            file = f"{base}.csv" if len(chunks) == 1 else f"{base}_part{number}.csv"
+            with AtomicRuleWriter(path.join(self.directory, file)) as writer:
+                writer.write(_csv_value(field))
+                for value in chunk:
+                    writer.write(_csv_value(value))
+            files.append(file)
+        return files
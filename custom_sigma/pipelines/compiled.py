@@ -0,0 +1,152 @@
+from dataclasses import dataclass, field
+from itertools import product as combinations
+from typing import Any, Dict, List, Optional, Tuple
+
+from sigma.processing.conditions import LogsourceCondition
+from sigma.processing.pipeline import ProcessingItem, ProcessingPipeline
+from sigma.rule import SigmaRule
+
+LogsourceKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def _logsource_keys(item: ProcessingItem) -> Optional[List[LogsourceKey]]:
+    """
+    (product, category, service) keys a processing item can apply to, None when the item has to be
+    checked against every rule (no rule conditions, negation or conditions other than log sources).
+    """
+    conditions = item.rule_conditions
+    if not conditions or item.rule_condition_negation:
+        return None
+    logsources = [c for c in conditions if isinstance(c, LogsourceCondition)]
+    if not logsources:
+        return None
+    if item.rule_condition_linking is all:
+        # every condition must match, so the first log source condition is enough to rule the item out
+        condition = logsources[0]
+        return [(condition.product, condition.category, condition.service)]
+    if item.rule_condition_linking is any and len(logsources) == len(conditions):
+        return [(c.product, c.category, c.service) for c in logsources]
+    return None
+
+
+def _rule_logsource(rule: SigmaRule) -> LogsourceKey:
+    logsource = rule.logsource
+    return logsource.product, logsource.category, logsource.service
+
+
+@dataclass
+class CompiledProcessingPipeline(ProcessingPipeline):
+    """
+    Processing pipeline that indexes its items by the log source of their rule conditions. Applying
+    it to a rule only visits the items that can match the rule log source, in their original order,
+    instead of every item of the pipeline. The index is built once and the candidate list is memoized
+    per log source, so the same compiled pipeline can be shared by any number of backends.
+    """
+
+    _index: Dict[LogsourceKey, List[int]] = field(init=False, repr=False, compare=False, default_factory=dict)
+    _generic: List[int] = field(init=False, repr=False, compare=False, default_factory=list)
+    _candidates: Dict[LogsourceKey, Tuple[int, ...]] = field(init=False, repr=False, compare=False,
+                                                             default_factory=dict)
+    _combined: Dict[int, Tuple[ProcessingPipeline, "CompiledProcessingPipeline"]] = field(
+        init=False, repr=False, compare=False, default_factory=dict)
+
+    def __post_init__(self):
+        super().__post_init__()
+        for position, item in enumerate(self.items):
+            keys = _logsource_keys(item)
+            if keys is None:
+                self._generic.append(position)
+                continue
+            for key in set(keys):
+                self._index.setdefault(key, []).append(position)
+
+    def candidates(self, product: Optional[str], category: Optional[str], service: Optional[str]) -> Tuple[int, ...]:
+        """Positions of the items that can apply to a rule with the given log source."""
+        key = (product, category, service)
+        if key not in self._candidates:
+            positions = set(self._generic)
+            # an item keyed with None for an attribute matches any value of that attribute
+            for lookup in combinations((None, product), (None, category), (None, service)):
+                positions.update(self._index.get(lookup, ()))
+            self._candidates[key] = tuple(sorted(positions))
+        return self._candidates[key]
+
+    def apply(self, rule):
+        if not isinstance(rule, SigmaRule):  # correlation rules match on their referenced rules
+            return super().apply(rule)
+
+        key = _rule_logsource(rule)
+        positions = self.candidates(*key)
+        self.applied = [False] * len(self.items)
+        self.applied_ids = set()
+        self.field_name_applied_ids = type(self.field_name_applied_ids)(set)
+        self.field_mappings = type(self.field_mappings)()
+        self.state = dict()
+        next_position = 0
+        while next_position < len(positions):
+            position = positions[next_position]
+            next_position += 1
+            item = self.items[position]
+            applied = item.apply(self, rule)
+            self.applied[position] = applied
+            if applied and (itid := item.identifier):
+                self.applied_ids.add(itid)
+            # items can change the log source (e.g. ChangeLogsourceTransformation), the items after them are
+            # matched against the new one
+            if _rule_logsource(rule) != key:
+                key = _rule_logsource(rule)
+                positions = tuple(later for later in self.candidates(*key) if later > position)
+                next_position = 0
+        return rule
+
+    def _is_empty(self, other: ProcessingPipeline) -> bool:
+        return not (other.items or other.postprocessing_items or other.finalizers)
+
+    def _combine(self, other: ProcessingPipeline, left: bool) -> "CompiledProcessingPipeline":
+        # backends concatenate their own pipelines with ours for every converted rule, keep the
+        # compiled result around instead of rebuilding the index each time
+        if id(other) not in self._combined:
+            first, second = (other, self) if left else (self, other)
+            combined = CompiledProcessingPipeline(
+                items=first.items + second.items,
+                postprocessing_items=first.postprocessing_items + second.postprocessing_items,
+                finalizers=first.finalizers + second.finalizers,
+                vars={**first.vars, **second.vars},
+            )
+            self._combined[id(other)] = (other, combined)
+        combined = self._combined[id(other)][1]
+        combined.vars.update(other.vars)
+        return combined
+
+    def __add__(self, other: Optional[ProcessingPipeline]) -> ProcessingPipeline:
+        if other is None:
+            return self
+        if not isinstance(other, ProcessingPipeline):
+            raise TypeError("Processing pipeline must be merged with another one.")
+        if self._is_empty(other):
+            self.vars.update(other.vars)
+            return self
+        return self._combine(other, left=False)
+
+    def __radd__(self, other: Any) -> ProcessingPipeline:
+        if isinstance(other, ProcessingPipeline):
+            if self._is_empty(other):
+                self.vars.update(other.vars)
+                return self
+            return self._combine(other, left=True)
+        return super().__radd__(other)
+
+
+def compile_pipeline(pipeline: Optional[ProcessingPipeline]) -> Optional[ProcessingPipeline]:
+    """Compile a processing pipeline, anything that is not a pipeline (e.g. no pipeline) is returned as is."""
+    if not isinstance(pipeline, ProcessingPipeline) or isinstance(pipeline, CompiledProcessingPipeline):
+        return pipeline
+    return CompiledProcessingPipeline(
+        items=pipeline.items,
+        postprocessing_items=pipeline.postprocessing_items,
+        finalizers=pipeline.finalizers,
+        vars=pipeline.vars,
+        priority=pipeline.priority,
+        name=pipeline.name,
+        allowed_backends=pipeline.allowed_backends,
+    )
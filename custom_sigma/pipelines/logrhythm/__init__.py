@@ -1,5 +1,5 @@
-from .windows import lr_windows
+from .windows import lr_windows_v2
 
 pipelines = {
-    "lr_windows": lr_windows,
+    "lr_windows_v2": lr_windows_v2,
 }
@@ -0,0 +1,106 @@
+import hashlib
+import pickle
+from dataclasses import dataclass, field
+from os import makedirs, path, replace, stat
+from typing import Dict, List, Optional, Union
+
+import yaml
+from sigma.exceptions import SigmaConfigurationError
+from sigma.processing.transformations import FieldMappingTransformation
+
+# bump when the layout of the precompiled cache changes
+CACHE_FORMAT = 1
+
+
+class MappingTable:
+    """
+    Field mapping tables declared in a YAML data file. The file is parsed once and stored next to it as
+    a pickle (in __pycache__) holding the entry list and one pickled mapping per entry. Later loads
+    only read the entry list, the mappings themselves are unpickled the first time an entry is used.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.cache = path.join(path.dirname(source), "__pycache__",
+                               path.splitext(path.basename(source))[0] + ".pickle")
+        self._compiled: Optional[Dict] = None
+        self._mappings: Dict[int, Dict[str, Union[str, List[str]]]] = {}
+
+    def _signature(self):
+        st = stat(self.source)
+        return CACHE_FORMAT, st.st_mtime_ns, st.st_size
+
+    def _compile(self) -> Dict:
+        with open(self.source, "rb") as f:
+            content = f.read()
+        data = yaml.load(content, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        if not isinstance(data, dict) or not isinstance(data.get("mappings"), list):
+            raise SigmaConfigurationError(f"Field mapping file {self.source} must contain a mappings list")
+
+        entries = []
+        mappings = []
+        for entry in data["mappings"]:
+            entries.append({key: entry.get(key) for key in ("name", "identifier", "product", "category", "service")})
+            mappings.append(pickle.dumps(entry.get("fields") or {}, protocol=pickle.HIGHEST_PROTOCOL))
+        return {
+            "signature": self._signature(),
+            "version": data.get("version"),
+            "digest": hashlib.sha256(content).hexdigest(),
+            "entries": entries,
+            "mappings": mappings,
+        }
+
+    def _load(self) -> Dict:
+        if self._compiled is not None:
+            return self._compiled
+        try:
+            with open(self.cache, "rb") as f:
+                compiled = pickle.load(f)
+            if compiled.get("signature") != self._signature():
+                compiled = None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            compiled = None
+
+        if compiled is None:
+            compiled = self._compile()
+            try:  # the cache is only an optimization, read-only installs simply parse the file each run
+                makedirs(path.dirname(self.cache), exist_ok=True)
+                with open(self.cache + ".tmp", "wb") as f:
+                    pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+                replace(self.cache + ".tmp", self.cache)
+            except OSError:
+                pass
+        self._compiled = compiled
+        return compiled
+
+    @property
+    def version(self):
+        return self._load()["version"]
+
+    @property
+    def digest(self) -> str:
+        return self._load()["digest"]
+
+    @property
+    def entries(self) -> List[Dict]:
+        return self._load()["entries"]
+
+    def mapping(self, position: int) -> Dict[str, Union[str, List[str]]]:
+        if position not in self._mappings:
+            self._mappings[position] = pickle.loads(self._load()["mappings"][position])
+        return self._mappings[position]
+
+
+@dataclass
+class LazyFieldMappingTransformation(FieldMappingTransformation):
+    """Field mapping transformation whose mapping is loaded from a MappingTable when first used."""
+
+    mapping: Optional[Dict[str, Union[str, List[str]]]] = field(default=None, compare=False)
+    table: Optional[MappingTable] = field(default=None, repr=False, compare=False)
+    position: int = 0
+    digest: str = ""  # content hash of the table, makes pipeline fingerprints follow changes of the data file
+
+    def get_mapping(self, field: str) -> Union[None, str, List[str]]:
+        if self.mapping is None:
+            self.mapping = self.table.mapping(self.position)
+        return self.mapping.get(field)
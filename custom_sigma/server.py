@@ -0,0 +1,106 @@
+import json
+import os
+import stat
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Callable, List, Optional, Tuple
+
+# convert(backend, pipeline, output format, rules) -> [(query, error)], rules are YAML texts or rule dicts
+Converter = Callable[[str, str, str, List], List[Tuple[Optional[str], Optional[str]]]]
+
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /health reports the server status.
+    POST /convert converts {"rule": ...} or {"rules": [...]} with optional "backend", "pipeline" and
+    "output_format", using the same defaults as the convert command.
+    """
+
+    server_version = "sigma-convert"
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send(200, {"status": "ok", "jobs": self.server.jobs})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            self._send(413, {"error": f"Request body larger than {MAX_BODY_SIZE} bytes"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+            return
+        if not isinstance(request, dict) or ("rule" in request) == ("rules" in request):
+            self._send(400, {"error": 'Expected a JSON object with either "rule" or "rules"'})
+            return
+        rules = [request["rule"]] if "rule" in request else request["rules"]
+        if not isinstance(rules, list) or not all(isinstance(rule, (str, dict)) for rule in rules):
+            self._send(400, {"error": "Rules must be YAML strings or rule objects"})
+            return
+
+        try:
+            results = self.server.convert(request.get("backend") or "splunk", request.get("pipeline") or "",
+                                          request.get("output_format") or "default", rules)
+        except Exception as e:
+            # unknown backends and pipelines surface here when the backend is created
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        results = [{"query": query, "error": error} for query, error in results]
+        self._send(200, results[0] if "rule" in request else {"results": results})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ConversionHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class ConversionUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def create_server(convert: Converter, jobs: int, host: str = "127.0.0.1", port: int = 8470,
+                  socket_path: Optional[str] = None, verbose: bool = False):
+    """HTTP server on host:port, or on a Unix socket when socket_path is given."""
+    if socket_path:
+        # a socket left behind by a server that did not shut down cleanly is replaced, any other file is kept
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise FileExistsError(f"{socket_path} exists and is not a socket")
+            os.unlink(socket_path)
+        server = ConversionUnixServer(socket_path, ConversionRequestHandler)
+    else:
+        server = ConversionHTTPServer((host, port), ConversionRequestHandler)
+    server.convert = convert
+    server.jobs = jobs
+    server.verbose = verbose
+    return server
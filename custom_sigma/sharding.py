@@ -0,0 +1,135 @@
+"""
+Deterministic sharding of a rule corpus across machines, and merging of the shard outputs.
+
+Every rule is assigned to a shard by a hash of its path relative to the rule source, or of its rule id, so the
+assignment does not depend on the machine, the checkout location or the other rules. Adding a rule does not move
+any other rule to another shard.
+
+Next to its output every shard writes a manifest with the position of each written query in the rule discovery
+order of the whole corpus. Merging sorts the queries of all shards by that position, which gives the exact
+output of a run over the whole corpus.
+"""
+import hashlib
+import json
+import re
+from os import path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from custom_sigma.archive import read_file
+
+MANIFEST_SUFFIX = ".shard.json"
+SHARD_KEYS = ("path", "id")
+# top-level id of a rule file, found without parsing the YAML
+ID_LINE = re.compile(rb"""^id:[ \t]*["']?([^"'\s#]+)""", re.MULTILINE)
+
+
+class ShardError(ValueError):
+    """Raised when shard outputs cannot be merged into the output of a whole run."""
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """(index, count) of an I/N shard specification, index counted from 1."""
+    index, separator, count = value.partition("/")
+    if not separator or not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+        raise ValueError(f"Expected a shard as I/N with 1 <= I <= N, got {value}")
+    return int(index), int(count)
+
+
+def shard_of(key: str, count: int) -> int:
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count + 1
+
+
+def manifest_path(destination: str) -> str:
+    return destination + MANIFEST_SUFFIX
+
+
+class Shard:
+    """Selects the rules of shard index of count, remembering the corpus position of every selected rule."""
+
+    def __init__(self, index: int, count: int, root: str, key: str = "path"):
+        self.index = index
+        self.count = count
+        self.root = root
+        self.key = key
+        self.positions: Dict[str, int] = {}
+        self.total = 0
+
+    def rule_key(self, file: str) -> str:
+        # rules of a folder or archive by their relative path, a single rule file by its name
+        relative = path.relpath(file, self.root) if file != self.root else path.basename(file)
+        relative = relative.replace(path.sep, "/")
+        if self.key == "id":
+            try:
+                match = ID_LINE.search(read_file(file))
+            except OSError:
+                match = None
+            if match:
+                return match.group(1).decode("utf-8", "replace").lower()
+        return relative
+
+    def select(self, paths: Iterable[str]) -> Iterator[str]:
+        for position, file in enumerate(paths):
+            self.total += 1
+            if shard_of(self.rule_key(file), self.count) == self.index:
+                self.positions[file] = position
+                yield file
+
+
+class ShardManifest:
+    """Positions and line counts of the queries a shard writes to one destination."""
+
+    def __init__(self, shard: Shard):
+        self.shard = shard
+        self.entries: List[Tuple[int, int]] = []
+        self.failed = 0
+
+    def add(self, file: str, item: str):
+        # every item is written as item + newline, see AtomicRuleWriter
+        self.entries.append((self.shard.positions[file], item.count("\n") + 1))
+
+    def dump(self, destination: str):
+        shard = self.shard
+        with open(manifest_path(destination), "w", encoding="utf-8") as f:
+            json.dump({"shard": shard.index, "shards": shard.count, "key": shard.key, "rules": shard.total,
+                       "selected": len(shard.positions), "failed": self.failed, "entries": self.entries}, f)
+
+
+def merge_shards(outputs: List[str]) -> Tuple[List[str], Dict]:
+    """
+    Queries of the shard outputs in the order of a whole run, and a summary of the merged run. Raises ShardError
+    unless outputs are every shard of the same run.
+    """
+    manifests = []
+    for output in outputs:
+        try:
+            with open(manifest_path(output), encoding="utf-8") as f:
+                manifests.append(json.load(f))
+        except FileNotFoundError:
+            raise ShardError(f"No shard manifest next to {output}, expected {manifest_path(output)}")
+    first = manifests[0]
+    for output, manifest in zip(outputs, manifests):
+        if any(manifest[name] != first[name] for name in ("shards", "key", "rules")):
+            raise ShardError(f"{output} is a shard of another run ({manifest['shards']} shards of {manifest['rules']} "
+                             f"rules by {manifest['key']}, expected {first['shards']} of {first['rules']} by "
+                             f"{first['key']})")
+    indexes = sorted(manifest["shard"] for manifest in manifests)
+    if indexes != list(range(1, first["shards"] + 1)):
+        raise ShardError(f"Expected shards 1 to {first['shards']} once each, got {', '.join(map(str, indexes))}")
+
+    entries = []
+    for output, manifest in zip(outputs, manifests):
+        with open(output, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        offset = 0
+        for number, (position, count) in enumerate(manifest["entries"]):
+            # the order within a shard breaks ties between the queries of one rule
+            entries.append((position, number, "\n".join(lines[offset:offset + count])))
+            offset += count
+        if offset != len(lines) - 1:
+            raise ShardError(f"{output} does not match its shard manifest")
+    entries.sort(key=lambda entry: entry[:2])
+    summary = {"shards": first["shards"], "rules": first["rules"],
+               "selected": sum(manifest["selected"] for manifest in manifests),
+               "failed": sum(manifest["failed"] for manifest in manifests)}
+    return [item for _, _, item in entries], summary
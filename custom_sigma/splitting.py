@@ -0,0 +1,264 @@
+"""
+Splitting of queries that exceed the query limits of the target SIEM.
+
+Oversized queries are split on their condition tree, not on the query text. OR groups that are reached from the
+root through AND/OR groups only are partitioned into chunks, and every chunk is converted together with the rest
+of the condition around it. A AND (x1 OR x2 OR x3) matches the same events as (A AND (x1 OR x2)) and (A AND x3)
+together, so the union of the parts equals the original query. Negated groups are never split.
+
+The group furthest over the limits on its own is split first. Chunks are planned from the converted length and term
+count of every OR argument on its own, then each part is converted and checked, and shortened in the rare case the
+estimate was too optimistic. Parts still over the limits because of another group are split again on that group,
+so with several oversized groups the parts are the combinations of their chunks.
+"""
+import dataclasses
+from collections import Counter
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+from sigma.conditions import ConditionAND, ConditionFieldEqualsValueExpression, ConditionItem, ConditionOR
+from sigma.conversion.state import ConversionState
+from sigma.exceptions import SigmaFeatureNotSupportedByBackendError
+from sigma.rule import SigmaRule
+
+from custom_sigma.backends.logrhythm.optimizer import Condition, count_terms, optimize_condition
+
+
+@dataclass(frozen=True)
+class QueryLimits:
+    """Limits of a single query, None for no limit."""
+    max_length: Optional[int] = None  # characters of the query, without output format metadata
+    max_clauses: Optional[int] = None  # value comparisons
+    max_list: Optional[int] = None  # values of one field:(a OR b) or field IN (a, b) list
+
+
+# LogRhythm searches run on Elasticsearch, whose boolean queries are limited to 1024 clauses by default. Splunk has
+# no hard limit, but searches of more than about 10k characters fail in the REST API and saved search editor
+BACKEND_LIMITS = {
+    "logrhythm": QueryLimits(max_length=8_000, max_clauses=1_024, max_list=500),
+    "splunk": QueryLimits(max_length=10_000, max_list=1_000),
+}
+DEFAULT_LIMITS = QueryLimits(max_length=10_000, max_clauses=1_024)
+
+
+class QueryLimitError(SigmaFeatureNotSupportedByBackendError):
+    """Raised when a query cannot be split into parts within the query limits."""
+
+
+def backend_limits(backend_name: str, overrides: Optional[QueryLimits] = None) -> QueryLimits:
+    """Query limits of a backend, with the limits set in overrides replacing the backend defaults."""
+    limits = BACKEND_LIMITS.get(backend_name.lower(), DEFAULT_LIMITS)
+    if overrides is None:
+        return limits
+    return dataclasses.replace(limits, **{field.name: getattr(overrides, field.name)
+                                          for field in dataclasses.fields(overrides)
+                                          if getattr(overrides, field.name) is not None})
+
+
+def largest_list(cond: Condition) -> int:
+    """Largest number of values of one field directly OR-ed together, the size of the longest in-expression."""
+    if not isinstance(cond, ConditionItem):
+        return 1
+    largest = max((largest_list(arg) for arg in cond.args), default=0)
+    if isinstance(cond, ConditionOR):
+        fields = Counter(arg.field for arg in cond.args if isinstance(arg, ConditionFieldEqualsValueExpression))
+        largest = max([largest, *fields.values()])
+    return largest
+
+
+def within_limits(limits: QueryLimits, cond: Condition, length: int) -> bool:
+    """True if a condition tree converted to a query of the given length is within the limits."""
+    return ((limits.max_length is None or length <= limits.max_length)
+            and (limits.max_clauses is None or count_terms(cond) <= limits.max_clauses)
+            and (limits.max_list is None or largest_list(cond) <= limits.max_list))
+
+
+def _link(cond: ConditionItem) -> ConditionItem:
+    for arg in cond.args:
+        arg.parent = cond
+    return cond
+
+
+def _replace(cond: ConditionItem, position: int, wrap: Callable[[Condition], Condition], arg: Condition) -> Condition:
+    # cond with its argument at position replaced, inside the tree built by wrap
+    args = cond.args[:position] + [arg] + cond.args[position + 1:]
+    return wrap(_link(type(cond)(args, cond.source)))
+
+
+class QuerySplitter:
+    """Splits the condition trees of one processed rule into parts within the limits."""
+
+    def __init__(self, backend, rule: SigmaRule, limits: QueryLimits, index: int):
+        self.backend = backend
+        self.rule = rule
+        self.limits = limits
+        self.index = index
+        self.separator = len(getattr(backend, "or_token", "OR")) + 2
+
+    def convert(self, cond: Condition) -> Tuple[ConversionState, str, str]:
+        """State, query and plain query text of a condition tree converted as a whole query."""
+        cond.parent = None
+        state = ConversionState(processing_state=dict(self.backend.last_processing_pipeline.state))
+        query = self.backend.convert_condition(cond, state)
+        text = self.backend.finalize_query(self.rule, query, self.index, state, self.backend.default_format)
+        return state, query, str(text)
+
+    def fits(self, cond: Condition, text: str) -> bool:
+        return within_limits(self.limits, cond, len(text))
+
+    def groups(self, cond: Condition, wrap: Callable[[Condition], Condition] = lambda cond: cond):
+        """
+        (group, wrap) of the OR groups of cond that can be split, reached through AND groups only. wrap builds the
+        whole condition tree around a replacement of the group, so parts keep the conditions they are combined with.
+        """
+        if isinstance(cond, ConditionOR) and len(cond.args) > 1:
+            yield cond, wrap
+            return
+        if isinstance(cond, (ConditionAND, ConditionOR)):
+            for position, arg in enumerate(cond.args):
+                if isinstance(arg, (ConditionAND, ConditionOR)):
+                    yield from self.groups(arg, partial(_replace, cond, position, wrap))
+
+    def excess(self, group: ConditionOR) -> float:
+        """Largest ratio of a measure of a group on its own (list size, terms, length) to its limit."""
+        limits = self.limits
+        ratios = []
+        if limits.max_list is not None:
+            ratios.append(largest_list(group) / limits.max_list)
+        if limits.max_clauses is not None:
+            ratios.append(count_terms(group) / limits.max_clauses)
+        if limits.max_length is not None:
+            parent = group.parent
+            ratios.append(len(self.convert(group)[2]) / limits.max_length)
+            group.parent = parent
+        return max(ratios, default=0.0)
+
+    def split(self, tree: Condition) -> List[Tuple]:
+        """
+        Converted parts (state, query) of a condition tree. The group furthest over the limits is split first,
+        parts still over the limits (e.g. because of another group) are split again, so with several oversized
+        groups every part combines one chunk of each of them.
+        """
+        state, query, text = self.convert(tree)
+        if self.fits(tree, text):
+            return [(state, query)]
+        groups = list(self.groups(tree))
+        if not groups:
+            raise QueryLimitError(f"Query exceeds the query limits and cannot be split: {self.rule.title}")
+        # the group breaking the limits on its own, the largest one when none does
+        group, wrap = max(groups, key=lambda item: (self.excess(item[0]), count_terms(item[0])))
+        return self._split_or(group, wrap, len(text))
+
+    def _split_or(self, cond: ConditionOR, wrap: Callable[[Condition], Condition], whole_length: int) -> List[Tuple]:
+        limits = self.limits
+        args = cond.args
+        lengths = [len(self.convert(arg)[2]) for arg in args]
+        terms = [count_terms(arg) for arg in args]
+        # what the conditions around the OR group add to every part
+        _, _, text = self.convert(wrap(args[0]))
+        length_overhead = len(text) - lengths[0] + 2
+        terms_overhead = count_terms(wrap(args[0])) - terms[0]
+        # arguments converted on their own repeat what an in-expression writes once (the field name), that
+        # difference to the length of the whole group is taken off every argument
+        shared = (sum(lengths) + self.separator * (len(args) - 1) - whole_length + length_overhead) / len(args)
+        lengths = [max(length - max(shared, 0), 1) for length in lengths]
+        # when the rest of the condition takes more than half of a limit, other groups are over it too and are split
+        # in the parts of this one. The group gets half of the limit, the rest is left to those splits
+        length_shift = max(length_overhead - limits.max_length // 2, 0) if limits.max_length is not None else 0
+        terms_shift = max(terms_overhead - limits.max_clauses // 2, 0) if limits.max_clauses is not None else 0
+        length_overhead -= length_shift
+        terms_overhead -= terms_shift
+
+        parts = []
+        start = 0
+        while start < len(args):
+            # the longest run of arguments estimated to fit, at least one
+            end, length, clauses, fields = start, length_overhead, terms_overhead, Counter()
+            while end < len(args):
+                arg = args[end]
+                field = arg.field if isinstance(arg, ConditionFieldEqualsValueExpression) else None
+                if end > start and ((limits.max_length is not None
+                                     and length + self.separator + lengths[end] > limits.max_length)
+                                    or (limits.max_clauses is not None and clauses + terms[end] > limits.max_clauses)
+                                    or (limits.max_list is not None and field is not None
+                                        and fields[field] + 1 > limits.max_list)):
+                    break
+                length += lengths[end] + (self.separator if end > start else 0)
+                clauses += terms[end]
+                if field is not None:
+                    fields[field] += 1
+                end += 1
+            if start == 0 and end == len(args):
+                # the group is within its share of the limits but the whole is not, it is halved anyway so every
+                # part is smaller than the tree it comes from
+                end = len(args) // 2
+
+            # the estimate is checked on the converted part, which is shortened until the group is within its share
+            # of the limits. Parts still over the limits are split again
+            while True:
+                chunk = args[start] if end - start == 1 else _link(ConditionOR(args[start:end], cond.source))
+                whole = wrap(chunk)
+                state, query, text = self.convert(whole)
+                if self.fits(whole, text):
+                    parts.append((state, query))
+                    break
+                if end - start == 1 or (
+                        (limits.max_length is None or len(text) - length_shift <= limits.max_length)
+                        and (limits.max_clauses is None or count_terms(whole) - terms_shift <= limits.max_clauses)
+                        and (limits.max_list is None or largest_list(chunk) <= limits.max_list)):
+                    parts.extend(self.split(whole))
+                    break
+                # one argument less at least, so parts over the clause or list limits shrink too
+                count = end - start - 1
+                if limits.max_length is not None and len(text) - length_shift > limits.max_length:
+                    count = min(count, (end - start) * limits.max_length // (len(text) - length_shift))
+                end = start + max(count, 1)
+            start = end
+        return parts
+
+
+def split_rule(backend, rule: SigmaRule, limits: QueryLimits, output_format: Optional[str] = None) -> List[str]:
+    """
+    Convert a rule like backend.convert_rule, splitting queries that exceed the limits into several queries. Parts
+    are named after the rule title with "(part i of n)" appended, in a stable order.
+    """
+    queries = backend.convert_rule(rule, output_format)
+    if rule._backreferences or not queries:
+        return queries
+    # every value takes at least a character, queries shorter than every limit cannot exceed any of them
+    bounds = [limit for limit in dataclasses.astuple(limits) if limit is not None]
+    if not bounds or all(len(str(query)) <= min(bounds) for query in queries):
+        return queries
+
+    if output_format is None:
+        # the LogRhythm backend finalizes queries in the output format it was created with, other backends (whose
+        # output format is applied to the whole collection) in their default format
+        output_format = backend.output_format if backend.name == "LogRhythm Lucene" else backend.default_format
+    # the optimizer statistics of the backend describe the rule as converted above, not the split attempts
+    statistics = {name: getattr(backend, name) for name in ("terms_before", "terms_after") if hasattr(backend, name)}
+    split = []
+    try:
+        for index, condition in enumerate(rule.detection.parsed_condition):
+            tree = condition.parsed
+            if getattr(backend, "optimize", False):
+                tree = optimize_condition(tree)
+            # finalized queries are at least as long as the query text, most fit without converting again
+            if within_limits(limits, tree, len(str(queries[index]))):
+                split.append(queries[index])
+                continue
+            parts = QuerySplitter(backend, rule, limits, index).split(tree)
+            if len(parts) == 1:
+                split.append(queries[index])
+                continue
+            title = rule.title
+            try:
+                for number, (state, query) in enumerate(parts, 1):
+                    rule.title = f"{title} (part {number} of {len(parts)})"
+                    split.append(backend.finalize_query(rule, query, index, state, output_format))
+            finally:
+                rule.title = title
+    finally:
+        for name, value in statistics.items():
+            setattr(backend, name, value)
+    return split
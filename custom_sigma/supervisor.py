@@ -0,0 +1,213 @@
+"""
+Supervised conversion: rules are converted one at a time in worker processes that are watched by the parent.
+
+A rule that runs longer than the timeout is killed with its worker, a rule allocating more than the memory
+limit fails with MemoryError in its worker, and a worker dying on a rule (segfault, out of memory killer) is
+noticed through its process sentinel. The rule is recorded as failed with the reason, the worker is replaced by a
+fresh one and the batch continues. Exceptions raised while converting a rule fail that rule only.
+
+The memory limit caps the address space a worker may grow by after it is initialized, through RLIMIT_AS. It is
+only available on platforms with the resource module.
+"""
+import time
+from collections import deque
+from multiprocessing import connection, get_context
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MEMORY_LIMIT_SUPPORTED = resource is not None and hasattr(resource, "RLIMIT_AS")
+
+
+def _limit_memory(limit: int):
+    # the limit is counted from the address space of the initialized worker, which holds the backend
+    try:
+        with open("/proc/self/statm") as f:
+            baseline = int(f.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        baseline = 0
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    soft = baseline + limit
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _serve(conn, initializer, initargs, function, finalizer, memory_limit):
+    # worker process: converts the files it is sent until it receives None
+    try:
+        initializer(*initargs)
+        if memory_limit:
+            _limit_memory(memory_limit)
+    except Exception as e:
+        conn.send(("init_error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready",))
+    while True:
+        try:
+            file = conn.recv()
+        except EOFError:
+            return
+        if file is None:
+            break
+        try:
+            conn.send(("result", function(file)))
+        except MemoryError:
+            # the state of a worker that ran out of memory cannot be trusted, it is replaced
+            conn.send(("memory",))
+            return
+        except Exception as e:
+            conn.send(("result", (None, f"Conversion raised {type(e).__name__}: {file}: {e}")))
+    if finalizer:
+        finalizer()
+
+
+def _exit_reason(exitcode: Optional[int]) -> str:
+    if exitcode is not None and exitcode < 0:
+        return f"signal {-exitcode}"
+    return f"exit code {exitcode}"
+
+
+class _Worker:
+    def __init__(self, context, args):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, *args), daemon=True)
+        self.process.start()
+        child.close()
+        self.ready = False
+        self.task: Optional[Tuple[int, str]] = None
+        self.deadline: Optional[float] = None
+
+    def assign(self, task: Tuple[int, str], timeout: Optional[float]):
+        self.task = task
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.conn.send(task[1])
+
+    def kill(self, grace: float = 0):
+        # a worker that is exiting on its own gets grace seconds to report its exit code
+        self.process.join(grace)
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RuleSupervisor:
+    """
+    Runs function(file) for every file in supervised worker processes, each initialized once with
+    initializer(*initargs). function returns (query, None) or (None, failure message), the supervisor returns
+    (None, failure message) for rules that time out, run out of memory or crash their worker.
+    """
+
+    def __init__(self, workers: int, initializer: Callable, initargs: tuple, function: Callable,
+                 finalizer: Optional[Callable] = None, timeout: Optional[float] = None,
+                 memory_limit: Optional[int] = None, window: int = 256):
+        self.workers = max(workers, 1)
+        self.args = (initializer, initargs, function, finalizer, memory_limit)
+        self.timeout = timeout
+        self.window = max(window, self.workers)  # results buffered ahead of the slowest rule
+        self.context = get_context()
+        self.restarts = 0
+
+    def imap(self, tasks: Iterable[Tuple[str, Optional[tuple]]]) -> Iterator[Tuple[str, tuple]]:
+        """
+        tasks are (file, result) pairs, result None for files to convert. Yields (file, result) in the order of
+        tasks, reading them as results are consumed.
+        """
+        tasks = iter(tasks)
+        waiting = deque()
+        results = {}
+        read = done = 0
+        exhausted = False
+        workers = [_Worker(self.context, self.args) for _ in range(self.workers)]
+        try:
+            while True:
+                while not exhausted and read - done < self.window:
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                        break
+                    file, result = task
+                    if result is None:
+                        waiting.append((read, file))
+                    else:
+                        results[read] = task
+                    read += 1
+                for worker in workers:
+                    if waiting and worker.ready and worker.task is None:
+                        worker.assign(waiting.popleft(), self.timeout)
+                if done in results:
+                    while done in results:
+                        yield results.pop(done)
+                        done += 1
+                    continue
+                if exhausted and done == read:
+                    return
+                self._wait(workers, results)
+        finally:
+            for worker in workers:
+                worker.stop()
+
+    def _wait(self, workers, results):
+        deadlines = [worker.deadline for worker in workers if worker.deadline is not None]
+        timeout = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+        ready = set(connection.wait([worker.conn for worker in workers]
+                                    + [worker.process.sentinel for worker in workers], timeout))
+        now = time.monotonic()
+        for position, worker in enumerate(workers):
+            message = None
+            if worker.conn in ready or worker.conn.poll():
+                try:
+                    message = worker.conn.recv()
+                except EOFError:
+                    pass
+                if message is not None and self._handle(worker, message, results):
+                    continue
+            elif worker.process.sentinel not in ready and (worker.deadline is None or now < worker.deadline):
+                continue
+            # the worker ran out of memory, timed out or exited
+            timed_out = (message is None and worker.deadline is not None and now >= worker.deadline
+                         and worker.process.exitcode is None)
+            worker.kill(grace=0 if timed_out else 1)
+            if worker.task is not None:
+                index, file = worker.task
+                if message == ("memory",):
+                    message = f"Conversion exceeded the memory limit: {file}"
+                elif timed_out:
+                    message = f"Conversion timed out after {self.timeout:g} seconds: {file}"
+                else:
+                    message = f"Conversion worker crashed ({_exit_reason(worker.process.exitcode)}): {file}"
+                results[index] = (file, (None, message))
+            elif not worker.ready:
+                raise RuntimeError(f"Conversion worker exited before it was ready "
+                                   f"({_exit_reason(worker.process.exitcode)})")
+            self.restarts += 1
+            workers[position] = _Worker(self.context, self.args)
+
+    def _handle(self, worker, message, results) -> bool:
+        # True if the worker can take the next rule
+        if message[0] == "ready":
+            worker.ready = True
+        elif message[0] == "result":
+            index, file = worker.task
+            results[index] = (file, message[1])
+            worker.task = worker.deadline = None
+        elif message[0] == "init_error":
+            raise RuntimeError(f"Conversion worker failed to start: {message[1]}")
+        else:
+            return False
+        return True
@@ -0,0 +1,144 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# inotify event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+class Inotify:
+    """Minimal Linux inotify binding. Events are only used as wake ups, changes are found by comparing snapshots."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def watch(self, directories: Iterable[str]):
+        # adding an already watched directory only updates its mask, so recreated directories are simply added
+        # again. Directories removed in the meantime fail with ENOENT, the kernel drops watches of deleted ones
+        for directory in directories:
+            self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """Block until events arrive or timeout seconds pass, True if there were events. Events are discarded."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        while True:
+            try:
+                if not os.read(self.fd, 64 * 1024):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RuleWatcher:
+    """
+    Watches a rule tree and yields batches of (changed, deleted) rule files. Uses inotify where available and polls
+    otherwise. A batch is only reported once the tree has been quiet for debounce seconds, so bursts such as a git
+    checkout or an editor's save-by-rename end up in one batch.
+    """
+
+    def __init__(self, root: str, list_files: Callable[[], Iterable[str]], debounce: float = 0.5,
+                 poll_interval: float = 1.0, use_inotify: bool = True):
+        self.root = root
+        self.list_files = list_files
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+        self._watch_directories()
+        self.snapshot = self._snapshot()
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.inotify else "polling"
+
+    @property
+    def files(self) -> List[str]:
+        """Rule files of the last snapshot, in the order list_files returned them."""
+        return list(self.snapshot)
+
+    def _snapshot(self) -> Snapshot:
+        snapshot = {}
+        for file in self.list_files():
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _watch_directories(self):
+        if self.inotify:
+            self.inotify.watch(directory for directory, _, _ in os.walk(self.root))
+
+    def _wait(self, timeout: float) -> bool:
+        if self.inotify:
+            return self.inotify.wait(timeout)
+        time.sleep(timeout)
+        return True
+
+    def _settle(self) -> Snapshot:
+        # wait until no event arrives (inotify) or the snapshot stops changing (polling) for debounce seconds
+        if self.inotify:
+            while self.inotify.wait(self.debounce):
+                pass
+            self._watch_directories()
+            return self._snapshot()
+        snapshot = self._snapshot()
+        while True:
+            time.sleep(self.debounce)
+            settled = self._snapshot()
+            if settled == snapshot:
+                return settled
+            snapshot = settled
+
+    def changes(self) -> Iterator[Tuple[List[str], List[str]]]:
+        while True:
+            if not self._wait(None if self.inotify else self.poll_interval):
+                continue
+            if not self.inotify and self._snapshot() == self.snapshot:
+                continue
+            current = self._settle()
+            changed = [file for file, state in current.items() if self.snapshot.get(file) != state]
+            deleted = [file for file in self.snapshot if file not in current]
+            self.snapshot = current
+            if changed or deleted:
+                yield changed, deleted
+
+    def close(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
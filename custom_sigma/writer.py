@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from os import path
+from typing import Dict, List, Optional, Tuple
+
+# savedsearches.conf style stanza header on a line of its own
+STANZA = re.compile(r"^\[([^\]\n]+)\]$", re.MULTILINE)
+
+
+class AtomicRuleWriter:
+    """
+    Writes converted rules to a temporary file next to the destination through a large buffer and moves it
+    over the destination on commit(), so readers (e.g. a deploying Splunk app) never see a half written file.
+    The destination is validated when the writer is created, before any conversion work is done.
+    """
+
+    def __init__(self, destination: str, buffer_size: int = 1024 * 1024):
+        self.destination = destination
+        directory = path.dirname(path.abspath(destination))
+        if path.isdir(destination):
+            raise IsADirectoryError(f"{destination} is a directory")
+        if path.exists(destination) and not os.access(destination, os.W_OK):
+            raise PermissionError(f"Insufficient permissions to write in {destination}")
+        # raises PermissionError/FileNotFoundError right away when the directory is not writable
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix=f".{path.basename(destination)}.",
+                                              suffix=".tmp")
+        self.file = open(fd, "w", encoding="utf-8", buffering=buffer_size)
+        self.count = 0
+
+    def write(self, item: str, name: Optional[str] = None):
+        # name identifies the item (e.g. its rule file) in changesets, see ChangesetWriter
+        self.file.write(item + "\n")
+        self.count += 1
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if path.exists(self.destination):
+            os.chmod(self.temp_path, os.stat(self.destination).st_mode & 0o7777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(self.temp_path, 0o666 & ~umask)
+        os.replace(self.temp_path, self.destination)
+
+    def abort(self):
+        self.file.close()
+        if path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def stanza_entries(content: str) -> Optional[List[Tuple[str, str]]]:
+    """(name, digest) of every stanza of savedsearches.conf style content, None if it has no stanzas."""
+    headers = list(STANZA.finditer(content))
+    if not headers:
+        return None
+    ends = [header.start() for header in headers[1:]] + [len(content)]
+    return [(header.group(1), _digest(content[header.start():end].strip()))
+            for header, end in zip(headers, ends)]
+
+
+def unique_entries(entries: List[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    Digests by entry name. Entries sharing a name (e.g. rules with the same title) are keyed by occurrence,
+    "name", "name #2", ... so none of them is dropped.
+    """
+    unique: Dict[str, str] = {}
+    occurrences: Dict[str, int] = {}
+    for name, digest in entries:
+        occurrences[name] = occurrences.get(name, 0) + 1
+        unique[name if occurrences[name] == 1 else f"{name} #{occurrences[name]}"] = digest
+    return unique
+
+
+class ChangesetWriter(AtomicRuleWriter):
+    """
+    AtomicRuleWriter comparing the new output with the previous one entry by entry. Entries are the stanzas of
+    stanza formatted output, the named items otherwise. On commit, the destination is left untouched when the
+    output did not change, and a JSON changeset lists the added, changed and removed entries. The changeset also
+    holds the digest of every entry, it is the index the next run compares against.
+    """
+
+    def __init__(self, destination: str, changeset: str, buffer_size: int = 1024 * 1024):
+        super().__init__(destination, buffer_size)
+        self.changeset = changeset
+        self.items: List[Tuple[str, str]] = []
+        self.summary: Dict = {}
+
+    def write(self, item: str, name: Optional[str] = None):
+        super().write(item, name)
+        digest = _digest(item)
+        self.items.append((name or digest, digest))
+
+    def _previous(self) -> Dict[str, str]:
+        try:
+            with open(self.changeset, encoding="utf-8") as f:
+                changeset = json.load(f)
+            if changeset.get("destination") == path.abspath(self.destination):
+                return changeset["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        # without an index of the previous run, stanzas of the current destination are compared
+        try:
+            with open(self.destination, encoding="utf-8") as f:
+                return unique_entries(stanza_entries(f.read()) or [])
+        except (OSError, UnicodeDecodeError):
+            return {}
+
+    def commit(self):
+        self.file.flush()
+        with open(self.temp_path, encoding="utf-8") as f:
+            content = f.read()
+        entries = unique_entries(stanza_entries(content) or self.items)
+        previous = self._previous()
+        try:
+            with open(self.destination, encoding="utf-8") as f:
+                unchanged = f.read() == content
+        except (OSError, UnicodeDecodeError):
+            unchanged = False
+
+        if unchanged:
+            # readers of the destination (e.g. Splunk watching its configuration) see no change at all
+            self.abort()
+        else:
+            super().commit()
+        self.summary = {
+            "destination": path.abspath(self.destination),
+            "written": not unchanged,
+            "added": [name for name in entries if name not in previous],
+            "changed": [name for name, digest in entries.items() if name in previous and previous[name] != digest],
+            "removed": [name for name in previous if name not in entries],
+            "unchanged": sum(1 for name, digest in entries.items() if previous.get(name) == digest),
+            "entries": entries,
+        }
+        with AtomicRuleWriter(self.changeset) as writer:
+            writer.write(json.dumps(self.summary, indent=2))
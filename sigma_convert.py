@@ -1,61 +1,680 @@
 import codecs
-from os import listdir, path, getcwd
-from yaml import load, UnsafeLoader
-import yaml
+import json
+import pickle
+import signal
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache
+from itertools import chain
+from os import path, getcwd, cpu_count, scandir
 
 import typer
-from typing_extensions import Annotated, Optional
+from typing_extensions import Annotated, List, Optional
+from yaml import YAMLError
 
-from sigmaiq import SigmAIQBackend, SigmAIQPipelineResolver
-from sigma.rule import SigmaRule
-from sigma.exceptions import SigmaFeatureNotSupportedByBackendError, SigmaTransformationError
-from custom_sigma.backends.logrhythm import logrhythm_lucene
-from custom_sigma.pipelines.logrhythm import windows
+# sigmaiq imports every bundled backend and pipeline, so backends, pipelines and the sigma rule model are
+# imported where they are first needed. --help and single backend runs only pay for what they use
+from sigma.exceptions import (SigmaError, SigmaFeatureNotSupportedByBackendError, SigmaTransformationError,
+                              SigmaRuleLocation)
+from custom_sigma.archive import archive_files, is_archive, read_file
+from custom_sigma.cache import ConversionCache
+from custom_sigma.failures import FailureReport
+from custom_sigma.loader import ParsedRuleCache, load_rule, load_yaml
+from custom_sigma.profiling import NULL_PROFILER, Profiler
+from custom_sigma.writer import AtomicRuleWriter, ChangesetWriter
 
 app = typer.Typer()
 
+CACHE_DIR = path.join(path.dirname(path.realpath(__file__)), ".cache")
 
-def get_files(directory):
-    return [f for f in listdir(directory) if f.endswith(".yml")]
 
+RULE_EXTENSIONS = (".yml", ".yaml")
 
-def parse_files(rule_source, directory):
-    # parse all yml files in current directory into dicts, then into a sigma collection
-    if directory:
-        files = get_files(rule_source)
-        if len(files) == 0:
-            raise FileNotFoundError(f"No .yml files found in the specified folder: {rule_source}")
-        paths = [path.join(rule_source, f) for f in files]
+
+def _matches(relative_path, patterns):
+    return any(fnmatch(relative_path, pattern) for pattern in patterns)
+
+
+def get_files(directory, include=(), exclude=(), relative=""):
+    # walk the rule tree depth first in name order, yielding rule files as they are found.
+    # Only the entries of the directory currently being read are held in memory
+    with scandir(directory) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        relative_path = f"{relative}{entry.name}"
+        if exclude and _matches(relative_path, exclude):
+            continue
+        if entry.is_dir():
+            yield from get_files(entry.path, include, exclude, relative_path + "/")
+        elif entry.name.endswith(RULE_EXTENSIONS) and (not include or _matches(relative_path, include)):
+            yield entry.path
+
+
+def parse_files(rule_source, directory, include=(), exclude=()):
+    # lazily discover rule files below rule_source, raising early when there is nothing to convert. Rules of
+    # .zip/.tar.gz archives are listed as <archive>/<member> paths, read from the archive without extracting it
+    if is_archive(rule_source):
+        paths = archive_files(rule_source, include, exclude)
+    elif not directory:
+        return iter([rule_source])
     else:
-        paths = [rule_source]
-    return paths
+        paths = get_files(rule_source, include, exclude)
+    first = next(paths, None)
+    if first is None:
+        raise FileNotFoundError(f"No .yml files found in the specified folder: {rule_source}")
+    return chain([first], paths)
 
 
-def convert_rules(paths, backend):
-    rules = []
+@lru_cache(maxsize=None)
+def resolve_pipeline(backend_name, pipeline_name=""):
+    # pipelines are compiled once per process and shared by every backend using them
+    from custom_sigma.pipelines.compiled import compile_pipeline
+
+    if backend_name.lower() == "logrhythm":
+        # custom pipeline for logrhythm
+        from custom_sigma.pipelines.logrhythm import windows
+        return compile_pipeline(windows.lr_windows_v2())
+    elif pipeline_name:
+        from sigmaiq import SigmAIQPipelineResolver
+        return compile_pipeline(
+            SigmAIQPipelineResolver(processing_pipelines=pipeline_name.split()).process_pipelines())
+    else:
+        return ""
+
+
+def create_backend(backend_name, pipeline_name="", output_format="default", optimize=True, limits=None,
+                   lookups=None):
+    # limits: QueryLimits overriding the backend defaults, queries are only split when given
+    # lookups: (directory, threshold) to move value lists with at least threshold values into lookup files
+    pipeline = resolve_pipeline(backend_name, pipeline_name)
+
+    # generate backend
+    if backend_name.lower() == "logrhythm":
+        from custom_sigma.backends.logrhythm import logrhythm_lucene
+        backend = logrhythm_lucene.LogRhythmBackend(pipeline, optimize=optimize, output_format=output_format)
+    else:
+        from sigmaiq import SigmAIQBackend
+        if pipeline:
+            backend = SigmAIQBackend(backend=backend_name.lower(),
+                                     processing_pipeline=pipeline,
+                                     output_format=output_format).create_backend()
+        else:
+            backend = SigmAIQBackend(backend=backend_name.lower()).create_backend()
+
+    if limits is not None:
+        from custom_sigma.splitting import backend_limits
+        backend.query_limits = backend_limits(backend_name, limits)
+    if lookups is not None:
+        from custom_sigma.lookups import LookupLists
+        LookupLists(backend_name, *lookups).install(backend)
+    return backend
+
+
+def convert_sigma_rule(rule, backend, name, profiler=NULL_PROFILER):
+    # converts a SigmaRule, name identifies the rule in failure messages.
+    # Returns (query, None) on success or (None, failure message). Queries split to stay within the query
+    # limits of the backend are returned as one line per part
+    limits = getattr(backend, "query_limits", None)
+    try:
+        # pipeline transformations are recorded as their own stage when profiling
+        with profiler.stage("query"):
+            if limits is not None:
+                from custom_sigma.splitting import split_rule
+                return "\n".join(split_rule(backend, rule, limits)), None
+            return backend.convert_rule(rule)[0], None
+
+    except SigmaFeatureNotSupportedByBackendError:
+        return None, f"Failed at converting SIGMA to query: {name}"
+    except SigmaTransformationError as e:
+        return None, f"Rule contains field with no official conversion: {name}"
+
+
+def convert_parsed(yml, backend, name, profiler=NULL_PROFILER):
+    # converts a parsed rule dict, returns (query, None) on success or (None, failure message)
+    from sigma.rule import SigmaRule
+
+    with profiler.stage("rule"):
+        rule = SigmaRule.from_dict(yml)
+    return convert_sigma_rule(rule, backend, name, profiler)
+
+
+def convert_file_for_targets(file, backends, rule_cache=None):
+    # returns a (query, error) per backend. The file is read, parsed and turned into a SigmaRule once.
+    # Pipelines modify the rule they are applied to, so every backend but the last converts an unpickled
+    # copy, which is several times cheaper than building the rule again
+    from sigma.rule import SigmaRule
+
+    try:
+        yml = rule_cache.load(file) if rule_cache else load_rule(file)
+    except FileNotFoundError:
+        return [(None, f"Failed at opening file: {file}")] * len(backends)
+    rule = SigmaRule.from_dict(yml)
+    pickled = pickle.dumps(rule, protocol=pickle.HIGHEST_PROTOCOL) if len(backends) > 1 else None
+    return [convert_sigma_rule(rule if position == len(backends) - 1 else pickle.loads(pickled), backend, file)
+            for position, backend in enumerate(backends)]
+
+
+def convert_file(file, backend, rule_cache=None, profiler=NULL_PROFILER):
+    # returns (query, None) on success or (None, failure message)
+    try:
+        with profiler.rule(file):
+            if rule_cache:
+                with profiler.stage("parse"):
+                    yml = rule_cache.load(file)
+            else:
+                with profiler.stage("read"):
+                    content = read_file(file)
+                with profiler.stage("parse"):
+                    yml = load_yaml(content)
+            return convert_parsed(yml, backend, file, profiler)
+
+    except FileNotFoundError:
+        return None, f"Failed at opening file: {file}"
+
+
+def convert_rules(paths, backend, cache=None, rule_cache=None, profiler=NULL_PROFILER):
+    # yields (file, query, error) for every path, in order
     for file in paths:
-        try:
-            yml = load(open(file, encoding='utf-8'), Loader=yaml.FullLoader)
-            rule = SigmaRule.from_dict(yml)
+        key = cache.key_for_file(file) if cache else None
+        converted_rule = cache.get(key) if cache else None
+        if converted_rule is None:
+            converted_rule, error = convert_file(file, backend, rule_cache, profiler)
+            if error:
+                yield file, None, error
+                continue
+            if cache:
+                cache.put(key, converted_rule)
+        yield file, converted_rule, None
+
+
+def _lookup_targets(file, caches, count):
+    # cache keys and cached (query, None) results of every target, None where the file has to be converted
+    if not caches:
+        return [None] * count, [None] * count
+    try:
+        content = read_file(file)
+    except OSError:
+        return [None] * count, [None] * count
+    keys = [cache.key(content) for cache in caches]
+    queries = [cache.get(key) for cache, key in zip(caches, keys)]
+    return keys, [None if query is None else (query, None) for query in queries]
+
+
+def _store_targets(results, missing, converted, keys, caches):
+    for position, (query, error) in zip(missing, converted):
+        results[position] = (query, error)
+        if caches and not error:
+            caches[position].put(keys[position], query)
+    return results
+
+
+def convert_rules_for_targets(paths, backends, caches=None, rule_cache=None):
+    # yields (file, [(query, error) per target]) for every path, in order. Only targets without a
+    # cached query convert the file, sharing one read and parse of it
+    for file in paths:
+        keys, results = _lookup_targets(file, caches, len(backends))
+        missing = [position for position, result in enumerate(results) if result is None]
+        if missing:
+            converted = convert_file_for_targets(file, [backends[position] for position in missing], rule_cache)
+            _store_targets(results, missing, converted, keys, caches)
+        yield file, results
+
 
-            converted_rule = backend.convert_rule(rule)[0]
-            rules.append(converted_rule)
+def backend_output_format(backend, output_format):
+    # sigmaiq backends validate the output format on creation, others fall back to their default format
+    output_format = getattr(backend, "output_format", None) or output_format
+    return output_format if output_format in backend.formats else backend.default_format
 
+
+def convert_collection(paths, backend, output_format="default", rule_cache=None):
+    # bulk mode: the whole rule set is loaded into one SigmaCollection so filters and correlation rules are
+    # resolved, every query of multi-query rules is kept and the backend finalizes the output once.
+    # Returns (file, queries, error) for every rule and the finalized output
+    from sigma.collection import SigmaCollection
+    from sigma.rule import SigmaRule
+
+    rules = []
+    results = []
+    for file in paths:
+        try:
+            yml = rule_cache.load(file) if rule_cache else load_rule(file)
         except FileNotFoundError:
-            print(f"Failed at opening file: {file}")
+            results.append((file, None, f"Failed at opening file: {file}"))
             continue
+        rules.extend(SigmaCollection.from_dicts([yml], source=SigmaRuleLocation(file)).rules)
+
+    collection = SigmaCollection(rules)
+    collection.resolve_rule_references()
+    output_format = backend_output_format(backend, output_format)
+    limits = getattr(backend, "query_limits", None)
+    if limits is not None:
+        from custom_sigma.splitting import split_rule
+    queries = []
+    for rule in collection.rules:
+        file = str(rule.source.path) if rule.source else rule.title
+        try:
+            if isinstance(rule, SigmaRule) and limits is not None:
+                converted = split_rule(backend, rule, limits, output_format)
+            elif isinstance(rule, SigmaRule):
+                converted = backend.convert_rule(rule, output_format)
+            else:
+                converted = backend.convert_correlation_rule(rule, output_format)
         except SigmaFeatureNotSupportedByBackendError:
-            print(f"Failed at converting SIGMA to query: {file}")
+            results.append((file, None, f"Failed at converting SIGMA to query: {file}"))
+            continue
+        except SigmaTransformationError:
+            results.append((file, None, f"Rule contains field with no official conversion: {file}"))
+            continue
+        queries.extend(converted)
+        results.append((file, converted, None))
+
+    return results, backend.finalize(queries, output_format)
+
+
+# backend (or backends of every target) and parsed rule cache of the current worker process, built once by
+# _init_worker or _init_targets_worker
+_worker_backend = None
+_worker_backends = []
+_worker_rule_cache = None
+
+
+def _init_worker(backend_name, pipeline_name, output_format, rule_cache_dir=None, optimize=True, limits=None,
+                 lookups=None):
+    global _worker_backend, _worker_rule_cache
+    _worker_backend = create_backend(backend_name, pipeline_name, output_format, optimize, limits, lookups)
+    _worker_rule_cache = ParsedRuleCache(rule_cache_dir) if rule_cache_dir else None
+
+
+def _convert_batch_in_worker(files):
+    results = [convert_file(file, _worker_backend, _worker_rule_cache) for file in files]
+    if _worker_rule_cache:
+        _worker_rule_cache.flush()
+    return results
+
+
+def _convert_file_in_worker(file):
+    try:
+        return convert_file(file, _worker_backend, _worker_rule_cache)
+    except (SigmaError, YAMLError) as e:
+        return None, f"Failed at parsing rule: {file}: {e}"
+
+
+def _close_worker():
+    if _worker_rule_cache:
+        _worker_rule_cache.close()
+
+
+def _init_targets_worker(targets, rule_cache_dir=None, optimize=True, limits=None):
+    global _worker_backends, _worker_rule_cache
+    _worker_backends = [create_backend(*target, optimize=optimize, limits=limits) for target in targets]
+    _worker_rule_cache = ParsedRuleCache(rule_cache_dir) if rule_cache_dir else None
+
+
+def _convert_targets_batch_in_worker(items):
+    # items are (file, positions of the targets to convert it for)
+    results = [convert_file_for_targets(file, [_worker_backends[position] for position in missing],
+                                        _worker_rule_cache)
+               for file, missing in items]
+    if _worker_rule_cache:
+        _worker_rule_cache.flush()
+    return results
+
+
+def _collect_batch(batch, future, cache):
+    results = iter(future.result()) if future else iter(())
+    for file, key, converted_rule in batch:
+        if converted_rule is None:
+            converted_rule, error = next(results)
+            if error:
+                yield file, None, error
+                continue
+            if cache:
+                cache.put(key, converted_rule)
+        yield file, converted_rule, None
+
+
+def convert_rules_parallel(paths, backend_name, pipeline_name, output_format, jobs, cache=None, rule_cache_dir=None,
+                           batch_size=16, optimize=True, limits=None, lookups=None):
+    # each worker builds its own backend and pipeline once. Paths are sent in small batches as they are
+    # discovered, with a bounded number of batches in flight, and results are yielded in the order of
+    # paths so the output matches a serial run. Cache lookups happen here, only misses go to the workers
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(backend_name, pipeline_name, output_format, rule_cache_dir,
+                                       optimize, limits, lookups)) as executor:
+        batch = []
+        for file in paths:
+            key = cache.key_for_file(file) if cache else None
+            batch.append((file, key, cache.get(key) if cache else None))
+            if len(batch) < batch_size:
+                continue
+            misses = [file for file, _, converted_rule in batch if converted_rule is None]
+            pending.append((batch, executor.submit(_convert_batch_in_worker, misses) if misses else None))
+            batch = []
+            while len(pending) > jobs * 2:
+                yield from _collect_batch(*pending.popleft(), cache)
+        if batch:
+            misses = [file for file, _, converted_rule in batch if converted_rule is None]
+            pending.append((batch, executor.submit(_convert_batch_in_worker, misses) if misses else None))
+        while pending:
+            yield from _collect_batch(*pending.popleft(), cache)
+
+
+def convert_rules_supervised(paths, supervisor, cache=None):
+    # yields (file, query, error) for every path in order, converting cache misses with a RuleSupervisor: rules
+    # exceeding its timeout or memory limit, or crashing their worker, fail on their own and the batch continues
+    keys = deque()
+
+    def tasks():
+        for file in paths:
+            key = cache.key_for_file(file) if cache else None
+            converted_rule = cache.get(key) if cache else None
+            keys.append(None if converted_rule is not None else key)
+            yield file, None if converted_rule is None else (converted_rule, None)
+
+    for file, (converted_rule, error) in supervisor.imap(tasks()):
+        key = keys.popleft()
+        if error:
+            yield file, None, error
             continue
-        except SigmaTransformationError as e:
-            print(f"Rule contains field with no official conversion: {file}")
+        if cache and key is not None:
+            cache.put(key, converted_rule)
+        yield file, converted_rule, None
+
+
+def _submit_targets_batch(executor, batch):
+    items = [(file, missing) for file, _, _, missing in batch if missing]
+    return batch, executor.submit(_convert_targets_batch_in_worker, items) if items else None
+
+
+def _collect_targets_batch(batch, future, caches):
+    converted = iter(future.result()) if future else iter(())
+    for file, keys, results, missing in batch:
+        if missing:
+            _store_targets(results, missing, next(converted), keys, caches)
+        yield file, results
+
+
+def convert_rules_for_targets_parallel(paths, targets, jobs, caches=None, rule_cache_dir=None, batch_size=16,
+                                       optimize=True, limits=None):
+    # convert_rules_parallel for several targets: each worker builds the backend of every target once and
+    # converts a file for all targets missing from the cache, results are yielded in the order of paths
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_targets_worker,
+                             initargs=(targets, rule_cache_dir, optimize, limits)) as executor:
+        batch = []
+        for file in paths:
+            keys, results = _lookup_targets(file, caches, len(targets))
+            batch.append((file, keys, results, [position for position, result in enumerate(results)
+                                                if result is None]))
+            if len(batch) < batch_size:
+                continue
+            pending.append(_submit_targets_batch(executor, batch))
+            batch = []
+            while len(pending) > jobs * 2:
+                yield from _collect_targets_batch(*pending.popleft(), caches)
+        if batch:
+            pending.append(_submit_targets_batch(executor, batch))
+        while pending:
+            yield from _collect_targets_batch(*pending.popleft(), caches)
+
+
+def watch_rules(watcher, entries, backend, output_file, cache=None, rule_cache=None, costs=None, quarantine=None,
+                quarantined=None):
+    # reconverts the rules of every batch of changes with the warm backend and updates their entries. The
+    # destination is rewritten from the queries kept in memory, in rule discovery order, only when a query changed.
+    # With costs, queries above the maximum cost are kept out of the destination, and with quarantine written to
+    # that file from the quarantined entries instead
+    if costs:
+        from custom_sigma.cost import analyze_query
+    quarantined = {} if quarantined is None else quarantined
+    for changed, deleted in watcher.changes():
+        modified = quarantine_modified = False
+        for file in deleted:
+            modified |= entries.pop(file, None) is not None
+            quarantine_modified |= quarantined.pop(file, None) is not None
+            print(f"Removed: {file}")
+        for file in changed:
+            try:
+                _, converted_rule, error = next(convert_rules([file], backend, cache, rule_cache))
+            except (SigmaError, YAMLError) as e:
+                converted_rule, error = None, f"Failed at parsing rule: {file}: {e}"
+            if error:
+                print(error)
+                modified |= entries.pop(file, None) is not None
+                quarantine_modified |= quarantined.pop(file, None) is not None
+                continue
+            if costs and costs.exceeds(analyze_query(converted_rule)):
+                # like the first run, expensive queries never reach the destination
+                print(f"Above the maximum cost of {costs.max_cost:g}, not written: {file}")
+                modified |= entries.pop(file, None) is not None
+                if quarantine and quarantined.get(file) != converted_rule:
+                    quarantined[file] = converted_rule
+                    quarantine_modified = True
+                continue
+            quarantine_modified |= quarantined.pop(file, None) is not None
+            if entries.get(file) != converted_rule:
+                entries[file] = converted_rule
+                modified = True
+                print(f"Updated: {file}")
+        if cache:
+            cache.flush()
+        if rule_cache:
+            rule_cache.flush()
+        if quarantine and quarantine_modified:
+            with AtomicRuleWriter(quarantine) as writer:
+                for file in watcher.files:
+                    if file in quarantined:
+                        writer.write(quarantined[file])
+            print(f"{writer.count} queries quarantined in {quarantine}")
+        if not modified:
             continue
+        with AtomicRuleWriter(output_file) as writer:
+            for file in watcher.files:
+                if file in entries:
+                    writer.write(entries[file])
+        print(f"{writer.count} queries written to {output_file}")
+
+
+# backends of the current server process, keyed by (backend, pipeline, output format). Backends preloaded by
+# the serve command are built before the worker pool starts, so forked workers inherit them ready to use
+_server_backends = {}
+
+
+def _server_backend(key):
+    backend = _server_backends.get(key)
+    if backend is None:
+        backend = _server_backends[key] = create_backend(*key)
+    return backend
+
+
+def _init_server_worker(preload):
+    # Ctrl+C stops the server, which then shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for key in preload:
+        _server_backend(key)
+
 
-    return rules
+def _convert_in_server_worker(key, rules, offset=0):
+    # rules are YAML texts or rule dicts sent by a client, anything invalid becomes a failure message
+    backend = _server_backend(key)
+    results = []
+    for index, rule in enumerate(rules, offset):
+        name = f"rule {index}"
+        try:
+            yml = load_yaml(rule) if isinstance(rule, str) else rule
+            if isinstance(yml, dict) and yml.get("title"):
+                name = f"rule {index} ({yml['title']})"
+            results.append(convert_parsed(yml, backend, name))
+        except (SigmaError, YAMLError, TypeError, AttributeError) as e:
+            results.append((None, f"Failed at parsing rule: {name}: {e}"))
+    return results
+
+
+def load_rule_matchers(paths, optimize=True):
+    # compiles every rule into a RuleMatcher for local evaluation. Returns the matchers, the files they came
+    # from and failure messages of the rules that cannot be evaluated
+    from sigma.rule import SigmaRule
+    from custom_sigma.evaluation import RuleMatcher
+    from custom_sigma.pipelines.logrhythm.windows import windows_mappings
+
+    backend = create_backend("logrhythm", optimize=optimize)
+    pipeline = (backend.backend_processing_pipeline + backend.processing_pipeline
+                + backend.output_format_processing_pipeline[backend.default_format])
+    matchers, files, errors = [], [], []
+    for file in paths:
+        try:
+            matchers.append(RuleMatcher(SigmaRule.from_dict(load_rule(file)), pipeline, windows_mappings(),
+                                        optimize))
+            files.append(file)
+        except FileNotFoundError:
+            errors.append(f"Failed at opening file: {file}")
+        except SigmaFeatureNotSupportedByBackendError as e:
+            errors.append(f"Cannot evaluate rule: {file}: {e}")
+        except (SigmaError, YAMLError) as e:
+            errors.append(f"Failed at parsing rule: {file}: {e}")
+    return matchers, files, errors
+
+
+def create_evaluator(matchers):
+    from custom_sigma.evaluation import Evaluator
+    from custom_sigma.pipelines.logrhythm.windows import windows_mappings
+
+    return Evaluator(matchers, windows_mappings())
+
+
+# evaluator of the current worker process, built once by _init_evaluation_worker
+_worker_evaluator = None
+
+
+def _init_evaluation_worker(files, optimize):
+    global _worker_evaluator
+    _worker_evaluator = create_evaluator(load_rule_matchers(files, optimize)[0])
+
+
+def _evaluate_in_worker(items, samples):
+    return _worker_evaluator.evaluate(items, samples)
+
+
+def evaluate_events(batches, files, optimize, jobs, samples=3):
+    # yields (events, skipped, hits) per batch of events, in order. Every worker compiles the rules once and
+    # evaluates whole batches, with a bounded number of batches in flight
+    if jobs <= 1:
+        evaluator = create_evaluator(load_rule_matchers(files, optimize)[0])
+        for batch in batches:
+            yield evaluator.evaluate(batch, samples)
+        return
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_evaluation_worker,
+                             initargs=(files, optimize)) as executor:
+        for batch in batches:
+            pending.append(executor.submit(_evaluate_in_worker, batch, samples))
+            while len(pending) > jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def server_key(value):
+    # backend[:pipeline[:output format]], the same defaults as the convert command
+    backend_name, pipeline_name, output_format = (value.split(":", 2) + ["", ""])[:3]
+    return backend_name.lower(), pipeline_name, output_format or "default"
+
+
+def target_callback(values: List[str]):
+    # backend[:pipeline[:output format]]=destination, like the serve --preload format
+    targets = []
+    for value in values or []:
+        spec, separator, destination = value.partition("=")
+        if not separator or not spec or not destination:
+            raise typer.BadParameter(f"Expected backend[:pipeline[:outputformat]]=destination, got {value}")
+        targets.append((spec, *server_key(spec), destination))
+    return targets
+
+
+def write_targets(paths, targets, jobs, use_cache, cache_size, use_rule_cache, optimize, limits=None, shard=None):
+    # converts every rule for each (label, backend, pipeline, output format, destination) target, writing
+    # each target to its own destination and printing a failure report per target. With a Shard, every
+    # destination gets a shard manifest for merge
+    writers = []
+    try:
+        for label, *_, destination in targets:
+            writers.append(AtomicRuleWriter(output_file_callback(destination)))
+    except (PermissionError, IsADirectoryError, FileNotFoundError) as e:
+        for writer in writers:
+            writer.abort()
+        print(f"Cannot write output to {destination}: {e}")
+        exit()
+
+    keys = [(backend_name, pipeline_name, output_format) for _, backend_name, pipeline_name, output_format, _
+            in targets]
+    backends = [create_backend(*key, optimize=optimize, limits=limits) for key in keys]
+    caches = []
+    if use_cache:
+        caches.append(ConversionCache(CACHE_DIR, backends[0], keys[0][0], keys[0][2],
+                                      max_size=cache_size * 1024 * 1024))
+        caches.extend(caches[0].share(backend, key[0], key[2]) for backend, key in zip(backends[1:], keys[1:]))
+    rule_cache = None
+    if jobs > 1:
+        results = convert_rules_for_targets_parallel(paths, keys, jobs, caches,
+                                                     CACHE_DIR if use_rule_cache else None, optimize=optimize,
+                                                     limits=limits)
+    else:
+        rule_cache = ParsedRuleCache(CACHE_DIR) if use_rule_cache else None
+        results = convert_rules_for_targets(paths, backends, caches, rule_cache)
+
+    total = 0
+    failures = [[] for _ in targets]
+    if shard:
+        from custom_sigma.sharding import ShardManifest
+    manifests = [ShardManifest(shard) if shard else None for _ in targets]
+    try:
+        for file, converted in results:
+            total += 1
+            for writer, errors, manifest, (query, error) in zip(writers, failures, manifests, converted):
+                if error:
+                    errors.append(error)
+                else:
+                    writer.write(query)
+                    if manifest:
+                        manifest.add(file, query)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    finally:
+        for cache in reversed(caches):
+            cache.close()
+        if rule_cache:
+            rule_cache.close()
+
+    for writer, errors, manifest, (label, *_) in zip(writers, failures, manifests, targets):
+        writer.commit()
+        print(f"\n{label}: {total - len(errors)} of {total} rules converted. {len(errors)} failed")
+        for error in errors:
+            print(f"  {error}")
+        print(f"  Output at: {path.join(getcwd(), writer.destination)}")
+        if manifest:
+            manifest.failed = len(errors)
+            manifest.dump(writer.destination)
+    if caches:
+        print(f"{sum(cache.hits for cache in caches)} queries reused from conversion cache")
+
+
+def shard_callback(value: Optional[str]):
+    if value is None:
+        return None
+    from custom_sigma.sharding import parse_shard
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
 
 
 def rule_source_callback(value: str):
-    if path.isdir(value):
+    if path.isdir(value) or is_archive(value):
         return value
     elif path.isdir(path.join(path.dirname(path.abspath(__file__)), value)):
         return path.join(path.dirname(path.abspath(__file__)), value)
@@ -79,10 +698,12 @@ def output_file_callback(value: str):
 
 
 @app.command()
-def convert(rule_source: Annotated[Optional[str], typer.Option("--folder", "-f",
-                                                               help="Source directory where SIGMA rules to be "
-                                                                    "converted are stored. Defaults to current "
-                                                                    "directory\\rules folder")] = path.join(
+def convert(ctx: typer.Context,
+        rule_source: Annotated[Optional[str], typer.Option("--folder", "-f",
+                                                               help="Source directory, .zip/.tar.gz archive "
+                                                                    "or file of the SIGMA rules to be converted. "
+                                                                    "Defaults to current directory\\rules "
+                                                                    "folder")] = path.join(
     path.dirname(path.realpath(__file__)), "rules"),
         output_format: Annotated[Optional[str], typer.Option("--outputformat", "-o",
                                                              help="")] = "default",
@@ -93,46 +714,578 @@ def convert(rule_source: Annotated[Optional[str], typer.Option("--folder", "-f",
                                                              help=f"Specify your pipeline")] = "",
         output_file: Annotated[Optional[str], typer.Option("--destination", "-d",
                                                            help="Default output to rules.conf, in current directory",
-                                                           callback=output_file_callback)] = "rules.conf"):
+                                                           callback=output_file_callback)] = "rules.conf",
+        jobs: Annotated[Optional[int], typer.Option("--jobs", "-j",
+                                                    help="Number of worker processes used for conversion. "
+                                                         "0 uses every available core")] = 1,
+        use_cache: Annotated[Optional[bool], typer.Option("--cache/--no-cache",
+                                                          help="Reuse queries of unchanged rules from the "
+                                                               "conversion cache")] = True,
+        cache_size: Annotated[Optional[int], typer.Option("--cache-size",
+                                                          help="Maximum size of the conversion cache in MB")] = 64,
+        include: Annotated[Optional[List[str]], typer.Option("--include", "-i",
+                                                             help="Only convert rules whose path relative to the "
+                                                                  "source folder matches this glob. Repeatable")] = None,
+        exclude: Annotated[Optional[List[str]], typer.Option("--exclude", "-e",
+                                                             help="Skip rules and folders whose relative path "
+                                                                  "matches this glob. Repeatable")] = None,
+        use_rule_cache: Annotated[Optional[bool], typer.Option("--rule-cache/--no-rule-cache",
+                                                               help="Keep parsed rules in a cache so unchanged "
+                                                                    "files skip YAML parsing")] = False,
+        collection: Annotated[Optional[bool], typer.Option("--collection",
+                                                           help="Convert the rule set as one collection, resolving "
+                                                                "filters and correlation rules and finalizing the "
+                                                                "output format once")] = False,
+        profile: Annotated[Optional[bool], typer.Option("--profile",
+                                                        help="Time every conversion stage per rule and print a "
+                                                             "summary. Runs in a single process without the "
+                                                             "conversion cache")] = False,
+        profile_output: Annotated[Optional[str], typer.Option("--profile-output",
+                                                              help="Write the profile as a Chrome trace JSON "
+                                                                   "file, including summary and per rule "
+                                                                   "data")] = None,
+        optimize: Annotated[Optional[bool], typer.Option("--optimize/--no-optimize",
+                                                         help="Shrink LogRhythm queries by rewriting conditions "
+                                                              "into smaller equivalent ones")] = True,
+        watch: Annotated[Optional[bool], typer.Option("--watch",
+                                                      help="Keep running and reconvert rules when they are "
+                                                           "created, modified or deleted")] = False,
+        debounce: Annotated[Optional[float], typer.Option("--debounce",
+                                                          help="Seconds without changes before a batch of "
+                                                               "changes is reconverted in watch mode")] = 0.5,
+        targets: Annotated[Optional[List[str]], typer.Option("--target", "-t",
+                                                             help="Convert for this target too, as "
+                                                                  "backend[:pipeline[:outputformat]]=destination. "
+                                                                  "Repeatable, rules are parsed once for all "
+                                                                  "targets",
+                                                             callback=target_callback)] = None,
+        max_cost: Annotated[Optional[float], typer.Option("--max-cost",
+                                                          help="Queries with a higher estimated cost are not "
+                                                               "written. The run fails unless --quarantine is "
+                                                               "given")] = None,
+        quarantine: Annotated[Optional[str], typer.Option("--quarantine",
+                                                          help="Write queries above --max-cost to this file "
+                                                               "instead of failing")] = None,
+        cost_report: Annotated[Optional[str], typer.Option("--cost-report",
+                                                           help="Write the estimated cost of every query, "
+                                                                "most expensive first, as JSON")] = None,
+        split: Annotated[Optional[bool], typer.Option("--split",
+                                                      help="Split queries exceeding the query limits of the "
+                                                           "backend into several queries matching the same "
+                                                           "events")] = False,
+        max_length: Annotated[Optional[int], typer.Option("--max-length",
+                                                          help="Maximum query length in characters, implies "
+                                                               "--split")] = None,
+        max_clauses: Annotated[Optional[int], typer.Option("--max-clauses",
+                                                           help="Maximum number of value comparisons per query, "
+                                                                "implies --split")] = None,
+        max_list: Annotated[Optional[int], typer.Option("--max-list",
+                                                        help="Maximum number of values in one field value list, "
+                                                             "implies --split")] = None,
+        consolidate: Annotated[Optional[bool], typer.Option("--consolidate",
+                                                            help="Write one Splunk saved search per logsource, "
+                                                                 "tagging events with the rules they match, "
+                                                                 "instead of one search per rule")] = False,
+        group_size: Annotated[Optional[int], typer.Option("--group-size",
+                                                          help="Maximum number of rules per consolidated "
+                                                               "search")] = 50,
+        lookup_threshold: Annotated[Optional[int], typer.Option("--lookup-threshold",
+                                                                help="Move value lists with at least this many "
+                                                                     "values into Splunk lookup files referenced "
+                                                                     "by the query")] = None,
+        lookup_dir: Annotated[Optional[str], typer.Option("--lookup-dir",
+                                                          help="Directory the lookup files are written "
+                                                               "to")] = "lookups",
+        changeset: Annotated[Optional[str], typer.Option("--changeset",
+                                                         help="Compare the output with the previous run and "
+                                                              "write the added, changed and removed stanzas or "
+                                                              "rules to this JSON file. The destination is not "
+                                                              "rewritten when nothing changed")] = None,
+        supervise: Annotated[Optional[bool], typer.Option("--supervise",
+                                                          help="Convert every rule in a supervised worker "
+                                                               "process. Rules exceeding the time or memory "
+                                                               "limit, or crashing, fail on their own and the "
+                                                               "worker is restarted")] = False,
+        rule_timeout: Annotated[Optional[float], typer.Option("--rule-timeout",
+                                                              help="Seconds a rule may take to convert, implies "
+                                                                   "--supervise",
+                                                              show_default="30")] = None,
+        rule_memory: Annotated[Optional[int], typer.Option("--rule-memory",
+                                                           help="MB a rule may allocate while converting, "
+                                                                "implies --supervise",
+                                                           show_default="1024")] = None,
+        failure_report: Annotated[Optional[str], typer.Option("--failure-report",
+                                                              help="Write the failed rules with the reason "
+                                                                   "they failed as JSON")] = None,
+        shard_spec: Annotated[Optional[str], typer.Option("--shard",
+                                                          help="Only convert shard I of N of the rules, as I/N. "
+                                                               "Shard outputs are combined with the merge "
+                                                               "command",
+                                                          callback=shard_callback)] = None,
+        shard_key: Annotated[Optional[str], typer.Option("--shard-key",
+                                                         help="Assign rules to shards by their path relative to "
+                                                              "the source folder or by their rule id (path, "
+                                                              "id)")] = "path"):
+    analyze_cost = max_cost is not None or quarantine or cost_report
+    if analyze_cost and (targets or collection):
+        print("--max-cost, --quarantine and --cost-report cannot be combined with --target or --collection.")
+        exit()
+    if quarantine and max_cost is None:
+        print("--quarantine requires --max-cost.")
+        exit()
+    limits = None
+    if split or max_length or max_clauses or max_list:
+        from custom_sigma.splitting import QueryLimits
+
+        limits = QueryLimits(max_length, max_clauses, max_list)
+    if consolidate and (targets or collection or watch):
+        print("--consolidate cannot be combined with --target, --collection or --watch.")
+        exit()
+    if consolidate and backend_name.lower() != "splunk":
+        print("--consolidate is only supported by the splunk backend.")
+        exit()
+    lookups = None
+    if lookup_threshold is not None:
+        if backend_name.lower() != "splunk":
+            print("--lookup-threshold is only supported by the splunk backend.")
+            exit()
+        if targets or limits:
+            print("--lookup-threshold cannot be combined with --target or --split.")
+            exit()
+        # cached queries would reference lookup files that are not written again
+        use_cache = False
+        lookups = (lookup_dir, max(lookup_threshold, 1))
+
+    supervise = supervise or rule_timeout is not None or rule_memory is not None
+    if supervise:
+        from custom_sigma.supervisor import MEMORY_LIMIT_SUPPORTED
+
+        if targets or collection or profile or watch:
+            print("--supervise cannot be combined with --target, --collection, --profile or --watch.")
+            exit()
+        if rule_memory is not None and not MEMORY_LIMIT_SUPPORTED:
+            print("--rule-memory is not supported on this platform, rules are converted without a memory limit.")
+            rule_memory = 0
+        rule_timeout = 30 if rule_timeout is None else rule_timeout
+        rule_memory = 1024 if rule_memory is None and MEMORY_LIMIT_SUPPORTED else rule_memory
+
+    if changeset and (targets or watch):
+        print("--changeset cannot be combined with --target or --watch.")
+        exit()
+
+    shard = None
+    if shard_spec:
+        from custom_sigma.sharding import SHARD_KEYS, Shard, ShardManifest, manifest_path
+
+        if collection or consolidate or watch or changeset:
+            print("--shard cannot be combined with --collection, --consolidate, --watch or --changeset.")
+            exit()
+        if shard_key not in SHARD_KEYS:
+            print(f"--shard-key must be one of: {', '.join(SHARD_KEYS)}.")
+            exit()
+        shard = Shard(*shard_spec, rule_source, shard_key)
+
+    if targets:
+        # --backend/--pipeline/--outputformat/--destination form the first target when given explicitly
+        if any(ctx.get_parameter_source(name).name != "DEFAULT"
+               for name in ("backend_name", "pipeline_name", "output_format", "output_file")):
+            spec = f"{backend_name}:{pipeline_name}:{output_format}"
+            targets = [(spec, *server_key(spec), output_file)] + targets
+        if collection or profile or watch:
+            print("--target cannot be combined with --collection, --profile or --watch.")
+            exit()
+        print(f"\nConvert SIGMA rules to {len(targets)} targets: {', '.join(label for label, *_ in targets)}.")
+        try:
+            paths = parse_files(rule_source, path.isdir(rule_source), include or (), exclude or ())
+        except FileNotFoundError:
+            print(f"No .yml files found in specified in directory: {rule_source}")
+            exit()
+        if shard:
+            paths = shard.select(paths)
+        write_targets(paths, targets, jobs or cpu_count() or 1, use_cache, cache_size, use_rule_cache, optimize,
+                      limits, shard)
+        if shard:
+            print(f"Shard {shard.index} of {shard.count}: {len(shard.positions)} of {shard.total} rules.")
+        return
+
     print(f"\nConvert SIGMA rules to {backend_name.capitalize()} queries.")
 
-    # resolving pipeline
-    if backend_name.lower() == "logrhythm":
-        # custom pipeline for logrhythm
-        pipeline = windows.lr_windows_v2()
-    elif pipeline_name:
-        pipeline = SigmAIQPipelineResolver(processing_pipelines=pipeline_name.split()).process_pipelines()
-    else:
-        pipeline = ""
+    # validate the destination before doing any conversion work
+    try:
+        writer = ChangesetWriter(output_file, changeset) if changeset else AtomicRuleWriter(output_file)
+    except PermissionError:
+        print(f"Insufficient permissions to write in {output_file}.")
+        exit()
+    except (IsADirectoryError, FileNotFoundError) as e:
+        print(f"Cannot write output to {output_file}: {e}")
+        exit()
+    costs = None
+    quarantined = None
+    consolidated = None
+    if consolidate:
+        from custom_sigma.consolidation import SearchConsolidator
 
-    # generate backend
-    if backend_name.lower() == "logrhythm":
-        backend = logrhythm_lucene.LogRhythmBackend(pipeline)
-    elif pipeline:
-        backend = SigmAIQBackend(backend=backend_name.lower(),
-                                 processing_pipeline=pipeline,
-                                 output_format=output_format).create_backend()
-    else:
-        backend = SigmAIQBackend(backend=backend_name.lower()).create_backend()
+        consolidated = SearchConsolidator(group_size)
+    if analyze_cost:
+        from custom_sigma.cost import CostReport
+
+        costs = CostReport(max_cost)
+        if quarantine:
+            try:
+                quarantined = AtomicRuleWriter(quarantine)
+            except (PermissionError, IsADirectoryError, FileNotFoundError) as e:
+                writer.abort()
+                print(f"Cannot write quarantined queries to {quarantine}: {e}")
+                exit()
+
+    # the watcher snapshots the rule tree before converting, so edits made during the first conversion are seen
+    watcher = None
+    entries = {}
+    quarantined_entries = {}
+    if watch:
+        if collection or profile:
+            writer.abort()
+            if quarantined:
+                quarantined.abort()
+            print("--watch cannot be combined with --collection or --profile.")
+            exit()
+        if is_archive(rule_source):
+            writer.abort()
+            if quarantined:
+                quarantined.abort()
+            print("--watch cannot watch rules inside an archive.")
+            exit()
+        from custom_sigma.watcher import RuleWatcher
+
+        if path.isdir(rule_source):
+            watcher = RuleWatcher(rule_source, lambda: get_files(rule_source, include or (), exclude or ()),
+                                  debounce=debounce)
+        else:
+            watcher = RuleWatcher(path.dirname(path.abspath(rule_source)),
+                                  lambda: [rule_source] if path.isfile(rule_source) else [], debounce=debounce)
+
+    with writer:
+        backend = create_backend(backend_name, pipeline_name, output_format, optimize, limits, lookups)
+        cache = ConversionCache(CACHE_DIR, backend, backend_name, output_format,
+                                max_size=cache_size * 1024 * 1024) if use_cache else None
+
+        # discover rules from rule source location, conversion starts as soon as the first file is found
+        try:
+            paths = parse_files(rule_source, path.isdir(rule_source), include or (), exclude or ())
+        except FileNotFoundError:
+            print(f"No .yml files found in specified in directory: {rule_source}")
+            exit()
+        manifest = None
+        if shard:
+            paths = shard.select(paths)
+            manifest = ShardManifest(shard)
+
+        if jobs == 0:
+            jobs = cpu_count() or 1
+        rule_cache = None
+        finalized = None
+        supervisor = None
+        profiler = NULL_PROFILER
+        if profile:
+            from sigma.processing.pipeline import ProcessingPipeline
+            from custom_sigma.pipelines.compiled import CompiledProcessingPipeline
+
+            profiler = Profiler()
+            profiler.instrument(ProcessingPipeline, "apply", "pipeline")
+            profiler.instrument(CompiledProcessingPipeline, "apply", "pipeline")
+            rule_cache = ParsedRuleCache(CACHE_DIR) if use_rule_cache else None
+            results = convert_rules(paths, backend, None, rule_cache, profiler)
+            if cache:
+                cache.close()
+                cache = None
+        elif collection:
+            if jobs > 1:
+                print("Collection conversion runs in a single process, --jobs is ignored.")
+            rule_cache = ParsedRuleCache(CACHE_DIR) if use_rule_cache else None
+            results, finalized = convert_collection(paths, backend, output_format, rule_cache)
+            if cache:
+                cache.close()
+                cache = None
+        elif supervise:
+            from custom_sigma.supervisor import RuleSupervisor
+
+            supervisor = RuleSupervisor(jobs, _init_worker,
+                                        (backend_name, pipeline_name, output_format,
+                                         CACHE_DIR if use_rule_cache else None, optimize, limits, lookups),
+                                        _convert_file_in_worker, _close_worker,
+                                        timeout=rule_timeout or None, memory_limit=(rule_memory or 0) * 1024 * 1024)
+            results = convert_rules_supervised(paths, supervisor, cache)
+        elif jobs > 1:
+            results = convert_rules_parallel(paths, backend_name, pipeline_name, output_format, jobs, cache,
+                                             CACHE_DIR if use_rule_cache else None, optimize=optimize,
+                                             limits=limits, lookups=lookups)
+        else:
+            rule_cache = ParsedRuleCache(CACHE_DIR) if use_rule_cache else None
+            results = convert_rules(paths, backend, cache, rule_cache)
+
+        # each query is written as soon as it is converted, collections are written once finalized. Failures are
+        # reported together once the run is done
+        total = 0
+        converted = 0
+        failures = FailureReport()
+        for file, converted_rule, error in results:
+            total += 1
+            if error:
+                failures.add(file, error)
+                if manifest:
+                    manifest.failed += 1
+                continue
+            converted += 1
+            if costs and costs.exceeds(costs.analyze(file, converted_rule)):
+                # expensive queries never reach the destination
+                if quarantined:
+                    quarantined.write(converted_rule)
+                    if watcher:
+                        quarantined_entries[file] = converted_rule
+                continue
+            if consolidated:
+                # rule metadata is read again from the (cached) rule, queries may come from the conversion cache
+                consolidated.add(rule_cache.load(file) if rule_cache else load_rule(file), converted_rule)
+                continue
+            if watcher:
+                entries[file] = converted_rule
+            if not collection:
+                writer.write(converted_rule, path.relpath(file, rule_source) if file != rule_source else file)
+                if manifest:
+                    manifest.add(file, converted_rule)
+        if collection:
+            for item in finalized if isinstance(finalized, list) else [finalized]:
+                writer.write(item)
+        if consolidated:
+            stanzas = consolidated.stanzas()
+            for item in stanzas:
+                writer.write(item)
+        print(f"{converted} of {total} rules converted. {total-converted} failed")
+        failures.report()
+        if supervisor and supervisor.restarts:
+            print(f"{supervisor.restarts} conversion workers restarted.")
+        if failure_report:
+            failures.dump(failure_report)
+            print(f"Failure report written to: {failure_report}")
+        if consolidated:
+            print(f"{consolidated.rules} rules consolidated into {len(stanzas)} saved searches.")
+        if getattr(backend, "optimize", False) and backend.terms_before:
+            print(f"Optimizer reduced {backend.terms_before} terms to {backend.terms_after}.")
+        if profile:
+            profiler.restore()
+            profiler.report()
+            if profile_output:
+                profiler.dump(profile_output)
+                print(f"Profile written to: {profile_output}")
+        if cache:
+            print(f"{cache.hits} rules reused from conversion cache")
+            cache.close()
+        if rule_cache:
+            rule_cache.close()
+        if costs:
+            costs.report()
+            if cost_report:
+                costs.dump(cost_report)
+                print(f"Cost report written to: {cost_report}")
+            over = sum(1 for _, cost in costs.entries if costs.exceeds(cost))
+            if quarantined:
+                quarantined.commit()
+                print(f"{over} queries above the maximum cost quarantined in: {quarantine}")
+            elif over:
+                # leaving the writer with an exception keeps the previous destination in place
+                print(f"{over} queries above the maximum cost of {max_cost:g}, {output_file} was not written.")
+                exit(1)
+
+    print(f"Output at: {path.join(getcwd(), output_file)}")
+    if manifest:
+        manifest.dump(output_file)
+        print(f"Shard {shard.index} of {shard.count}: {len(shard.positions)} of {shard.total} rules. "
+              f"Shard manifest written to: {manifest_path(output_file)}")
+    if changeset:
+        summary = writer.summary
+        print(f"{len(summary['added'])} added, {len(summary['changed'])} changed, {len(summary['removed'])} removed, "
+              f"{summary['unchanged']} unchanged" + ("" if summary["written"] else ", destination left untouched")
+              + f". Changeset written to: {changeset}")
 
-    # digest rules from rule source location
+    if watcher:
+        cache = ConversionCache(CACHE_DIR, backend, backend_name, output_format,
+                                max_size=cache_size * 1024 * 1024) if use_cache else None
+        rule_cache = ParsedRuleCache(CACHE_DIR) if use_rule_cache else None
+        print(f"Watching {watcher.root} for changes ({watcher.mode}), press Ctrl+C to stop.")
+        try:
+            watch_rules(watcher, entries, backend, output_file, cache, rule_cache, costs, quarantine,
+                        quarantined_entries)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            watcher.close()
+            if cache:
+                cache.close()
+            if rule_cache:
+                rule_cache.close()
+
+
+@app.command()
+def merge(outputs: Annotated[List[str], typer.Argument(help="Outputs of every shard of a --shard run, each with "
+                                                             "its shard manifest next to it")],
+          output_file: Annotated[Optional[str], typer.Option("--destination", "-d",
+                                                             help="Default output to rules.conf, in current "
+                                                                  "directory",
+                                                             callback=output_file_callback)] = "rules.conf"):
+    """Combine the outputs of the shards of a --shard run into the output of a run over every rule."""
+    from custom_sigma.sharding import ShardError, merge_shards
+
+    try:
+        items, summary = merge_shards(outputs)
+    except ShardError as e:
+        print(e)
+        exit(1)
+    except FileNotFoundError as e:
+        print(f"Shard output not found: {e.filename}")
+        exit(1)
+    try:
+        writer = AtomicRuleWriter(output_file)
+    except (PermissionError, IsADirectoryError, FileNotFoundError) as e:
+        print(f"Cannot write output to {output_file}: {e}")
+        exit(1)
+    with writer:
+        for item in items:
+            writer.write(item)
+    converted = summary["selected"] - summary["failed"]
+    print(f"Merged {summary['shards']} shards: {converted} of {summary['rules']} rules converted. "
+          f"{summary['failed']} failed")
+    print(f"Output at: {path.join(getcwd(), output_file)}")
+
+
+@app.command()
+def serve(host: Annotated[Optional[str], typer.Option("--host",
+                                                      help="Address to listen on")] = "127.0.0.1",
+          port: Annotated[Optional[int], typer.Option("--port",
+                                                      help="Port to listen on")] = 8470,
+          socket_path: Annotated[Optional[str], typer.Option("--socket",
+                                                             help="Listen on this Unix socket instead of "
+                                                                  "host and port")] = None,
+          jobs: Annotated[Optional[int], typer.Option("--jobs", "-j",
+                                                      help="Number of worker processes converting requests. "
+                                                           "0 uses every available core")] = 0,
+          preload: Annotated[Optional[List[str]], typer.Option("--preload",
+                                                               help="Backend to build before serving, as "
+                                                                    "backend[:pipeline[:outputformat]]. "
+                                                                    "Repeatable")] = None,
+          batch_size: Annotated[Optional[int], typer.Option("--batch-size",
+                                                            help="Rules of a batch request converted per "
+                                                                 "worker task")] = 16,
+          verbose: Annotated[Optional[bool], typer.Option("--verbose",
+                                                          help="Log every request")] = False):
+    from custom_sigma.server import create_server
+
+    if jobs == 0:
+        jobs = cpu_count() or 1
+    keys = [server_key(value) for value in preload or []]
+    for key in keys:
+        _server_backend(key)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_server_worker, initargs=(keys,)) as executor:
+        def convert_request(backend_name, pipeline_name, output_format, rules):
+            # batches are split so their rules are converted by several workers at once
+            key = (backend_name.lower(), pipeline_name, output_format)
+            futures = [executor.submit(_convert_in_server_worker, key, rules[start:start + batch_size], start)
+                       for start in range(0, len(rules), batch_size)]
+            return [result for future in futures for result in future.result()]
+
+        try:
+            server = create_server(convert_request, jobs, host, port, socket_path, verbose)
+        except OSError as e:
+            print(f"Cannot listen on {socket_path or f'{host}:{port}'}: {e}")
+            exit()
+        print(f"Serving conversions on {socket_path or f'http://{host}:{port}'} with {jobs} workers, "
+              f"press Ctrl+C to stop.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("Stopped serving.")
+        finally:
+            server.server_close()
+
+
+@app.command()
+def evaluate(events: Annotated[List[str], typer.Option("--events", "-E",
+                                                       help="JSONL or CSV export of Windows/Sysmon events. "
+                                                            "Repeatable")],
+             rule_source: Annotated[Optional[str], typer.Option("--folder", "-f",
+                                                                help="Source directory or file of the SIGMA "
+                                                                     "rules to evaluate")] = path.join(
+                 path.dirname(path.realpath(__file__)), "rules"),
+             include: Annotated[Optional[List[str]], typer.Option("--include", "-i",
+                                                                  help="Only evaluate rules whose relative path "
+                                                                       "matches this glob. Repeatable")] = None,
+             exclude: Annotated[Optional[List[str]], typer.Option("--exclude", "-e",
+                                                                  help="Skip rules and folders whose relative "
+                                                                       "path matches this glob. Repeatable")] = None,
+             jobs: Annotated[Optional[int], typer.Option("--jobs", "-j",
+                                                         help="Number of worker processes evaluating events. "
+                                                              "0 uses every available core")] = 1,
+             batch_size: Annotated[Optional[int], typer.Option("--batch-size",
+                                                               help="Events per worker task")] = 5000,
+             samples: Annotated[Optional[int], typer.Option("--samples",
+                                                            help="Matching events kept per rule")] = 3,
+             report_file: Annotated[Optional[str], typer.Option("--output",
+                                                                help="Write hit counts and sample matches "
+                                                                     "per rule as JSON")] = None,
+             optimize: Annotated[Optional[bool], typer.Option("--optimize/--no-optimize",
+                                                              help="Evaluate the optimized conditions the "
+                                                                   "LogRhythm backend converts")] = True):
+    from custom_sigma.evaluation import read_events
+
+    print(f"\nEvaluate SIGMA rules against {len(events)} event files.")
+    for file in events:
+        if not path.isfile(file):
+            print(f"Event file not found: {file}")
+            exit()
     try:
-        paths = parse_files(rule_source, path.isdir(rule_source))
+        paths = list(parse_files(rule_source, path.isdir(rule_source), include or (), exclude or ()))
     except FileNotFoundError:
         print(f"No .yml files found in specified in directory: {rule_source}")
         exit()
 
-    output = convert_rules(paths, backend)
-    print(f"{len(output)} of {len(paths)} rules converted. {len(paths)-len(output)} failed")
+    matchers, files, errors = load_rule_matchers(paths, optimize)
+    for error in errors:
+        print(error)
+    print(f"{len(files)} of {len(paths)} rules compiled. {len(errors)} failed")
 
-    with open(output_file, "w", encoding="utf-8") as file:
-        try:
-            for item in output:
-                file.write(item + "\n")
-        except PermissionError:
-            print(f"Insufficient permissions to write in {output_file}.")
-    print(f"Output at: {path.join(getcwd(), output_file)}")
+    if jobs == 0:
+        jobs = cpu_count() or 1
+    total = skipped = 0
+    counts = [0] * len(files)
+    found = [[] for _ in files]
+    batches = (batch for file in events for batch in read_events(file, batch_size))
+    for batch_events, batch_skipped, hits in evaluate_events(batches, files, optimize, jobs, samples):
+        total += batch_events
+        skipped += batch_skipped
+        for index, (count, matched) in hits.items():
+            counts[index] += count
+            found[index].extend(matched[:samples - len(found[index])])
+
+    print(f"{total} events evaluated." + (f" {skipped} lines skipped, not JSON objects." if skipped else ""))
+    ranked = sorted(range(len(files)), key=lambda index: -counts[index])
+    for index in ranked:
+        if counts[index]:
+            print(f"{counts[index]:>10}  {matchers[index].title}  ({files[index]})")
+    print(f"{sum(1 for count in counts if count)} rules matched, {sum(1 for count in counts if not count)} "
+          f"without hits.")
+
+    if report_file:
+        report = [{"file": files[index], "title": matchers[index].title, "id": matchers[index].id,
+                   "hits": counts[index], "samples": found[index]} for index in ranked]
+        with AtomicRuleWriter(report_file) as writer:
+            writer.write(json.dumps({"events": total, "skipped": skipped, "rules": report, "failed": errors},
+                                    indent=2))
+        print(f"Report at: {path.join(getcwd(), report_file)}")
 
 
 if __name__ == "__main__":
+    # convert is the default command, so `sigma_convert.py -f rules` keeps working next to the other commands
+    commands = {command.name or command.callback.__name__ for command in app.registered_commands}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands | {"--help", "--install-completion", "--show-completion"}:
+        sys.argv.insert(1, "convert")
     app()
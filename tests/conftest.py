@@ -0,0 +1,27 @@
+import shutil
+import sys
+from os import path
+
+import pytest
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import CorpusShape, write_corpus  # noqa: E402
+from sigma_convert import get_files  # noqa: E402
+
+RULES = path.join(path.dirname(path.abspath(__file__)), "rules")
+
+
+@pytest.fixture(scope="session")
+def rule_source(tmp_path_factory):
+    """Folder with the SigmaHQ style rules of tests/rules and a small synthetic corpus."""
+    directory = str(tmp_path_factory.mktemp("rules"))
+    shutil.copytree(RULES, directory, dirs_exist_ok=True)
+    write_corpus(CorpusShape(rules=60, seed=7), path.join(directory, "synthetic"))
+    return directory
+
+
+@pytest.fixture(scope="session")
+def rule_files(rule_source):
+    return list(get_files(rule_source))
@@ -0,0 +1,83 @@
+import shutil
+import tarfile
+import zipfile
+from os import path
+
+import pytest
+
+from custom_sigma.archive import ZipRuleArchive, archive_files, open_archive
+from sigma_convert import convert_rules, create_backend, get_files, parse_files
+
+RULE = b"title: Whoami\ndetection:\n  selection:\n    Image|endswith: \\whoami.exe\n  condition: selection\n"
+
+
+@pytest.fixture
+def archives():
+    # archives are opened once per process, a later test may write another archive at the same path
+    yield
+    open_archive.cache_clear()
+
+
+def write_zip(file):
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("whoami.yml", RULE)
+    with zipfile.ZipFile(file) as archive:
+        return archive.getinfo("whoami.yml").header_offset
+
+
+def corrupt(file, offset, data):
+    with open(file, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def test_zip_members_are_read(tmp_path):
+    file = str(tmp_path / "rules.zip")
+    write_zip(file)
+    assert ZipRuleArchive(file).read("whoami.yml") == RULE
+
+
+def test_bad_crc_is_detected(tmp_path):
+    file = str(tmp_path / "rules.zip")
+    write_zip(file)
+    with open(file, "rb") as f:
+        offset = f.read().index(b"whoami.exe")
+    corrupt(file, offset, b"W")
+    with pytest.raises(zipfile.BadZipFile, match="CRC"):
+        ZipRuleArchive(file).read("whoami.yml")
+
+
+def test_bad_local_header_is_detected(tmp_path):
+    file = str(tmp_path / "rules.zip")
+    corrupt(file, write_zip(file), b"PK\x05\x06")
+    with pytest.raises(zipfile.BadZipFile, match="local file header"):
+        ZipRuleArchive(file).read("whoami.yml")
+
+
+@pytest.mark.parametrize("include,exclude", [
+    ((), ()),
+    (("windows/process_creation/*",), ()),
+    ((), ("windows/process_creation",)),
+    (("*certutil*", "synthetic/*"), ("synthetic/*0.yml",)),
+])
+def test_archive_files_are_filtered_like_get_files(rule_source, tmp_path, archives, include, exclude):
+    archive = shutil.make_archive(str(tmp_path / "rules"), "zip", rule_source)
+    from_folder = [path.relpath(file, rule_source) for file in get_files(rule_source, include, exclude)]
+    from_archive = [path.relpath(file, archive) for file in archive_files(archive, include, exclude)]
+    assert from_folder and from_archive == from_folder
+
+
+@pytest.mark.parametrize("kind", ["zip", "tar.gz"])
+def test_archive_converts_like_folder(rule_source, tmp_path, archives, kind):
+    if kind == "zip":
+        archive = shutil.make_archive(str(tmp_path / "rules"), "zip", rule_source)
+    else:
+        archive = str(tmp_path / "rules.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(rule_source, arcname=".")
+    backend = create_backend("logrhythm")
+    from_folder = [(path.relpath(file, rule_source), query, error is None)
+                   for file, query, error in convert_rules(parse_files(rule_source, True), backend)]
+    from_archive = [(path.relpath(file, archive), query, error is None)
+                    for file, query, error in convert_rules(parse_files(archive, False), backend)]
+    assert from_archive == from_folder
@@ -0,0 +1,56 @@
+import pytest
+
+from custom_sigma.cache import ConversionCache, environment_fingerprint
+from custom_sigma.splitting import QueryLimits
+from sigma_convert import convert_rules, create_backend
+
+# configurations sharing one cache, each one must get its own entries
+CONFIGURATIONS = [
+    ("logrhythm", "", "default", True, None),
+    ("logrhythm", "", "default", False, None),
+    ("logrhythm", "", "ndjson", True, None),
+    ("logrhythm", "", "default", True, QueryLimits(max_list=2)),
+    ("splunk", "splunk_windows", "default", True, None),
+    ("splunk", "windows_sysmon splunk_windows", "default", True, None),
+]
+
+
+def convert(files, backend, cache=None):
+    return [(file, query, error) for file, query, error in convert_rules(files, backend, cache)]
+
+
+def test_cached_conversion_matches_plain_conversion(rule_files, tmp_path):
+    for backend_name, pipeline_name, output_format, optimize, limits in CONFIGURATIONS:
+        backend = create_backend(backend_name, pipeline_name, output_format, optimize, limits)
+        plain = convert(rule_files, backend)
+        converted = sum(1 for _, query, _ in plain if query is not None)
+        for run in range(2):
+            cache = ConversionCache(str(tmp_path), backend, backend_name, output_format)
+            assert convert(rule_files, backend, cache) == plain
+            # nothing is reused from the configurations before, everything from the first run
+            assert cache.hits == (converted if run else 0), (backend_name, pipeline_name, output_format, run)
+            cache.close()
+
+
+def test_edited_rule_is_converted_again(rule_files, tmp_path):
+    backend = create_backend("logrhythm")
+    cache = ConversionCache(str(tmp_path), backend, "logrhythm", "default")
+    file = next(file for file in rule_files if "whoami" in file)
+    key = cache.key_for_file(file)
+    with open(file, "rb") as f:
+        content = f.read()
+    assert cache.key(content.replace(b"whoami.exe", b"quser.exe")) != key
+    assert cache.key(content) == key
+    cache.close()
+
+
+@pytest.mark.parametrize("fingerprint", ["other", environment_fingerprint()])
+def test_environment_change_drops_entries(tmp_path, fingerprint):
+    backend = create_backend("logrhythm")
+    cache = ConversionCache(str(tmp_path), backend, "logrhythm", "default")
+    cache.put(cache.key(b"rule"), "query")
+    cache.flush()
+    cache._invalidate_on_change(fingerprint)
+    kept = fingerprint == environment_fingerprint()
+    assert (cache.get(cache.key(b"rule")) == "query") is kept
+    cache.close()
@@ -0,0 +1,68 @@
+import json
+import shutil
+from os import path
+
+from typer.testing import CliRunner
+
+from custom_sigma.writer import ChangesetWriter
+from sigma_convert import app
+
+
+def write(destination, changeset, stanzas):
+    with ChangesetWriter(destination, changeset) as writer:
+        for name, search in stanzas:
+            writer.write(f"[{name}]\nsearch = {search}\n")
+    return writer.summary
+
+
+def test_changeset_entries(tmp_path):
+    destination, changeset = str(tmp_path / "savedsearches.conf"), str(tmp_path / "changeset.json")
+    write(destination, changeset, [("A", "a"), ("B", "b"), ("C", "c")])
+    summary = write(destination, changeset, [("A", "a"), ("B", "b2"), ("D", "d")])
+    assert (summary["added"], summary["changed"], summary["removed"], summary["unchanged"]) == (["D"], ["B"], ["C"], 1)
+
+    # nothing changed, the destination is left untouched
+    summary = write(destination, changeset, [("A", "a"), ("B", "b2"), ("D", "d")])
+    assert not summary["written"] and summary["unchanged"] == 3
+
+
+def test_changeset_duplicate_names(tmp_path):
+    destination, changeset = str(tmp_path / "savedsearches.conf"), str(tmp_path / "changeset.json")
+    write(destination, changeset, [("A", "a"), ("A", "b")])
+    summary = write(destination, changeset, [("A", "a"), ("A", "b2"), ("A", "c")])
+    assert (summary["added"], summary["changed"], summary["unchanged"]) == (["A #3"], ["A #2"], 1)
+
+
+def test_changeset_matches_conversion(rule_source, tmp_path):
+    # the changeset of a run reports exactly the rules whose query differs from the previous plain conversion
+    source = str(tmp_path / "rules")
+    shutil.copytree(rule_source, source)
+    destination, changeset = str(tmp_path / "queries.txt"), str(tmp_path / "changeset.json")
+    options = ["convert", "-f", source, "-b", "logrhythm", "-j", "1", "--no-cache", "--no-rule-cache"]
+
+    def run(*extra):
+        # answer the prompt to override the existing destination
+        result = CliRunner().invoke(app, options + list(extra), input="y\n")
+        assert result.exit_code == 0, result.output
+
+    run("-d", destination, "--changeset", changeset)
+    with open(changeset, encoding="utf-8") as f:
+        first = json.load(f)
+    assert first["unchanged"] == 0 and not first["changed"] and len(first["added"]) == len(first["entries"])
+
+    edited = path.join("windows", "process_creation", "proc_creation_win_whoami_execution.yml")
+    with open(path.join(source, edited), encoding="utf-8") as f:
+        rule = f.read()
+    with open(path.join(source, edited), "w", encoding="utf-8") as f:
+        f.write(rule.replace("whoami.exe", "quser.exe"))
+    run("-d", destination, "--changeset", changeset)
+    with open(changeset, encoding="utf-8") as f:
+        second = json.load(f)
+    assert second["changed"] == [edited]
+    assert not second["added"] and not second["removed"]
+    assert second["unchanged"] == len(first["entries"]) - 1
+
+    plain = str(tmp_path / "plain.txt")
+    run("-d", plain)
+    with open(destination, encoding="utf-8") as f, open(plain, encoding="utf-8") as g:
+        assert f.read() == g.read()
@@ -0,0 +1,42 @@
+import pytest
+from sigma.exceptions import SigmaError
+from sigma.rule import SigmaRule
+
+from custom_sigma.loader import load_rule
+from custom_sigma.pipelines.logrhythm import windows
+from sigma_convert import create_backend, resolve_pipeline
+
+
+def convert(backend, file):
+    try:
+        return backend.convert_rule(SigmaRule.from_dict(load_rule(file)))
+    except SigmaError as e:
+        return type(e).__name__
+
+
+@pytest.mark.parametrize("pipeline_name", ["splunk_windows", "windows_sysmon splunk_windows",
+                                           "splunk_windows windows_sysmon"])
+def test_compiled_pipeline_matches_plain_pipeline_splunk(rule_files, pipeline_name):
+    from sigmaiq import SigmAIQBackend, SigmAIQPipelineResolver
+
+    plain = SigmAIQBackend(backend="splunk", processing_pipeline=SigmAIQPipelineResolver(
+        processing_pipelines=pipeline_name.split()).process_pipelines()).create_backend()
+    compiled = create_backend("splunk", pipeline_name)
+    for file in rule_files:
+        assert convert(compiled, file) == convert(plain, file), file
+
+
+def test_sysmon_logsource_change_keeps_source(rule_files):
+    # windows_sysmon changes the log source to sysmon, the Splunk items of the new log source must apply
+    backend = create_backend("splunk", "windows_sysmon splunk_windows")
+    query = convert(backend, next(file for file in rule_files if "whoami" in file))
+    assert query[0].startswith('source="WinEventLog:Microsoft-Windows-Sysmon/Operational"')
+
+
+def test_compiled_pipeline_matches_plain_pipeline_logrhythm(rule_files):
+    from custom_sigma.backends.logrhythm import LogRhythmBackend
+
+    plain = LogRhythmBackend(windows.lr_windows_v2(), optimize=False)
+    compiled = LogRhythmBackend(resolve_pipeline("logrhythm"), optimize=False)
+    for file in rule_files:
+        assert convert(compiled, file) == convert(plain, file), file
@@ -0,0 +1,35 @@
+from custom_sigma.consolidation import SearchConsolidator, eval_string
+
+
+def rule(rule_id, title, level, image):
+    return {"id": rule_id, "title": title, "level": level,
+            "logsource": {"product": "windows", "category": "process_creation"},
+            "query": f'Image="*\\\\{image}"'}
+
+
+def consolidate(rules):
+    consolidator = SearchConsolidator()
+    for item in rules:
+        consolidator.add(item, item["query"])
+    stanzas = consolidator.stanzas()
+    assert len(stanzas) == 1
+    return stanzas[0]
+
+
+def test_consolidated_rules_keep_their_metadata():
+    rules = [rule("id-1", "Suspicious Child", "low", "whoami.exe"),
+             rule("id-2", "Suspicious Child", "high", "quser.exe"),
+             rule("", "Suspicious Child", "medium", "net.exe")]
+    search = consolidate(rules)
+    # every rule is tagged with its own key, and its level is looked up by that key, not by the shared title
+    for item, key in zip(rules, ("id-1", "id-2", "Suspicious Child")):
+        assert f"if(searchmatch({eval_string(item['query'])}), {eval_string(key)}, null())" in search
+        assert f"sigma_id=={eval_string(key)}, {eval_string(item['level'])}" in search
+
+
+def test_duplicate_ids_are_tagged_by_occurrence():
+    rules = [rule("id-1", "First", "low", "whoami.exe"), rule("id-1", "Second", "high", "quser.exe")]
+    search = consolidate(rules)
+    assert 'sigma_id=="id-1", "First"' in search and 'sigma_id=="id-1 #2", "Second"' in search
+    assert 'sigma_id=="id-1", "low"' in search and 'sigma_id=="id-1 #2", "high"' in search
+    assert "Consolidated search of 2 rules: First, Second" in search
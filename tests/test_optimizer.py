@@ -0,0 +1,87 @@
+import random
+
+from sigma.conditions import ConditionFieldEqualsValueExpression, ConditionItem, ConditionValueExpression
+from sigma.exceptions import SigmaError
+from sigma.rule import SigmaRule
+from sigma.types import SigmaString, SpecialChars
+
+from custom_sigma.backends.logrhythm.optimizer import count_terms, optimize_condition
+from custom_sigma.evaluation import Event, compile_condition
+from custom_sigma.loader import load_rule
+from sigma_convert import create_backend
+
+KEYWORDS = "message"
+
+
+def leaves(cond):
+    if isinstance(cond, ConditionItem):
+        for arg in cond.args:
+            yield from leaves(arg)
+    elif isinstance(cond, (ConditionFieldEqualsValueExpression, ConditionValueExpression)):
+        yield cond
+
+
+def samples(value: SigmaString):
+    # strings matched by a value with its wildcards filled in different ways, their case variants and near misses
+    found = []
+    for filler in ("", "x", "urlcache "):
+        text = "".join(part if isinstance(part, str) else filler if part == SpecialChars.WILDCARD_MULTI else "q"
+                       for part in value.s if isinstance(part, (str, SpecialChars)))
+        found.extend([text, text.upper(), text[1:], text[:-1]])
+    return found
+
+
+def probe_events(trees, rng):
+    """Events setting one sample value at a time, the other fields of the rule get a random sample of their own."""
+    pool = {}
+    for tree in trees:
+        for leaf in leaves(tree):
+            if isinstance(leaf.value, SigmaString):
+                pool.setdefault(getattr(leaf, "field", None) or KEYWORDS, []).extend(samples(leaf.value))
+    everything = [text for texts in pool.values() for text in texts]
+    for field, texts in pool.items():
+        for text in texts + rng.sample(everything, min(len(everything), 10)):
+            raw = {name: rng.choice(values) for name, values in pool.items() if rng.random() < 0.9}
+            raw[field] = text
+            yield raw
+
+
+def converted_trees(backend, file):
+    pipeline = (backend.backend_processing_pipeline + backend.processing_pipeline
+                + backend.output_format_processing_pipeline[backend.default_format])
+    rule = SigmaRule.from_dict(load_rule(file))
+    pipeline.apply(rule)
+    return [condition.parsed for condition in rule.detection.parsed_condition]
+
+
+def test_optimized_conditions_match_the_same_events(rule_files):
+    backend = create_backend("logrhythm", optimize=False)
+    rng = random.Random(11)
+    terms_before = terms_after = matched = 0
+    for file in rule_files:
+        try:
+            plain = converted_trees(backend, file)
+            optimized = [optimize_condition(tree) for tree in converted_trees(backend, file)]
+            plain_match = [compile_condition(tree) for tree in plain]
+            optimized_match = [compile_condition(tree) for tree in optimized]
+        except SigmaError:
+            continue
+        terms_before += sum(count_terms(tree) for tree in plain)
+        terms_after += sum(count_terms(tree) for tree in optimized)
+        for raw in probe_events(plain, rng):
+            event = Event(raw)
+            expected = [match(event) for match in plain_match]
+            assert [match(event) for match in optimized_match] == expected, (file, raw)
+            matched += any(expected)
+    # the corpus exercises the optimizer and the probe events hit the rules
+    assert terms_after < terms_before and matched
+
+
+def test_covered_values_are_dropped(rule_files):
+    file = next(file for file in rule_files if "certutil" in file)
+    backend = create_backend("logrhythm")
+    query = backend.convert_rule(SigmaRule.from_dict(load_rule(file)))[0]
+    # "* -urlcache *" and "*/urlcache *" are covered by "*urlcache *", the full path by "*\\certutil.exe"
+    assert "urlcache *" in query and "-urlcache *" not in query and "/urlcache" not in query
+    assert "System32" not in query
+    assert backend.terms_after < backend.terms_before
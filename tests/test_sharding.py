@@ -0,0 +1,39 @@
+import pytest
+from typer.testing import CliRunner
+
+from sigma_convert import app
+
+
+def run(*options):
+    result = CliRunner().invoke(app, list(options))
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def read(file):
+    with open(file, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("backend,shard_key", [("logrhythm", "path"), ("logrhythm", "id"), ("splunk", "path")])
+def test_merged_shards_equal_a_single_run(rule_source, tmp_path, backend, shard_key):
+    options = ["-f", rule_source, "-b", backend, "-j", "1", "--no-cache", "--no-rule-cache"]
+    whole = str(tmp_path / "whole.conf")
+    run("convert", *options, "-d", whole)
+    shards = [str(tmp_path / f"shard{index}.conf") for index in range(1, 4)]
+    for index, shard in enumerate(shards, 1):
+        run("convert", *options, "--shard", f"{index}/3", "--shard-key", shard_key, "-d", shard)
+    assert all(0 < len(read(shard)) < len(read(whole)) for shard in shards)
+    # shards are merged in any order
+    merged = str(tmp_path / "merged.conf")
+    run("merge", *reversed(shards), "-d", merged)
+    assert read(merged) == read(whole)
+
+
+def test_merge_requires_every_shard(rule_source, tmp_path):
+    shards = [str(tmp_path / f"shard{index}.conf") for index in range(1, 3)]
+    for index, shard in enumerate(shards, 1):
+        run("convert", "-f", rule_source, "-b", "logrhythm", "-j", "1", "--no-cache", "--shard", f"{index}/3",
+            "-d", shard)
+    result = CliRunner().invoke(app, ["merge", *shards, "-d", str(tmp_path / "merged.conf")])
+    assert result.exit_code == 1
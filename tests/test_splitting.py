@@ -0,0 +1,106 @@
+import itertools
+import json
+import subprocess
+import sys
+
+import pytest
+from sigma.rule import SigmaRule
+
+from custom_sigma.loader import load_rule
+from custom_sigma.splitting import QueryLimits
+from sigma_convert import convert_sigma_rule, create_backend
+from conftest import ROOT
+
+RULE = {
+    "title": "Reconnaissance Tools",
+    "id": "5d9f6b2e-0c0a-4d8e-9a53-0a4c1b6f7e21",
+    "logsource": {"product": "windows", "category": "process_creation"},
+    "detection": {
+        "selection": {"Image|endswith": [f"\\tool{number}.exe" for number in range(6)]},
+        "condition": "selection",
+    },
+    "level": "medium",
+}
+
+
+def convert(backend):
+    query, error = convert_sigma_rule(SigmaRule.from_dict(RULE), backend, RULE["title"])
+    assert error is None
+    return query.split("\n")
+
+
+def test_split_parts_keep_the_logrhythm_output_format():
+    backend = create_backend("logrhythm", output_format="ndjson", limits=QueryLimits(max_list=2))
+    parts = convert(backend)
+    assert len(parts) == 3
+    assert [json.loads(part)["title"] for part in parts] == [f"{RULE['title']} (part {number} of 3)"
+                                                              for number in range(1, 4)]
+
+
+def test_split_splunk_queries():
+    backend = create_backend("splunk", "splunk_windows", limits=QueryLimits(max_list=2))
+    parts = convert(backend)
+    assert len(parts) == 3
+    assert all(sum(f"tool{number}.exe" in part for number in range(6)) == 2 for part in parts)
+
+
+def test_splitting_does_not_import_the_logrhythm_backend():
+    code = ("import sys; import custom_sigma.splitting; "
+            "sys.exit('custom_sigma.backends.logrhythm.logrhythm_lucene' in sys.modules)")
+    assert subprocess.run([sys.executable, "-c", code], cwd=ROOT).returncode == 0
+
+
+def test_parts_over_the_list_limit_are_shortened():
+    # the estimate packs both selections in one part, which is over the list limit and must be shortened
+    rule = {
+        "title": "Reconnaissance By System",
+        "logsource": {"product": "windows", "category": "process_creation"},
+        "detection": {
+            "selection_image": {"Image|endswith": ["\\a.exe", "\\b.exe", "\\c.exe"], "User": "SYSTEM"},
+            "selection_command": {"CommandLine|contains": ["x", "y", "z"], "User": "SYSTEM"},
+            "condition": "1 of selection_*",
+        },
+    }
+    backend = create_backend("logrhythm", limits=QueryLimits(max_list=2))
+    query, error = convert_sigma_rule(SigmaRule.from_dict(rule), backend, rule["title"])
+    assert error is None and len(query.split("\n")) == 4
+
+
+def test_the_group_over_the_limit_is_split(rule_files):
+    # after the optimizer, the Image/OriginalFileName group has as many terms as the CommandLine list, only the
+    # list is over the limit
+    file = next(file for file in rule_files if "powershell_encoded" in file)
+    backend = create_backend("logrhythm", limits=QueryLimits(max_list=2))
+    query, error = convert_sigma_rule(SigmaRule.from_dict(load_rule(file)), backend, file)
+    assert error is None
+    parts = query.split("\n")
+    assert len(parts) == 2
+    assert ["-e *" in part and "-en *" in part for part in parts] == [True, False]
+    assert ["-enc *" in part and "-encodedcommand *" in part for part in parts] == [False, True]
+    assert all("powershell.exe" in part and "pwsh.dll" in part for part in parts)
+
+
+@pytest.mark.parametrize("backend_name,pipeline_name", [("logrhythm", ""), ("splunk", "splunk_windows")])
+def test_every_group_over_the_limit_is_split(backend_name, pipeline_name):
+    images = [f"\\tool{number}.exe" for number in range(3)]
+    commands = [f"option{number}" for number in range(3)]
+    rule = {
+        "title": "Tools With Options",
+        "logsource": {"product": "windows", "category": "process_creation"},
+        "detection": {
+            "selection_image": {"Image|endswith": images},
+            "selection_command": {"CommandLine|contains": commands},
+            "condition": "selection_image and selection_command",
+        },
+    }
+    backend = create_backend(backend_name, pipeline_name, limits=QueryLimits(max_list=2))
+    query, error = convert_sigma_rule(SigmaRule.from_dict(rule), backend, rule["title"])
+    assert error is None
+    parts = query.split("\n")
+    # the parts are the combinations of the chunks of both lists, every pair of values is in exactly one part
+    assert len(parts) == 4
+    for part in parts:
+        assert sum(f"tool{number}.exe" in part for number in range(3)) <= 2
+        assert sum(f"option{number}" in part for number in range(3)) <= 2
+    for image, command in itertools.product(range(3), range(3)):
+        assert sum(f"tool{image}.exe" in part and f"option{command}" in part for part in parts) == 1
@@ -0,0 +1,56 @@
+import shutil
+
+import yaml
+
+from custom_sigma.cost import CostReport, analyze_query
+from sigma_convert import convert_rules, create_backend, watch_rules
+
+
+class ReplayWatcher:
+    """Watcher replaying a fixed list of (changed, deleted) batches."""
+
+    def __init__(self, files, batches):
+        self.files = files
+        self.batches = batches
+
+    def changes(self):
+        yield from self.batches
+
+
+def read(file):
+    with open(file, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_watched_rules_above_the_maximum_cost_never_reach_the_destination(rule_files, tmp_path):
+    backend = create_backend("logrhythm")
+    files = []
+    for name in ("whoami", "powershell_encoded"):
+        files.append(str(tmp_path / f"{name}.yml"))
+        shutil.copy(next(file for file in rule_files if name in file), files[-1])
+    entries = {file: query for file, query, _ in convert_rules(files, backend)}
+    cheap = entries[files[0]]
+
+    # the edited rule matches any command line containing one of many words, with leading wildcards
+    with open(files[0], encoding="utf-8") as f:
+        rule = yaml.safe_load(f)
+    rule["detection"]["selection"] = {"CommandLine|contains": [f"word{number}" for number in range(40)]}
+    with open(files[0], "w", encoding="utf-8") as f:
+        yaml.safe_dump(rule, f)
+    expensive = next(convert_rules(files[:1], backend))[1]
+    max_cost = analyze_query(cheap).score + 1
+    assert analyze_query(expensive).score > max_cost
+
+    destination, quarantine = str(tmp_path / "rules.conf"), str(tmp_path / "expensive.conf")
+    quarantined = {}
+    watch_rules(ReplayWatcher(files, [(files[:1], [])]), entries, backend, destination, costs=CostReport(max_cost),
+                quarantine=quarantine, quarantined=quarantined)
+    assert read(destination) == [entries[files[1]]]
+    assert read(quarantine) == [expensive] and files[0] not in entries
+
+    # reverted, the rule leaves the quarantine and is written again
+    shutil.copy(next(file for file in rule_files if "whoami" in file), files[0])
+    watch_rules(ReplayWatcher(files, [(files[:1], [])]), entries, backend, destination, costs=CostReport(max_cost),
+                quarantine=quarantine, quarantined=quarantined)
+    assert read(destination) == [cheap, entries[files[1]]]
+    assert read(quarantine) == []